@@ -14,7 +14,7 @@ import TopBar from "@/components/TopBar";
 import { SkeletonRows, EmptyState } from "@/components/ui";
 import { api } from "@/lib/api";
 import { cn, formatDate, formatTime } from "@/lib/utils";
-import type { LoginLogEntry, PaginatedResponse } from "@/lib/types";
+import type { LoginLogEntry, CursorPage } from "@/lib/types";
 import { useToast } from "@/providers/ToastProvider";
 
 export default function LogsPage() {
@@ -22,44 +22,53 @@ export default function LogsPage() {
   const searchParams = useSearchParams();
   const { error: showError } = useToast();
 
-  const page = parseInt(searchParams.get("page") || "1", 10);
+  const cursor = searchParams.get("cursor") || "";
+  const direction = searchParams.get("direction") || "next";
   const logType = searchParams.get("type") || "all";
 
   const [logs, setLogs] = useState<LoginLogEntry[]>([]);
-  const [totalPages, setTotalPages] = useState(1);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [prevCursor, setPrevCursor] = useState<string | null>(null);
   const [total, setTotal] = useState(0);
+  const [totalApproximate, setTotalApproximate] = useState(false);
   const [loading, setLoading] = useState(true);
 
   const loadLogs = useCallback(async () => {
     setLoading(true);
     try {
-      const data = await api.get<PaginatedResponse<LoginLogEntry>>(
+      const params: Record<string, string> = { type: logType };
+      if (cursor) {
+        params.cursor = cursor;
+        params.direction = direction;
+      }
+      const data = await api.get<CursorPage<LoginLogEntry>>(
         "/admin/logs",
-        {
-          page: String(page),
-          type: logType,
-        },
+        params,
       );
       setLogs(data.items || []);
-      setTotalPages(data.total_pages || 1);
+      setNextCursor(data.next_cursor);
+      setPrevCursor(data.prev_cursor);
       setTotal(data.total || 0);
+      setTotalApproximate(data.total_approximate);
     } catch {
       showError("Failed to load logs");
     } finally {
       setLoading(false);
     }
-  }, [page, logType, showError]);
+  }, [cursor, direction, logType, showError]);
 
   useEffect(() => {
     loadLogs();
   }, [loadLogs]);
 
   function setFilter(type: string) {
-    router.push(`/admin/logs?type=${type}&page=1`);
+    router.push(`/admin/logs?type=${type}`);
   }
 
-  function goPage(p: number) {
-    router.push(`/admin/logs?type=${logType}&page=${p}`);
+  function goCursor(c: string, dir: "next" | "prev") {
+    router.push(
+      `/admin/logs?type=${logType}&cursor=${encodeURIComponent(c)}&direction=${dir}`,
+    );
   }
 
   const filters = [
@@ -167,51 +176,27 @@ export default function LogsPage() {
                 </tbody>
               </table>
 
-              {/* Pagination */}
-              {totalPages > 1 && (
+              {/* Pagination (keyset: newer / older) */}
+              {(nextCursor || prevCursor) && (
                 <div className="flex items-center justify-between px-5 py-3 border-t border-surface-200 bg-brand-900/30">
                   <span className="text-xs text-brand-400">
-                    Page {page} of {totalPages} · {total} entries
+                    {total}
+                    {totalApproximate ? "+" : ""} entries
                   </span>
                   <div className="flex items-center gap-1">
                     <button
-                      onClick={() => goPage(page - 1)}
-                      disabled={page <= 1}
+                      onClick={() => prevCursor && goCursor(prevCursor, "prev")}
+                      disabled={!prevCursor}
                       className="btn btn-ghost btn-icon btn-sm disabled:opacity-30"
+                      title="Newer"
                     >
                       <ChevronLeft className="w-4 h-4" />
                     </button>
-                    {/* Page numbers */}
-                    {Array.from({ length: Math.min(5, totalPages) }, (_, i) => {
-                      let p: number;
-                      if (totalPages <= 5) {
-                        p = i + 1;
-                      } else if (page <= 3) {
-                        p = i + 1;
-                      } else if (page >= totalPages - 2) {
-                        p = totalPages - 4 + i;
-                      } else {
-                        p = page - 2 + i;
-                      }
-                      return (
-                        <button
-                          key={p}
-                          onClick={() => goPage(p)}
-                          className={cn(
-                            "w-8 h-8 rounded-lg text-xs font-medium transition-colors",
-                            page === p
-                              ? "bg-white text-brand-900"
-                              : "text-brand-300 hover:bg-surface-50",
-                          )}
-                        >
-                          {p}
-                        </button>
-                      );
-                    })}
                     <button
-                      onClick={() => goPage(page + 1)}
-                      disabled={page >= totalPages}
+                      onClick={() => nextCursor && goCursor(nextCursor, "next")}
+                      disabled={!nextCursor}
                       className="btn btn-ghost btn-icon btn-sm disabled:opacity-30"
+                      title="Older"
                     >
                       <ChevronRight className="w-4 h-4" />
                     </button>
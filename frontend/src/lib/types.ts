@@ -231,6 +231,15 @@ export interface PaginatedResponse<T> {
   total_pages: number;
 }
 
+export interface CursorPage<T> {
+  items: T[];
+  next_cursor: string | null;
+  prev_cursor: string | null;
+  total: number;
+  total_approximate: boolean;
+  per_page: number;
+}
+
 // ── API ───────────────────────────────────────────────────────────────────
 export interface ApiError {
   error: string;
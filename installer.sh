@@ -323,9 +323,101 @@ CREATE TABLE IF NOT EXISTS login_log (
     user_agent TEXT,
     success BOOLEAN,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX ix_login_log_created (created_at, id),
+    INDEX ix_login_log_success_created (success, created_at, id),
+    INDEX ix_login_log_email_created (email, created_at, id),
+    INDEX ix_login_log_ip_created (ip_address, created_at, id),
     FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE SET NULL
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
 
+-- Daily login rollups, filled incrementally from login_log
+CREATE TABLE IF NOT EXISTS login_stats_domain_daily (
+    day DATE NOT NULL,
+    domain VARCHAR(255) NOT NULL,
+    success INT NOT NULL DEFAULT 0,
+    failure INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, domain)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS login_stats_account_daily (
+    email VARCHAR(255) NOT NULL,
+    day DATE NOT NULL,
+    domain VARCHAR(255) NOT NULL,
+    success INT NOT NULL DEFAULT 0,
+    failure INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (email, day),
+    INDEX ix_login_stats_account_daily_domain (domain)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS login_rollup_state (
+    name VARCHAR(64) PRIMARY KEY,
+    last_id INT NOT NULL DEFAULT 0,
+    updated_at DATETIME
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Measured mailbox sizes (filled by flask usage-scan)
+CREATE TABLE IF NOT EXISTS mailbox_usage (
+    account_id INT PRIMARY KEY,
+    domain_id INT NOT NULL,
+    bytes BIGINT NOT NULL DEFAULT 0,
+    messages INT NOT NULL DEFAULT 0,
+    source VARCHAR(16),
+    scan_state TEXT,
+    scanned_at DATETIME,
+    INDEX ix_mailbox_usage_domain_id (domain_id),
+    FOREIGN KEY (account_id) REFERENCES accounts(id) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Queued maildir provisioning (worked by promail-maildirs.service)
+CREATE TABLE IF NOT EXISTS maildir_tasks (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    email VARCHAR(255) NOT NULL,
+    action VARCHAR(16) NOT NULL,
+    status VARCHAR(16) NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    next_attempt_at DATETIME,
+    created_at DATETIME,
+    updated_at DATETIME,
+    INDEX ix_maildir_tasks_email (email),
+    INDEX ix_maildir_tasks_status_next (status, next_attempt_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Bulk account import jobs (running is 1 for the one live import, NULL otherwise)
+CREATE TABLE IF NOT EXISTS import_jobs (
+    id VARCHAR(32) PRIMARY KEY,
+    status VARCHAR(16) NOT NULL,
+    running TINYINT(1) NULL,
+    progress MEDIUMTEXT NOT NULL,
+    error TEXT,
+    created_at DATETIME,
+    updated_at DATETIME,
+    UNIQUE KEY uq_import_jobs_running (running),
+    INDEX ix_import_jobs_updated_at (updated_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Issued API tokens (session registry / revocation list)
+CREATE TABLE IF NOT EXISTS api_sessions (
+    jti VARCHAR(32) PRIMARY KEY,
+    account_id INT NOT NULL,
+    ip_address VARCHAR(45),
+    user_agent VARCHAR(500),
+    created_at DATETIME,
+    expires_at DATETIME NOT NULL,
+    revoked_at DATETIME NULL,
+    INDEX idx_api_sessions_account (account_id),
+    INDEX idx_api_sessions_expires (expires_at),
+    INDEX ix_api_sessions_revoked_at (revoked_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- Server-side web sessions (used when Redis isn't configured)
+CREATE TABLE IF NOT EXISTS web_sessions (
+    sid VARCHAR(128) PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at DATETIME NOT NULL,
+    INDEX idx_web_sessions_expires (expires_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
 -- System settings
 CREATE TABLE IF NOT EXISTS settings (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -612,6 +704,13 @@ debug_log_path = /var/log/dovecot-debug.log
 mail_location = maildir:/var/vmail/%d/%n/Maildir
 mail_privileged_group = vmail
 
+# Quota (rule comes from the userdb); the maildir backend keeps a maildirsize
+# file per mailbox, which the webmail usage scanner reads
+mail_plugins = \$mail_plugins quota
+plugin {
+    quota = maildir:User quota
+}
+
 # Authentication
 auth_mechanisms = plain login
 disable_plaintext_auth = yes
@@ -694,7 +793,7 @@ protocol lmtp {
 }
 
 protocol imap {
-    mail_plugins = \$mail_plugins
+    mail_plugins = \$mail_plugins imap_quota
     mail_max_userip_connections = 20
 }
 
@@ -756,6 +855,26 @@ if header :contains "X-Spam-Flag" "YES" {
 EOF
     sievec /var/vmail/sieve-before.d/spam.sieve 2>/dev/null || true
 
+    # Logs readable by the adm group (the webmail admin log viewer runs in it)
+    touch /var/log/dovecot.log /var/log/dovecot-info.log /var/log/dovecot-debug.log
+    chown root:adm /var/log/dovecot.log /var/log/dovecot-info.log /var/log/dovecot-debug.log
+    chmod 640 /var/log/dovecot.log /var/log/dovecot-info.log /var/log/dovecot-debug.log
+    cat > /etc/logrotate.d/promail-dovecot <<'EOF'
+/var/log/dovecot.log /var/log/dovecot-info.log /var/log/dovecot-debug.log {
+    weekly
+    rotate 8
+    missingok
+    notifempty
+    compress
+    delaycompress
+    create 0640 root adm
+    sharedscripts
+    postrotate
+        doveadm log reopen >/dev/null 2>&1 || true
+    endscript
+}
+EOF
+
     log_info "Dovecot configured"
 }
 
@@ -1006,12 +1125,14 @@ setup_webmail() {
     # Create production config
     SECRET_KEY=$(python3 -c "import secrets; print(secrets.token_hex(32))")
     JWT_SECRET=$(python3 -c "import secrets; print(secrets.token_hex(32))")
+    FERNET_KEY=$(python3 -c "import base64, os; print(base64.urlsafe_b64encode(os.urandom(32)).decode())")
 
     cat > "$CONFIG_DIR/production.env" <<EOF
 # ProMail Production Configuration
 FLASK_ENV=production
 SECRET_KEY=${SECRET_KEY}
 JWT_SECRET_KEY=${JWT_SECRET}
+FERNET_KEY=${FERNET_KEY}
 
 # Database
 DB_HOST=127.0.0.1
@@ -1037,9 +1158,52 @@ CSRF_ENABLED=true
 # Limits
 MAX_ATTACHMENT_SIZE=26214400
 MAX_RECIPIENTS=50
+
+# Maildirs are created by promail-maildirs.service (it can chown to vmail)
+MAILDIR_ROOT=/var/vmail
+MAILDIR_WORKER=external
+
+# Per-worker Prometheus files; /run/promail is the api unit's RuntimeDirectory
+METRICS_DIR=/run/promail/metrics
+# bcrypt queue slots shared by all API workers
+BCRYPT_SLOT_DIR=/run/promail/bcrypt
+# Request coalescing across API workers (locks and short-lived results)
+SINGLEFLIGHT_DIR=/run/promail/singleflight
 EOF
 
     chmod 600 "$CONFIG_DIR/production.env"
+
+    # Schema changes run once here, not on every worker boot
+    (cd "$WEBMAIL_DIR" && "$VENV_DIR/bin/flask" --app app migrate)
+
+    # Login log rollups every few minutes; archive rotation and retention nightly
+    cat > /etc/cron.d/promail-loginlog << EOF
+*/5 * * * * www-data cd $WEBMAIL_DIR && $VENV_DIR/bin/flask --app app loginlog-rollup >/dev/null 2>&1
+15 3 * * * www-data cd $WEBMAIL_DIR && $VENV_DIR/bin/flask --app app loginlog-rotate >/dev/null 2>&1
+EOF
+
+    # Mailbox usage scan; root because only vmail can read /var/vmail
+    cat > /etc/cron.d/promail-usage << EOF
+*/15 * * * * root cd $WEBMAIL_DIR && $VENV_DIR/bin/flask --app app usage-scan >/dev/null 2>&1
+EOF
+
+    # Admin queue actions (requeue/delete/hold) run postsuper, which needs root.
+    # Only the exact command lines mailqueue.act() builds are allowed: ids on
+    # stdin ("<flag> -") or a whole queue ("<flag> ALL <queue>").
+    local postsuper_cmds=""
+    for flag in -r -d -h -H; do
+        postsuper_cmds+="/usr/sbin/postsuper $flag -, "
+        for queue in maildrop incoming active deferred hold corrupt; do
+            postsuper_cmds+="/usr/sbin/postsuper $flag ALL $queue, "
+        done
+    done
+    cat > /etc/sudoers.d/promail-postsuper << EOF
+Cmnd_Alias PROMAIL_POSTSUPER = ${postsuper_cmds%, }
+www-data ALL=(root) NOPASSWD: PROMAIL_POSTSUPER
+EOF
+    chmod 440 /etc/sudoers.d/promail-postsuper
+    visudo -cf /etc/sudoers.d/promail-postsuper >/dev/null || rm -f /etc/sudoers.d/promail-postsuper
+
     chown -R www-data:www-data "$WEBMAIL_DIR"
     chown -R www-data:www-data "$LOG_DIR"
 
@@ -1209,11 +1373,35 @@ After=network.target mariadb.service
 Type=exec
 User=www-data
 Group=www-data
+# adm: read access to /var/log/mail.log and the dovecot logs for the admin log viewer
+SupplementaryGroups=adm
+RuntimeDirectory=promail
+WorkingDirectory=${WEBMAIL_DIR}
+EnvironmentFile=${CONFIG_DIR}/production.env
+ExecStart=${VENV_DIR}/bin/gunicorn --preload --workers 4 --worker-class gthread --threads 8 --bind 127.0.0.1:8000 --timeout 120 --access-logfile /var/log/promail/api-access.log --error-logfile /var/log/promail/api-error.log app:app
+Restart=always
+RestartSec=5
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+    # Maildir provisioning worker; root so it can chown new mailboxes to vmail
+    cat > /etc/systemd/system/promail-maildirs.service <<EOF
+[Unit]
+Description=ProMail Maildir Provisioning Worker
+After=network.target mariadb.service
+
+[Service]
+Type=exec
+User=root
 WorkingDirectory=${WEBMAIL_DIR}
 EnvironmentFile=${CONFIG_DIR}/production.env
-ExecStart=${VENV_DIR}/bin/gunicorn --workers 4 --bind 127.0.0.1:8000 --timeout 120 --access-logfile /var/log/promail/api-access.log --error-logfile /var/log/promail/api-error.log app:app
+ExecStart=${VENV_DIR}/bin/flask --app app maildirs-worker
 Restart=always
 RestartSec=5
+ProtectSystem=full
+ProtectHome=true
 
 [Install]
 WantedBy=multi-user.target
@@ -1258,8 +1446,9 @@ WantedBy=multi-user.target
 EOF
 
     systemctl daemon-reload
-    systemctl enable promail-api promail-frontend promail
+    systemctl enable promail-api promail-maildirs promail-frontend promail
     systemctl start promail-api
+    systemctl start promail-maildirs
     systemctl start promail-frontend
 
     log_info "ProMail services created and started (API :8000, Frontend :3000)"
@@ -0,0 +1,196 @@
+"""
+ProMail — account snapshot cache
+Per-process, TTL-bounded copies of the account fields request handlers need,
+including the decrypted mailbox credential (held in memory only, never
+serialized or shared). Committed changes to an account row are broadcast so
+the worker that made them drops its copy at once. Other workers find out by
+polling accounts.updated_at every ACCOUNT_CACHE_POLL seconds, which also
+catches changes made outside the ORM; a deactivation or lost admin right
+therefore takes effect everywhere within seconds, with or without Redis.
+"""
+
+import threading, time, logging
+from datetime import timedelta
+
+from flask_login import UserMixin
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session, joinedload, object_session
+
+import broadcast
+import mailpool
+from models import db, Account
+
+logger = logging.getLogger(__name__)
+
+# Columns whose change must evict cached snapshots (last_login etc. don't matter)
+SNAPSHOT_COLUMNS = ('email', 'name', 'quota', 'is_admin', 'active', 'domain_id',
+                    'password_hash', 'encrypted_password')
+
+# Polls re-read rows this much older than the newest stamp seen (same-second writes, late commits)
+_SLACK = timedelta(seconds=5)
+
+_snapshots = {}
+_lock = threading.Lock()
+_settings = {'ttl': 300, 'max_entries': 10000, 'poll_interval': 2.0}
+_poll_lock = threading.Lock()
+_poll_state = {'watermark': None, 'count': None, 'polled_at': 0.0}
+
+
+class AccountSnapshot(UserMixin):
+    """Read-only view of an Account; also serves as flask-login's current_user."""
+
+    def __init__(self, account, password=None):
+        self.id = account.id
+        self.email = account.email
+        self.name = account.name or ''
+        self.domain_name = account.domain.name if account.domain else ''
+        self.is_admin = bool(account.is_admin)
+        self.quota = account.quota
+        self.active = bool(account.active)
+        self.created_at = account.created_at.isoformat() if account.created_at else ''
+        self.password = password if password is not None else account._decrypt_password()
+        self.row = tuple(getattr(account, c) for c in SNAPSHOT_COLUMNS)
+        self.loaded_at = time.monotonic()
+
+    @property
+    def is_active(self):
+        return self.active
+
+    @property
+    def username(self):
+        return self.email.split('@')[0]
+
+    @property
+    def full_name(self):
+        return self.name or self.email
+
+    @property
+    def _imap_password(self):
+        return self.password
+
+    def to_user_dict(self):
+        return {
+            'id': self.id,
+            'email': self.email,
+            'name': self.name or self.email,
+            'domain': self.domain_name,
+            'is_admin': self.is_admin,
+            'quota': self.quota,
+            'created_at': self.created_at,
+        }
+
+
+def remember(account, password=None):
+    """Snapshot an already-loaded Account (pass the plaintext password at login to skip Fernet)."""
+    snap = AccountSnapshot(account, password)
+    with _lock:
+        if len(_snapshots) >= _settings['max_entries']:
+            _snapshots.clear()
+        _snapshots[account.id] = snap
+    return snap
+
+
+def get(account_id):
+    account_id = int(account_id)
+    _poll()
+    snap = _snapshots.get(account_id)
+    if snap and time.monotonic() - snap.loaded_at < _settings['ttl']:
+        return snap
+    account = db.session.get(Account, account_id, options=[joinedload(Account.domain)])
+    if not account:
+        _drop(account_id)
+        return None
+    return remember(account)
+
+
+def invalidate(account_id):
+    broadcast.publish('accounts', account_id)
+
+
+def _drop(account_id):
+    with _lock:
+        snap = _snapshots.pop(int(account_id), None)
+    if snap:
+        mailpool.pool.discard(snap.email)
+
+
+broadcast.subscribe('accounts', _drop)
+
+
+def _poll():
+    """Drop snapshots of accounts changed or deleted by any worker; runs at most every poll_interval."""
+    if time.monotonic() - _poll_state['polled_at'] < _settings['poll_interval']:
+        return
+    # One thread polls; the rest keep answering from the snapshots they have
+    if not _poll_lock.acquire(blocking=False):
+        return
+    try:
+        table = Account.__table__
+        columns = [table.c[c] for c in SNAPSHOT_COLUMNS]
+        with db.engine.connect() as conn:
+            count = conn.execute(db.select(func.count()).select_from(table)).scalar()
+            if _poll_state['watermark'] is None:
+                rows = []
+                _poll_state['watermark'] = conn.execute(db.select(func.max(table.c.updated_at))).scalar()
+            else:
+                rows = conn.execute(db.select(table.c.id, table.c.updated_at, *columns).where(
+                    table.c.updated_at >= _poll_state['watermark'] - _SLACK)).all()
+            gone = []
+            if _poll_state['count'] is not None and count < _poll_state['count']:
+                # Deletes leave no stamp behind; only then look up which cached ids are missing
+                cached = list(_snapshots)
+                for start in range(0, len(cached), 1000):
+                    chunk = cached[start:start + 1000]
+                    present = set(conn.execute(db.select(table.c.id).where(table.c.id.in_(chunk))).scalars())
+                    gone.extend(i for i in chunk if i not in present)
+        for row in rows:
+            snap = _snapshots.get(row.id)
+            # last_login flushes stamp updated_at too; only a change the snapshot holds counts
+            if snap is not None and snap.row != tuple(row._mapping[c] for c in SNAPSHOT_COLUMNS):
+                _drop(row.id)
+            if row.updated_at and row.updated_at > _poll_state['watermark']:
+                _poll_state['watermark'] = row.updated_at
+        for account_id in gone:
+            _drop(account_id)
+        _poll_state['count'] = count
+    except Exception as e:
+        logger.warning(f"ACCOUNT_POLL_FAILED error={e}")
+    finally:
+        _poll_state['polled_at'] = time.monotonic()
+        _poll_lock.release()
+
+
+# ── ORM hooks: collect changed accounts during flush, broadcast after commit ──
+
+def _mark(target, deleted=False):
+    state = inspect(target)
+    if deleted or any(state.attrs[c].history.has_changes() for c in SNAPSHOT_COLUMNS):
+        session = object_session(target)
+        if session is not None:
+            session.info.setdefault('promail_changed_accounts', set()).add(target.id)
+
+
+@event.listens_for(Account, 'after_update')
+def _account_updated(mapper, connection, target):
+    _mark(target)
+
+
+@event.listens_for(Account, 'after_delete')
+def _account_deleted(mapper, connection, target):
+    _mark(target, deleted=True)
+
+
+@event.listens_for(Session, 'after_commit')
+def _publish_changes(session):
+    for account_id in session.info.pop('promail_changed_accounts', ()):
+        invalidate(account_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changes(session):
+    session.info.pop('promail_changed_accounts', None)
+
+
+def init_app(app):
+    _settings['ttl'] = app.config.get('ACCOUNT_CACHE_TTL', 300)
+    _settings['poll_interval'] = app.config.get('ACCOUNT_CACHE_POLL', _settings['poll_interval'])
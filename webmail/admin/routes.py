@@ -1,5 +1,3 @@
-import os
-import subprocess
 from functools import wraps
 from datetime import datetime, timedelta
 from flask import render_template, request, jsonify, flash, redirect, url_for, abort
@@ -8,6 +6,13 @@ from admin import admin_bp
 from models import db, Domain, Account, Alias, Setting, LoginLog, CalendarEvent, Contact
 import bcrypt
 import logging
+import resilience
+import settings as settings_registry
+import dashboard as dashboard_snapshot
+import loginlog
+import maildirs
+import mailqueue
+import maillogs
 
 logger = logging.getLogger(__name__)
 
@@ -28,64 +33,28 @@ def admin_required(f):
 @admin_bp.route('/')
 @admin_required
 def dashboard():
-    stats = {
-        'total_domains': Domain.query.count(),
-        'active_domains': Domain.query.filter_by(is_active=True).count(),
-        'total_accounts': Account.query.count(),
-        'active_accounts': Account.query.filter_by(is_active=True).count(),
-        'total_aliases': Alias.query.count(),
-        'logins_today': LoginLog.query.filter(
-            LoginLog.created_at >= datetime.utcnow().date()
-        ).count(),
-        'failed_logins_today': LoginLog.query.filter(
-            LoginLog.created_at >= datetime.utcnow().date(),
-            LoginLog.success == False
-        ).count(),
-    }
+    snap, age = dashboard_snapshot.collector.snapshot()
+    stats = snap['stats']
 
-    # Recent logins
+    # Recent logins (template formats the datetimes itself)
     recent_logins = LoginLog.query.order_by(
         LoginLog.created_at.desc()
     ).limit(20).all()
 
-    # Get system info
-    system_info = {}
-    try:
-        system_info['uptime'] = subprocess.check_output(
-            ['uptime', '-p'], text=True
-        ).strip()
-    except Exception:
-        system_info['uptime'] = 'N/A'
-
-    try:
-        disk = os.statvfs('/')
-        total_gb = (disk.f_blocks * disk.f_frsize) / (1024 ** 3)
-        free_gb = (disk.f_bfree * disk.f_frsize) / (1024 ** 3)
-        system_info['disk_total'] = f"{total_gb:.1f} GB"
-        system_info['disk_free'] = f"{free_gb:.1f} GB"
-        system_info['disk_percent'] = round((1 - free_gb / total_gb) * 100, 1)
-    except Exception:
-        system_info['disk_total'] = 'N/A'
-        system_info['disk_free'] = 'N/A'
-        system_info['disk_percent'] = 0
-
-    # Service status
-    services = {}
-    for svc in ['postfix', 'dovecot', 'opendkim', 'spamassassin', 'clamav-daemon', 'nginx', 'mariadb']:
-        try:
-            result = subprocess.run(
-                ['systemctl', 'is-active', svc],
-                capture_output=True, text=True, timeout=5
-            )
-            services[svc] = result.stdout.strip() == 'active'
-        except Exception:
-            services[svc] = None
+    system = snap['system']
+    system_info = {
+        'uptime': system['uptime'],
+        'disk_total': f"{system['disk_total_bytes'] / (1024 ** 3):.1f} GB",
+        'disk_free': f"{system['disk_free_bytes'] / (1024 ** 3):.1f} GB",
+        'disk_percent': system['disk_percent'],
+        'snapshot_age': age,
+    }
 
     return render_template('dashboard.html',
                            stats=stats,
                            recent_logins=recent_logins,
                            system_info=system_info,
-                           services=services)
+                           services=snap['services'])
 
 
 # ─── Domain Management ──────────────────────────────────────────────────────
@@ -93,7 +62,7 @@ def dashboard():
 @admin_bp.route('/domains')
 @admin_required
 def domains():
-    all_domains = Domain.query.order_by(Domain.domain).all()
+    all_domains = Domain.with_counts(Domain.query.order_by(Domain.name))
     return render_template('domains.html', domains=all_domains)
 
 
@@ -212,7 +181,7 @@ def create_account():
         domain_id=domain_id,
         email=email_addr,
         full_name=data.get('full_name', ''),
-        quota_mb=data.get('quota_mb', int(Setting.get('default_quota', 1024))),
+        quota_mb=data.get('quota_mb', settings_registry.get('default_quota', 1024)),
         is_admin=data.get('is_admin', False),
         is_active=True,
     )
@@ -220,18 +189,7 @@ def create_account():
 
     db.session.add(account)
     db.session.commit()
-
-    # Create maildir
-    try:
-        mail_domain = email_addr.split('@')[1]
-        mail_user = email_addr.split('@')[0]
-        maildir = f"/var/vmail/{mail_domain}/{mail_user}/Maildir"
-        os.makedirs(maildir, exist_ok=True)
-        for d in ['cur', 'new', 'tmp']:
-            os.makedirs(os.path.join(maildir, d), exist_ok=True)
-        os.system(f"chown -R vmail:vmail /var/vmail/{mail_domain}/{mail_user}")
-    except Exception as e:
-        logger.warning(f"Could not create maildir: {e}")
+    maildirs.enqueue(email_addr, 'create')
 
     logger.info(f"ACCOUNT_CREATED email={email_addr} by={current_user.email}")
     return jsonify(account.to_dict()), 201
@@ -271,6 +229,7 @@ def delete_account(account_id):
     email = account.email
     db.session.delete(account)
     db.session.commit()
+    maildirs.enqueue(email, 'remove')
 
     logger.info(f"ACCOUNT_DELETED email={email} by={current_user.email}")
     return jsonify({'success': True})
@@ -333,8 +292,7 @@ def settings():
 def update_settings():
     data = request.get_json()
 
-    for key, value in data.items():
-        Setting.set(key, value)
+    settings_registry.update(data)
 
     logger.info(f"SETTINGS_UPDATED by={current_user.email} keys={list(data.keys())}")
     return jsonify({'success': True})
@@ -353,10 +311,7 @@ def service_control(action, service):
         return jsonify({'error': 'Invalid service or action'}), 400
 
     try:
-        result = subprocess.run(
-            ['systemctl', action, service],
-            capture_output=True, text=True, timeout=30
-        )
+        result = resilience.run(['systemctl', action, service], timeout=30)
         success = result.returncode == 0
         logger.info(f"SERVICE_{action.upper()} {service} success={success} by={current_user.email}")
         return jsonify({'success': success, 'message': result.stderr or 'OK'})
@@ -370,24 +325,32 @@ def service_control(action, service):
 @admin_required
 def logs():
     log_type = request.args.get('type', 'login')
-    page = int(request.args.get('page', 1))
-    per_page = 50
 
     if log_type == 'login':
-        query = LoginLog.query.order_by(LoginLog.created_at.desc())
-        total = query.count()
-        entries = query.offset((page - 1) * per_page).limit(per_page).all()
+        try:
+            entries, next_cursor, prev_cursor = loginlog.page(
+                loginlog.parse_filters(request.args), request.args.get('cursor'),
+                request.args.get('direction', 'next'))
+        except ValueError:
+            abort(400)
     else:
-        entries = []
-        total = 0
-
-    total_pages = max(1, (total + per_page - 1) // per_page)
+        # Mail server logs are paged newest first; only a forward cursor exists
+        try:
+            entries, next_cursor, _ = maillogs.page(log_type, maillogs.parse_filters(request.args),
+                                                    request.args.get('cursor'))
+        except KeyError:
+            abort(404)
+        except ValueError:
+            abort(400)
+        except PermissionError:
+            entries, next_cursor = [], None
+        prev_cursor = None
 
     return render_template('logs.html',
                            entries=entries,
                            log_type=log_type,
-                           page=page,
-                           total_pages=total_pages)
+                           next_cursor=next_cursor,
+                           prev_cursor=prev_cursor)
 
 
 # ─── System Stats API ──────────────────────────────────────────────────────
@@ -397,10 +360,7 @@ def logs():
 def api_stats():
     # Mail queue
     try:
-        queue = subprocess.check_output(
-            ['postqueue', '-p'], text=True, timeout=5
-        )
-        queue_count = queue.count('\n') - 1 if queue.strip() != 'Mail queue is empty' else 0
+        queue_count = mailqueue.summary()[0]['messages']
     except Exception:
         queue_count = 0
 
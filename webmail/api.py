@@ -4,44 +4,67 @@ Production-grade JSON API for the Next.js frontend.
 All endpoints prefixed with /api/
 """
 
-import os, subprocess, shutil, imaplib, email as email_lib, smtplib
+import re, imaplib, email as email_lib
+from contextlib import contextmanager
 from datetime import datetime, date, timedelta
 from functools import wraps
 
-from flask import Blueprint, request, jsonify, g, current_app, make_response
+from flask import Blueprint, Response, request, jsonify, g, current_app, make_response
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
-
-import jwt, bcrypt
+import email.policy
+
+import mailpool, warmup, resilience, singleflight, accounts, passwords, throttle, auditlog, tokens
+import settings as settings_registry
+import dashboard
+import loginlog
+import bulkimport
+import maildirs
+import mailqueue
+import usage
+import maillogs
+import metrics
+import profiling
+from cache import cache
+
+import jwt
+from sqlalchemy.orm import joinedload
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 # ── Helpers ────────────────────────────────────────────────────────────────
 
-SECRET_KEY = os.environ.get('SECRET_KEY', 'change-me-in-production')
 TOKEN_EXPIRY_DAYS = 7
 COOKIE_NAME = 'promail_token'
 
 
 def create_token(account):
+    """Register an API session for an AccountSnapshot and sign its token."""
+    expires = datetime.utcnow() + timedelta(days=TOKEN_EXPIRY_DAYS)
+    jti = tokens.issue(account.id, expires, throttle.client_ip(), request.headers.get('User-Agent', ''))
     payload = {
+        'jti': jti,
         'sub': account.id,
         'email': account.email,
         'name': account.name or account.email,
-        'domain': account.domain.name if account.domain else '',
+        'domain': account.domain_name,
         'is_admin': account.is_admin,
-        'exp': datetime.utcnow() + timedelta(days=TOKEN_EXPIRY_DAYS),
+        'exp': expires,
     }
-    return jwt.encode(payload, SECRET_KEY, algorithm='HS256')
+    return jwt.encode(payload, current_app.config['JWT_SECRET_KEY'], algorithm='HS256')
 
 
 def decode_token(token):
     try:
-        return jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        payload = jwt.decode(token, current_app.config['JWT_SECRET_KEY'], algorithms=['HS256'],
+                             options={'require': ['exp', 'jti']})
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return None
+    if tokens.is_revoked(payload['jti']):
+        return None
+    return payload
 
 
 def get_current_user():
@@ -75,20 +98,50 @@ def admin_required(f):
     return wrapper
 
 
-def get_imap(user_payload):
-    """Open an IMAP connection for the current user."""
-    from models import Account
-    account = Account.query.get(user_payload['sub'])
+@contextmanager
+def imap_session(user_payload):
+    """Pooled IMAP connection for the current user (None without an account).
+
+    Always handed back on exit, and closed instead of pooled if the block
+    raised a timeout or abort, so neither the in-use count nor a half-open
+    breaker probe is left behind by an error.
+    """
+    account = accounts.get(user_payload['sub'])
     if not account:
-        return None
-    conn = imaplib.IMAP4_SSL(
-        current_app.config.get('MAIL_SERVER', '127.0.0.1'),
-        current_app.config.get('IMAP_PORT', 993),
-    )
-    conn.login(account.email, account._decrypt_password())
-    return conn
+        yield None
+        return
+    with mailpool.pool.connection(
+            current_app.config.get('MAIL_SERVER', '127.0.0.1'),
+            current_app.config.get('IMAP_PORT', 993),
+            account.email, account.password) as conn:
+        yield conn
+
+
+def error_response(e):
+    """JSON error for a failed backend call; open circuits and blown deadlines become 503s."""
+    if isinstance(e, resilience.BackendUnavailable):
+        resp = jsonify({'error': str(e)})
+        resp.headers['Retry-After'] = str(e.retry_after)
+        return resp, 503
+    return jsonify({'error': str(e)}), 500
+
 
+@api_bp.errorhandler(resilience.BackendUnavailable)
+def backend_unavailable(e):
+    return error_response(e)
 
+
+def _mail_key(account_id, *parts):
+    """Cache key for mailbox data; bumping the account's generation invalidates all of it."""
+    gen = cache.get(f'mail:{account_id}:gen') or 0
+    return ':'.join(['mail', str(account_id), str(gen)] + [str(p) for p in parts])
+
+
+def invalidate_mail_cache(account_id):
+    cache.incr(f'mail:{account_id}:gen')
+
+
+@profiling.watch
 def parse_email(raw_bytes, uid):
     """Parse raw email bytes into a dict."""
     msg = email_lib.message_from_bytes(raw_bytes)
@@ -174,7 +227,7 @@ def parse_email(raw_bytes, uid):
 
 @api_bp.route('/auth/login', methods=['POST'])
 def auth_login():
-    from models import Account, LoginLog, db
+    from models import Account, db
     data = request.get_json(silent=True) or {}
     email_addr = data.get('email', '').strip().lower()
     password = data.get('password', '')
@@ -182,49 +235,56 @@ def auth_login():
     if not email_addr or not password:
         return jsonify({'error': 'Email and password are required'}), 400
 
-    account = Account.query.filter_by(email=email_addr).first()
+    ip_addr = throttle.client_ip()
+    blocked = throttle.limiter.check(ip_addr, email_addr)
+    if blocked:
+        resp = jsonify({'error': 'Too many failed login attempts. Try again later.'})
+        resp.headers['Retry-After'] = str(blocked[1])
+        return resp, 429
+
+    account = Account.query.options(joinedload(Account.domain)).filter_by(email=email_addr).first()
     success_flag = False
 
     if account and account.active and account.check_password(password):
         success_flag = True
-        token = create_token(account)
-        user_data = {
-            'id': account.id,
-            'email': account.email,
-            'name': account.name or account.email,
-            'domain': account.domain.name if account.domain else '',
-            'is_admin': account.is_admin,
-            'quota': account.quota,
-            'created_at': account.created_at.isoformat() if account.created_at else '',
-        }
-        resp = make_response(jsonify({'user': user_data, 'message': 'Login successful'}))
+        if db.session.is_modified(account):  # password hash upgraded to the current cost
+            db.session.commit()
+        throttle.limiter.reset_account(email_addr)
+        snapshot = accounts.remember(account, password)
+        token = create_token(snapshot)
+        resp = make_response(jsonify({'user': snapshot.to_user_dict(), 'message': 'Login successful'}))
         resp.set_cookie(
             COOKIE_NAME, token,
             httponly=True, secure=request.is_secure,
             samesite='Lax', max_age=86400 * TOKEN_EXPIRY_DAYS,
             path='/',
         )
+        warmup.queue.enqueue(
+            account.id, _warm_mailbox,
+            current_app.config.get('MAIL_SERVER', '127.0.0.1'),
+            current_app.config.get('IMAP_PORT', 993),
+            account.email, password, account.id,
+            50, current_app.config.get('MAIL_CACHE_TTL', 30),
+        )
     else:
+        throttle.limiter.record_failure(ip_addr, email_addr)
         resp = make_response(jsonify({'error': 'Invalid email or password'}), 401)
 
-    # Log attempt
-    try:
-        log = LoginLog(
-            email=email_addr,
-            ip_address=request.remote_addr,
-            user_agent=request.headers.get('User-Agent', '')[:500],
-            success=success_flag,
-        )
-        db.session.add(log)
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
+    # Log attempt (batched; also coalesces last_login)
+    auditlog.writer.record_login(
+        email_addr, ip_addr, request.headers.get('User-Agent', ''), success_flag,
+        account_id=account.id if account else None,
+    )
 
     return resp
 
 
 @api_bp.route('/auth/logout', methods=['POST'])
 def auth_logout():
+    user = get_current_user()
+    if user:
+        warmup.queue.cancel(user['sub'])
+        tokens.revoke(user['jti'])
     resp = make_response(jsonify({'message': 'Logged out'}))
     resp.delete_cookie(COOKIE_NAME, path='/')
     return resp
@@ -233,53 +293,111 @@ def auth_logout():
 @api_bp.route('/auth/me', methods=['GET'])
 @auth_required
 def auth_me():
-    from models import Account
-    account = Account.query.get(g.user['sub'])
+    account = accounts.get(g.user['sub'])
     if not account:
         return jsonify({'error': 'Account not found'}), 404
-    return jsonify({
-        'user': {
-            'id': account.id,
-            'email': account.email,
-            'name': account.name or account.email,
-            'domain': account.domain.name if account.domain else '',
-            'is_admin': account.is_admin,
-            'quota': account.quota,
-            'created_at': account.created_at.isoformat() if account.created_at else '',
-        }
-    })
+    return jsonify({'user': dict(account.to_user_dict(), usage=usage.for_account(account.id, account.quota))})
 
 
 # ══════════════════════════════════════════════════════════════════════════
 #  MAIL
 # ══════════════════════════════════════════════════════════════════════════
 
+MAIL_FOLDERS = [
+    {'name': 'INBOX', 'display_name': 'Inbox', 'icon': 'inbox', 'count': 0, 'unread': 0},
+    {'name': 'Sent', 'display_name': 'Sent', 'icon': 'send', 'count': 0, 'unread': 0},
+    {'name': 'Drafts', 'display_name': 'Drafts', 'icon': 'file-text', 'count': 0, 'unread': 0},
+    {'name': 'Trash', 'display_name': 'Trash', 'icon': 'trash-2', 'count': 0, 'unread': 0},
+    {'name': 'Junk', 'display_name': 'Spam', 'icon': 'archive', 'count': 0, 'unread': 0},
+]
+
+
+def _load_folders(conn):
+    """Message and unread counts for the standard folders via STATUS (no SELECT needed).
+
+    A missing folder just keeps zero counts; a timeout or abort ends the whole
+    load, since every later STATUS on that session would wait just as long.
+    """
+    folders = [dict(f) for f in MAIL_FOLDERS]
+    for f in folders:
+        try:
+            status, data = conn.status(f['name'], '(MESSAGES UNSEEN)')
+            if status == 'OK' and data[0]:
+                messages = re.search(rb'MESSAGES (\d+)', data[0])
+                unseen = re.search(rb'UNSEEN (\d+)', data[0])
+                f['count'] = int(messages.group(1)) if messages else 0
+                f['unread'] = int(unseen.group(1)) if unseen else 0
+        except (OSError, imaplib.IMAP4.abort):
+            raise
+        except Exception:
+            pass
+    return folders
+
+
+def _load_message_page(conn, folder, page, per_page):
+    """Fetch and parse one page of a folder, newest first."""
+    # EXAMINE, so fetching RFC822 for the list doesn't implicitly set \Seen
+    conn.select(folder, readonly=True)
+    _, data = conn.search(None, 'ALL')
+    uids = data[0].split() if data[0] else []
+    uids.reverse()  # newest first
+
+    total = len(uids)
+    start = (page - 1) * per_page
+    page_uids = uids[start:start + per_page]
+
+    messages = []
+    if page_uids:
+        uid_str = b','.join(page_uids)
+        _, msg_data = conn.fetch(uid_str, '(RFC822 FLAGS)')
+        i = 0
+        while i < len(msg_data):
+            if isinstance(msg_data[i], tuple):
+                uid_bytes = page_uids[len(messages)] if len(messages) < len(page_uids) else b'0'
+                uid = int(uid_bytes)
+                raw = msg_data[i][1]
+                parsed = parse_email(raw, uid)
+                # Parse flags
+                flag_line = msg_data[i][0].decode('utf-8', errors='replace')
+                parsed['read'] = '\\Seen' in flag_line
+                parsed['starred'] = '\\Flagged' in flag_line
+                messages.append(parsed)
+            i += 1
+    return {'messages': messages, 'total': total}
+
+
+def _warm_mailbox(cancel, host, port, email_addr, password, account_id, per_page, ttl):
+    """Warm-up job: prime the pooled session plus folder and first-page caches."""
+    with mailpool.pool.connection(host, port, email_addr, password) as conn:
+        if cancel.is_set():
+            return
+        cache.set(_mail_key(account_id, 'folders'), _load_folders(conn), ttl)
+        if cancel.is_set():
+            return
+        cache.set(_mail_key(account_id, 'messages', 'INBOX', 1, per_page),
+                  _load_message_page(conn, 'INBOX', 1, per_page), ttl)
+
+
 @api_bp.route('/mail/folders', methods=['GET'])
 @auth_required
 def mail_folders():
-    folders = [
-        {'name': 'INBOX', 'display_name': 'Inbox', 'icon': 'inbox', 'count': 0, 'unread': 0},
-        {'name': 'Sent', 'display_name': 'Sent', 'icon': 'send', 'count': 0, 'unread': 0},
-        {'name': 'Drafts', 'display_name': 'Drafts', 'icon': 'file-text', 'count': 0, 'unread': 0},
-        {'name': 'Trash', 'display_name': 'Trash', 'icon': 'trash-2', 'count': 0, 'unread': 0},
-        {'name': 'Junk', 'display_name': 'Spam', 'icon': 'archive', 'count': 0, 'unread': 0},
-    ]
-    try:
-        conn = get_imap(g.user)
-        if conn:
-            for f in folders:
-                try:
-                    status, data = conn.select(f['name'], readonly=True)
-                    if status == 'OK':
-                        f['count'] = int(data[0])
-                        _, unseen = conn.search(None, 'UNSEEN')
-                        f['unread'] = len(unseen[0].split()) if unseen[0] else 0
-                except Exception:
-                    pass
-            conn.logout()
-    except Exception:
-        pass
-    return jsonify({'folders': folders})
+    key = _mail_key(g.user['sub'], 'folders')
+
+    def load():
+        with imap_session(g.user) as conn:
+            if not conn:
+                return None
+            result = _load_folders(conn)
+        cache.set(key, result, current_app.config.get('MAIL_CACHE_TTL', 30))
+        return result
+
+    folders = cache.get(key)
+    if folders is None:
+        try:
+            folders = singleflight.do(key, load)
+        except Exception:
+            pass
+    return jsonify({'folders': folders or [dict(f) for f in MAIL_FOLDERS]})
 
 
 @api_bp.route('/mail/messages', methods=['GET'])
@@ -290,47 +408,29 @@ def mail_messages():
     per_page = int(request.args.get('per_page', 50))
 
     try:
-        conn = get_imap(g.user)
-        if not conn:
+        key = _mail_key(g.user['sub'], 'messages', folder, page, per_page)
+
+        def load():
+            with imap_session(g.user) as conn:
+                if not conn:
+                    return None
+                page_data = _load_message_page(conn, folder, page, per_page)
+            cache.set(key, page_data, current_app.config.get('MAIL_CACHE_TTL', 30))
+            return page_data
+
+        result = cache.get(key) or singleflight.do(key, load)
+        if result is None:
             return jsonify({'error': 'Cannot connect to mailbox'}), 500
 
-        conn.select(folder)
-        _, data = conn.search(None, 'ALL')
-        uids = data[0].split() if data[0] else []
-        uids.reverse()  # newest first
-
-        total = len(uids)
-        start = (page - 1) * per_page
-        page_uids = uids[start:start + per_page]
-
-        messages = []
-        if page_uids:
-            uid_str = b','.join(page_uids)
-            _, msg_data = conn.fetch(uid_str, '(RFC822 FLAGS)')
-            i = 0
-            while i < len(msg_data):
-                if isinstance(msg_data[i], tuple):
-                    uid_bytes = page_uids[len(messages)] if len(messages) < len(page_uids) else b'0'
-                    uid = int(uid_bytes)
-                    raw = msg_data[i][1]
-                    parsed = parse_email(raw, uid)
-                    # Parse flags
-                    flag_line = msg_data[i][0].decode('utf-8', errors='replace')
-                    parsed['read'] = '\\Seen' in flag_line
-                    parsed['starred'] = '\\Flagged' in flag_line
-                    messages.append(parsed)
-                i += 1
-
-        conn.logout()
         return jsonify({
-            'messages': messages,
-            'total': total,
+            'messages': result['messages'],
+            'total': result['total'],
             'page': page,
             'per_page': per_page,
             'folder': folder,
         })
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @api_bp.route('/mail/messages/<int:uid>', methods=['GET'])
@@ -338,32 +438,31 @@ def mail_messages():
 def mail_message_detail(uid):
     folder = request.args.get('folder', 'INBOX')
     try:
-        conn = get_imap(g.user)
-        if not conn:
-            return jsonify({'error': 'Cannot connect'}), 500
-        conn.select(folder)
-        _, data = conn.fetch(str(uid).encode(), '(RFC822 FLAGS)')
-        if not data or not data[0]:
-            conn.logout()
-            return jsonify({'error': 'Message not found'}), 404
-        raw = data[0][1]
-        parsed = parse_email(raw, uid)
-        flag_line = data[0][0].decode('utf-8', errors='replace')
-        parsed['read'] = '\\Seen' in flag_line
-        parsed['starred'] = '\\Flagged' in flag_line
-        # Mark as read
-        conn.store(str(uid).encode(), '+FLAGS', '\\Seen')
-        conn.logout()
+        with imap_session(g.user) as conn:
+            if not conn:
+                return jsonify({'error': 'Cannot connect'}), 500
+            conn.select(folder)
+            _, data = conn.fetch(str(uid).encode(), '(RFC822 FLAGS)')
+            if not data or not data[0]:
+                return jsonify({'error': 'Message not found'}), 404
+            raw = data[0][1]
+            parsed = parse_email(raw, uid)
+            flag_line = data[0][0].decode('utf-8', errors='replace')
+            parsed['read'] = '\\Seen' in flag_line
+            parsed['starred'] = '\\Flagged' in flag_line
+            # Mark as read
+            conn.store(str(uid).encode(), '+FLAGS', '\\Seen')
+        if not parsed['read']:
+            invalidate_mail_cache(g.user['sub'])
         return jsonify({'message': parsed})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @api_bp.route('/mail/send', methods=['POST'])
 @auth_required
 def mail_send():
-    from models import Account
-    account = Account.query.get(g.user['sub'])
+    account = accounts.get(g.user['sub'])
     if not account:
         return jsonify({'error': 'Account not found'}), 404
 
@@ -404,25 +503,39 @@ def mail_send():
             part.add_header('Content-Disposition', f'attachment; filename="{f.filename}"')
             msg.attach(part)
 
-        smtp = smtplib.SMTP(
-            current_app.config.get('MAIL_SERVER', '127.0.0.1'),
-            current_app.config.get('SMTP_PORT', 587),
-        )
-        smtp.starttls()
-        smtp.login(account.email, account._decrypt_password())
-
         all_recipients = [r.strip() for r in to.split(',')]
         if cc:
             all_recipients += [r.strip() for r in cc.split(',')]
         if bcc:
             all_recipients += [r.strip() for r in bcc.split(',')]
 
-        smtp.sendmail(account.email, all_recipients, msg.as_string())
-        smtp.quit()
+        # Serialize once; the same bytes go to SMTP DATA and the Sent APPEND
+        raw = msg.as_bytes(policy=email.policy.SMTP)
+        password = account.password
+
+        smtp_host = current_app.config.get('MAIL_SERVER', '127.0.0.1')
+        smtp_port = current_app.config.get('SMTP_PORT', 587)
+        backend = f'smtp:{smtp_host}:{smtp_port}'
+        with resilience.breaker(backend).guard():
+            smtp = metrics.SMTP(smtp_host, smtp_port,
+                                timeout=resilience.timeout_for('smtp', backend))
+            smtp.starttls()
+            smtp.login(account.email, password)
+            smtp.sendmail(account.email, all_recipients, raw)
+            smtp.quit()
+
+        append = mailpool.background.submit(
+            mailpool.store_sent_copy,
+            current_app.config.get('MAIL_SERVER', '127.0.0.1'),
+            current_app.config.get('IMAP_PORT', 993),
+            account.email, password, raw,
+            current_app.config.get('SENT_FOLDER', 'Sent'),
+        )
+        append.add_done_callback(lambda _: invalidate_mail_cache(account.id))
 
         return jsonify({'message': 'Sent successfully'})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @api_bp.route('/mail/messages/<int:uid>/star', methods=['POST'])
@@ -431,18 +544,18 @@ def mail_star(uid):
     data = request.get_json(silent=True) or {}
     folder = data.get('folder', 'INBOX')
     try:
-        conn = get_imap(g.user)
-        conn.select(folder)
-        _, flag_data = conn.fetch(str(uid).encode(), '(FLAGS)')
-        flags = flag_data[0].decode('utf-8', errors='replace') if flag_data[0] else ''
-        if '\\Flagged' in flags:
-            conn.store(str(uid).encode(), '-FLAGS', '\\Flagged')
-        else:
-            conn.store(str(uid).encode(), '+FLAGS', '\\Flagged')
-        conn.logout()
+        with imap_session(g.user) as conn:
+            conn.select(folder)
+            _, flag_data = conn.fetch(str(uid).encode(), '(FLAGS)')
+            flags = flag_data[0].decode('utf-8', errors='replace') if flag_data[0] else ''
+            if '\\Flagged' in flags:
+                conn.store(str(uid).encode(), '-FLAGS', '\\Flagged')
+            else:
+                conn.store(str(uid).encode(), '+FLAGS', '\\Flagged')
+        invalidate_mail_cache(g.user['sub'])
         return jsonify({'message': 'OK'})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @api_bp.route('/mail/messages/<int:uid>/delete', methods=['POST'])
@@ -451,14 +564,14 @@ def mail_delete(uid):
     data = request.get_json(silent=True) or {}
     folder = data.get('folder', 'INBOX')
     try:
-        conn = get_imap(g.user)
-        conn.select(folder)
-        conn.store(str(uid).encode(), '+FLAGS', '\\Deleted')
-        conn.expunge()
-        conn.logout()
+        with imap_session(g.user) as conn:
+            conn.select(folder)
+            conn.store(str(uid).encode(), '+FLAGS', '\\Deleted')
+            conn.expunge()
+        invalidate_mail_cache(g.user['sub'])
         return jsonify({'message': 'Deleted'})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 @api_bp.route('/mail/messages/<int:uid>/move', methods=['POST'])
@@ -468,15 +581,15 @@ def mail_move(uid):
     folder = data.get('folder', 'INBOX')
     target = data.get('target', 'Archive')
     try:
-        conn = get_imap(g.user)
-        conn.select(folder)
-        conn.copy(str(uid).encode(), target)
-        conn.store(str(uid).encode(), '+FLAGS', '\\Deleted')
-        conn.expunge()
-        conn.logout()
+        with imap_session(g.user) as conn:
+            conn.select(folder)
+            conn.copy(str(uid).encode(), target)
+            conn.store(str(uid).encode(), '+FLAGS', '\\Deleted')
+            conn.expunge()
+        invalidate_mail_cache(g.user['sub'])
         return jsonify({'message': f'Moved to {target}'})
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
 # ══════════════════════════════════════════════════════════════════════════
@@ -639,9 +752,9 @@ def contacts_delete(cid):
 @auth_required
 def contacts_groups():
     from models import ContactGroup
-    groups = ContactGroup.query.filter_by(account_id=g.user['sub']).all()
+    groups = ContactGroup.with_counts(ContactGroup.query.filter_by(account_id=g.user['sub']))
     return jsonify({
-        'groups': [{'id': g_.id, 'name': g_.name, 'count': 0} for g_ in groups]
+        'groups': [{'id': g_.id, 'name': g_.name, 'count': g_.member_count} for g_ in groups]
     })
 
 
@@ -663,76 +776,26 @@ def contacts_create_group():
 @api_bp.route('/admin/dashboard', methods=['GET'])
 @admin_required
 def admin_dashboard():
-    from models import Domain, Account, Alias, LoginLog, db
-    today_start = datetime.combine(date.today(), datetime.min.time())
-
-    stats = {
-        'active_domains': Domain.query.filter_by(active=True).count(),
-        'active_accounts': Account.query.filter_by(active=True).count(),
-        'total_aliases': Alias.query.count(),
-        'logins_today': LoginLog.query.filter(LoginLog.created_at >= today_start).count(),
-        'failed_logins_today': LoginLog.query.filter(
-            LoginLog.created_at >= today_start, LoginLog.success == False
-        ).count(),
-        'disk_percent': 0,
-        'disk_total': '0 GB',
-        'disk_free': '0 GB',
-        'uptime': 'Unknown',
-    }
-
-    # System info
-    try:
-        usage = shutil.disk_usage('/')
-        stats['disk_percent'] = round(usage.used / usage.total * 100, 1)
-        stats['disk_total'] = f'{usage.total // (1024**3)} GB'
-        stats['disk_free'] = f'{usage.free // (1024**3)} GB'
-    except Exception:
-        pass
-
-    try:
-        result = subprocess.run(['uptime', '-p'], capture_output=True, text=True, timeout=5)
-        stats['uptime'] = result.stdout.strip() if result.returncode == 0 else 'Unknown'
-    except Exception:
-        stats['uptime'] = 'Unknown'
-
-    # Services
-    service_names = [
-        ('postfix', 'Postfix SMTP'),
-        ('dovecot', 'Dovecot IMAP'),
-        ('opendkim', 'OpenDKIM'),
-        ('spamassassin', 'SpamAssassin'),
-        ('clamav-daemon', 'ClamAV'),
-        ('nginx', 'Nginx'),
-        ('fail2ban', 'Fail2Ban'),
-    ]
-    services = []
-    for name, display in service_names:
-        running = False
-        try:
-            result = subprocess.run(
-                ['systemctl', 'is-active', name],
-                capture_output=True, text=True, timeout=5,
-            )
-            running = result.stdout.strip() == 'active'
-        except Exception:
-            pass
-        services.append({'name': name, 'display_name': display, 'running': running})
-
-    # Recent logins
-    recent = LoginLog.query.order_by(LoginLog.created_at.desc()).limit(15).all()
-    recent_data = [
-        {
-            'id': l.id, 'email': l.email, 'ip_address': l.ip_address,
-            'success': l.success, 'user_agent': l.user_agent or '',
-            'created_at': l.created_at.isoformat() if l.created_at else '',
-        }
-        for l in recent
+    """Served from the background-collected snapshot; ``snapshot_age`` is in seconds."""
+    snap, age = dashboard.collector.snapshot()
+    system = snap['system']
+    stats = dict(
+        snap['stats'],
+        disk_percent=system['disk_percent'],
+        disk_total=f"{system['disk_total_bytes'] // (1024**3)} GB",
+        disk_free=f"{system['disk_free_bytes'] // (1024**3)} GB",
+        uptime=system['uptime'],
+    )
+    services = [
+        {'name': name, 'display_name': display, 'running': bool(snap['services'].get(name))}
+        for name, display in dashboard.SERVICES
     ]
-
     return jsonify({
         'stats': stats,
         'services': services,
-        'recent_logins': recent_data,
+        'recent_logins': snap['recent_logins'],
+        'collected_at': datetime.utcfromtimestamp(snap['collected_at']).isoformat() + 'Z',
+        'snapshot_age': age,
     })
 
 
@@ -740,13 +803,13 @@ def admin_dashboard():
 @admin_required
 def admin_domains_list():
     from models import Domain
-    domains = Domain.query.order_by(Domain.name).all()
+    domains = Domain.with_counts(Domain.query.order_by(Domain.name))
     return jsonify({
         'domains': [
             {
                 'id': d.id, 'name': d.name, 'active': d.active,
-                'accounts_count': len(d.accounts) if hasattr(d, 'accounts') else 0,
-                'aliases_count': len(d.aliases) if hasattr(d, 'aliases') else 0,
+                'accounts_count': d.account_total,
+                'aliases_count': d.alias_count,
                 'created_at': d.created_at.isoformat() if d.created_at else '',
             }
             for d in domains
@@ -783,14 +846,16 @@ def admin_domains_delete(did):
 @api_bp.route('/admin/accounts', methods=['GET'])
 @admin_required
 def admin_accounts_list():
-    from models import Account, Domain
-    q = Account.query
+    from models import Account, Domain, MailboxUsage
+    q = Account.query.options(joinedload(Account.domain))
     domain_filter = request.args.get('domain', '').strip()
     if domain_filter:
         domain = Domain.query.filter_by(name=domain_filter).first()
         if domain:
             q = q.filter_by(domain_id=domain.id)
     accounts = q.order_by(Account.email).all()
+    used = dict(MailboxUsage.query.with_entities(MailboxUsage.account_id, MailboxUsage.bytes)
+                .filter(MailboxUsage.account_id.in_([a.id for a in accounts])).all()) if accounts else {}
     return jsonify({
         'accounts': [
             {
@@ -798,6 +863,7 @@ def admin_accounts_list():
                 'domain_id': a.domain_id,
                 'domain_name': a.domain.name if a.domain else '',
                 'quota': a.quota, 'active': a.active, 'is_admin': a.is_admin,
+                'usage_bytes': used.get(a.id),
                 'created_at': a.created_at.isoformat() if a.created_at else '',
             }
             for a in accounts
@@ -832,23 +898,56 @@ def admin_accounts_create():
         email=email_addr,
         name=name,
         domain_id=domain.id,
-        quota=data.get('quota', 1024),
+        quota=data.get('quota') or settings_registry.get('default_quota', 1024),
         is_admin=data.get('is_admin', False),
         active=True,
     )
     account.set_password(password)
     db.session.add(account)
     db.session.commit()
+    maildirs.enqueue(email_addr, 'create')
+
+    return jsonify({'message': 'Account created', 'id': account.id,
+                    'maildir': maildirs.to_dict(maildirs.latest(email_addr))}), 201
 
-    # Create maildir
-    maildir = f'/var/mail/vhosts/{domain.name}/{username}'
-    try:
-        os.makedirs(maildir, exist_ok=True)
-        subprocess.run(['chown', '-R', 'vmail:vmail', maildir], check=False)
-    except Exception:
-        pass
 
-    return jsonify({'message': 'Account created', 'id': account.id}), 201
+@api_bp.route('/admin/accounts/import', methods=['POST'])
+@admin_required
+def admin_accounts_import():
+    """Bulk-create accounts from CSV or JSON (raw body or a ``file`` upload); ``?dry_run=1`` only validates."""
+    upload = request.files.get('file')
+    if upload:
+        data, fmt = upload.read(), 'json' if (upload.filename or '').lower().endswith('.json') else 'csv'
+    elif request.is_json:
+        data, fmt = request.get_json(silent=True), 'json'
+    else:
+        data, fmt = request.get_data(), 'csv'
+    try:
+        rows = bulkimport.parse(data, fmt)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    default_domain = request.args.get('domain') or (data.get('domain') if isinstance(data, dict) else None)
+    new_accounts, errors = bulkimport.validate(rows, default_domain)
+    summary = {'total': len(rows), 'valid': len(new_accounts), 'errors': errors}
+    if request.args.get('dry_run') in ('1', 'true'):
+        return jsonify(summary)
+    if not new_accounts:
+        return jsonify(dict(summary, error='No valid accounts to import')), 400
+
+    job_id = bulkimport.start(current_app._get_current_object(), new_accounts, errors)
+    if job_id is None:
+        return jsonify({'error': 'Another import is still running'}), 409
+    return jsonify(dict(summary, job_id=job_id)), 202
+
+
+@api_bp.route('/admin/accounts/import/<job_id>', methods=['GET'])
+@admin_required
+def admin_accounts_import_status(job_id):
+    """Progress of an import job; clients poll this until ``status`` is done or failed."""
+    job = bulkimport.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Import not found'}), 404
+    return jsonify(job)
 
 
 @api_bp.route('/admin/accounts/<int:aid>', methods=['PUT'])
@@ -868,6 +967,8 @@ def admin_accounts_update(aid):
     if 'password' in data and data['password']:
         account.set_password(data['password'])
     db.session.commit()
+    if not account.active or data.get('password'):
+        tokens.revoke_account(aid)
     return jsonify({'message': 'Account updated'})
 
 
@@ -876,16 +977,99 @@ def admin_accounts_update(aid):
 def admin_accounts_delete(aid):
     from models import Account, db
     account = Account.query.get_or_404(aid)
+    email_addr = account.email
     db.session.delete(account)
     db.session.commit()
+    tokens.revoke_account(aid)
+    maildirs.enqueue(email_addr, 'remove')
     return jsonify({'message': 'Account deleted'})
 
 
+@api_bp.route('/admin/accounts/<int:aid>/maildir', methods=['GET'])
+@admin_required
+def admin_account_maildir(aid):
+    """State of the latest provisioning task for this account's mailbox."""
+    from models import Account
+    account = Account.query.get_or_404(aid)
+    return jsonify(maildirs.to_dict(maildirs.latest(account.email)))
+
+
+@api_bp.route('/admin/accounts/<int:aid>/maildir', methods=['POST'])
+@admin_required
+def admin_account_maildir_repair(aid):
+    """Queue the mailbox to be (re)created; also fixes ownership of an existing tree."""
+    from models import Account
+    account = Account.query.get_or_404(aid)
+    maildirs.enqueue(account.email, 'create')
+    return jsonify(maildirs.to_dict(maildirs.latest(account.email))), 202
+
+
+@api_bp.route('/admin/accounts/<int:aid>/usage', methods=['POST'])
+@admin_required
+def admin_account_usage_refresh(aid):
+    """Measure one mailbox now (over IMAP if this process can't read the mail store)."""
+    from models import Account
+    account = Account.query.get_or_404(aid)
+    usage.scan([aid])
+    measured = usage.for_account(aid, account.quota)
+    if measured is None:
+        return jsonify({'error': 'Mailbox could not be measured'}), 502
+    return jsonify(measured)
+
+
+@api_bp.route('/admin/usage', methods=['GET'])
+@admin_required
+def admin_usage():
+    """Stored mailbox usage, fullest first; ``?min_percent=90`` lists accounts near their quota."""
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    return jsonify({'accounts': usage.accounts_usage(request.args.get('domain') or None,
+                                                     request.args.get('min_percent', type=float), limit)})
+
+
+@api_bp.route('/admin/usage/domains', methods=['GET'])
+@admin_required
+def admin_usage_domains():
+    return jsonify({'domains': usage.domain_totals()})
+
+
+@api_bp.route('/admin/maildir-tasks', methods=['GET'])
+@admin_required
+def admin_maildir_tasks():
+    """Recent provisioning tasks, newest first; ``?status=failed`` to find the stuck ones."""
+    from models import MaildirTask
+    q = MaildirTask.query
+    status = request.args.get('status', '').strip()
+    if status:
+        q = q.filter(MaildirTask.status == status)
+    limit = max(1, min(request.args.get('limit', 100, type=int), 500))
+    return jsonify({'tasks': [maildirs.to_dict(t) for t in q.order_by(MaildirTask.id.desc()).limit(limit)]})
+
+
+@api_bp.route('/admin/accounts/<int:aid>/sessions', methods=['GET'])
+@admin_required
+def admin_account_sessions(aid):
+    return jsonify({'sessions': tokens.active_sessions(aid)})
+
+
+@api_bp.route('/admin/accounts/<int:aid>/sessions', methods=['DELETE'])
+@admin_required
+def admin_account_sessions_revoke_all(aid):
+    return jsonify({'message': 'Sessions revoked', 'revoked': tokens.revoke_account(aid)})
+
+
+@api_bp.route('/admin/accounts/<int:aid>/sessions/<jti>', methods=['DELETE'])
+@admin_required
+def admin_account_session_revoke(aid, jti):
+    if not tokens.revoke(jti, account_id=aid):
+        return jsonify({'error': 'Session not found'}), 404
+    return jsonify({'message': 'Session revoked'})
+
+
 @api_bp.route('/admin/aliases', methods=['GET'])
 @admin_required
 def admin_aliases_list():
     from models import Alias
-    aliases = Alias.query.order_by(Alias.source).all()
+    aliases = Alias.query.options(joinedload(Alias.domain)).order_by(Alias.source).all()
     return jsonify({
         'aliases': [
             {
@@ -929,29 +1113,14 @@ def admin_aliases_delete(aid):
 @api_bp.route('/admin/settings', methods=['GET'])
 @admin_required
 def admin_settings_get():
-    from models import Setting
-    settings = Setting.query.order_by(Setting.key).all()
-    return jsonify({
-        'settings': [
-            {'key': s.key, 'value': s.value, 'description': s.description or ''}
-            for s in settings
-        ]
-    })
+    return jsonify({'settings': settings_registry.registry.all()})
 
 
 @api_bp.route('/admin/settings', methods=['PUT'])
 @admin_required
 def admin_settings_update():
-    from models import Setting, db
     data = request.get_json(silent=True) or {}
-    settings_dict = data.get('settings', {})
-    for key, value in settings_dict.items():
-        setting = Setting.query.filter_by(key=key).first()
-        if setting:
-            setting.value = value
-        else:
-            db.session.add(Setting(key=key, value=value))
-    db.session.commit()
+    settings_registry.update(data.get('settings', {}))
     return jsonify({'message': 'Settings saved'})
 
 
@@ -965,51 +1134,174 @@ def admin_service_action(name, action):
     if action not in allowed_actions:
         return jsonify({'error': 'Invalid action'}), 400
     try:
-        result = subprocess.run(
-            ['systemctl', action, name],
-            capture_output=True, text=True, timeout=30,
-        )
+        result = resilience.run(['systemctl', action, name], timeout=30)
         if result.returncode == 0:
             return jsonify({'message': f'{name} {action}ed successfully'})
         return jsonify({'error': result.stderr or 'Action failed'}), 500
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return error_response(e)
 
 
-@api_bp.route('/admin/logs', methods=['GET'])
+@api_bp.route('/admin/backends', methods=['GET'])
 @admin_required
-def admin_logs():
-    from models import LoginLog
-    page = int(request.args.get('page', 1))
-    per_page = 50
-    log_type = request.args.get('type', 'all')
+def admin_backends():
+    """Circuit breaker state, failure and trip counters per backend."""
+    return jsonify({'backends': resilience.stats()})
+
 
-    q = LoginLog.query
-    if log_type == 'success':
-        q = q.filter_by(success=True)
-    elif log_type == 'failed':
-        q = q.filter_by(success=False)
+@api_bp.route('/admin/bcrypt', methods=['GET'])
+@admin_required
+def admin_bcrypt_stats():
+    """Password hashing pool: queue depth, rejections and latency histogram."""
+    return jsonify({'bcrypt': passwords.pool.stats()})
 
-    total = q.count()
-    total_pages = max(1, (total + per_page - 1) // per_page)
-    logs = q.order_by(LoginLog.created_at.desc()).offset((page - 1) * per_page).limit(per_page).all()
+
+@api_bp.route('/admin/logs', methods=['GET'])
+@admin_required
+def admin_logs():
+    """Keyset-paginated login log: pass ``next_cursor``/``prev_cursor`` back as ``cursor`` (+ ``direction=prev``)."""
+    try:
+        filters = loginlog.parse_filters(request.args)
+        per_page = max(1, min(int(request.args.get('per_page', 50)), 200))
+        entries, next_cursor, prev_cursor = loginlog.page(
+            filters, request.args.get('cursor'), request.args.get('direction', 'next'), per_page)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    total, approximate = loginlog.total(filters)
 
     return jsonify({
-        'items': [
-            {
-                'id': l.id, 'email': l.email, 'ip_address': l.ip_address,
-                'success': l.success, 'user_agent': l.user_agent or '',
-                'created_at': l.created_at.isoformat() if l.created_at else '',
-            }
-            for l in logs
-        ],
+        'items': [loginlog.to_dict(l) for l in entries],
+        'next_cursor': next_cursor,
+        'prev_cursor': prev_cursor,
         'total': total,
-        'page': page,
+        'total_approximate': approximate,
         'per_page': per_page,
-        'total_pages': total_pages,
     })
 
 
+@api_bp.route('/admin/logs/stats', methods=['GET'])
+@admin_required
+def admin_login_stats():
+    """Daily login success/failure counts from the rollup tables, optionally for one domain or account."""
+    days = max(1, min(request.args.get('days', 30, type=int), 366))
+    return jsonify({'days': loginlog.trend(days, domain=request.args.get('domain') or None,
+                                           email=request.args.get('email') or None)})
+
+
+@api_bp.route('/admin/maillogs', methods=['GET'])
+@admin_required
+def admin_maillogs():
+    """Configured mail server logs and the (rotated, possibly gzipped) files behind each."""
+    return jsonify({'logs': maillogs.describe()})
+
+
+@api_bp.route('/admin/maillogs/<source>', methods=['GET'])
+@admin_required
+def admin_maillog_page(source):
+    """Lines filtered by ``since``/``until``/``queue_id``/``address``/``level``/``q``, newest first
+    (``order=asc`` for oldest first); pass ``next_cursor`` back as ``cursor``. With ``order=asc``
+    the last page's cursor points at the end of the live file, so polling with it tails the log."""
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    try:
+        filters = maillogs.parse_filters(request.args)
+        items, next_cursor, truncated = maillogs.page(source, filters, request.args.get('cursor'),
+                                                      request.args.get('order', 'desc'), limit)
+    except KeyError:
+        return jsonify({'error': 'Unknown log'}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except PermissionError:
+        return jsonify({'error': 'Log is not readable by the web service'}), 503
+    return jsonify({'items': items, 'next_cursor': next_cursor, 'truncated': truncated, 'limit': limit})
+
+
+@api_bp.route('/admin/profiles', methods=['GET'])
+@admin_required
+def admin_profiles():
+    """Saved request profiles, newest first; send ``X-Profile: cpu|sample|memory`` on a request to add one."""
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    return jsonify({'profiles': profiling.recent(limit), 'header': profiling.HEADER, 'modes': profiling.MODES,
+                    'sample_rate': current_app.config.get('PROFILE_SAMPLE_RATE', 0)})
+
+
+@api_bp.route('/admin/profiles/<profile_id>', methods=['GET'])
+@admin_required
+def admin_profile(profile_id):
+    """One profile with its function, stack or allocation tables."""
+    meta = profiling.get(profile_id)
+    if not meta:
+        return jsonify({'error': 'Profile not found'}), 404
+    return jsonify(meta)
+
+
+@api_bp.route('/admin/profiles/<profile_id>/download', methods=['GET'])
+@admin_required
+def admin_profile_download(profile_id):
+    """The raw pstats dump (cpu) or folded stacks for flamegraph.pl/speedscope (sample)."""
+    found = profiling.artifact(profile_id)
+    if not found:
+        return jsonify({'error': 'Profile has no downloadable data'}), 404
+    path, suffix = found
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    response = Response(data, content_type='text/plain' if suffix == 'folded' else 'application/octet-stream')
+    response.headers['Content-Disposition'] = f'attachment; filename="{profile_id}.{suffix}"'
+    return response
+
+
+@api_bp.route('/admin/slow-requests', methods=['GET'])
+@admin_required
+def admin_slow_requests():
+    """Requests over SLOW_REQUEST_SECONDS with their IMAP/SMTP/SQL/bcrypt/CPU split, newest first."""
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    return jsonify({'requests': profiling.slow_requests(limit),
+                    'threshold': current_app.config.get('SLOW_REQUEST_SECONDS')})
+
+
+@api_bp.route('/admin/queue/summary', methods=['GET'])
+@admin_required
+def admin_queue_summary():
+    """Postfix queue totals by queue, recipient domain and deferral reason (cached; ``?refresh=1`` to rescan)."""
+    try:
+        snap, age = mailqueue.summary(refresh=request.args.get('refresh') in ('1', 'true'))
+    except Exception as e:
+        return error_response(e)
+    return jsonify(dict(snap, age=age))
+
+
+@api_bp.route('/admin/queue', methods=['GET'])
+@admin_required
+def admin_queue_list():
+    """Queued messages filtered by queue/domain/sender/reason/id, ``offset``/``limit`` paginated."""
+    offset = max(0, request.args.get('offset', 0, type=int))
+    limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+    filters = {k: request.args.get(k) for k in ('queue', 'domain', 'sender', 'reason', 'id')}
+    try:
+        items, total = mailqueue.listing(filters, offset, limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return error_response(e)
+    return jsonify({'items': items, 'total': total, 'offset': offset, 'limit': limit})
+
+
+@api_bp.route('/admin/queue/actions', methods=['POST'])
+@admin_required
+def admin_queue_action():
+    """``{"action": "requeue|delete|hold|release", "ids": [...]}`` or ``{"action": ..., "queue": "deferred"}``."""
+    data = request.get_json(silent=True) or {}
+    action, ids, queue = data.get('action'), data.get('ids') or [], data.get('queue')
+    if not isinstance(ids, list):
+        return jsonify({'error': 'ids must be a list'}), 400
+    try:
+        count = mailqueue.act(action, ids=ids, queue=None if ids else queue, actor=g.user.get('email'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return error_response(e)
+    return jsonify({'action': action, 'count': count})
+
+
 # ══════════════════════════════════════════════════════════════════════════
 #  ATTACHMENT DOWNLOAD
 # ══════════════════════════════════════════════════════════════════════════
@@ -1019,44 +1311,38 @@ def admin_logs():
 def download_attachment(uid, att_index):
     """Download a specific attachment from an email by its part index."""
     folder = request.args.get('folder', 'INBOX')
-    conn = get_imap(g.user)
-    if not conn:
-        return jsonify({'error': 'Mail connection failed'}), 500
-
     try:
-        conn.select(folder, readonly=True)
-        _, data = conn.uid('FETCH', str(uid), '(RFC822)')
-        if not data or not data[0]:
-            return jsonify({'error': 'Message not found'}), 404
-
-        raw = data[0][1]
-        msg = email_lib.message_from_bytes(raw)
-
-        # Walk through parts to find the attachment at the given index
-        for i, part in enumerate(msg.walk()):
-            if i == att_index:
-                cd = str(part.get('Content-Disposition', ''))
-                if 'attachment' not in cd:
-                    return jsonify({'error': 'Part is not an attachment'}), 400
-
-                payload = part.get_payload(decode=True)
-                if not payload:
-                    return jsonify({'error': 'Empty attachment'}), 404
-
-                filename = part.get_filename() or f'attachment_{i}'
-                content_type = part.get_content_type() or 'application/octet-stream'
-
-                from flask import Response
-                response = Response(payload, content_type=content_type)
-                response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
-                response.headers['Content-Length'] = len(payload)
-                return response
-
-        return jsonify({'error': 'Attachment not found'}), 404
+        with imap_session(g.user) as conn:
+            if not conn:
+                return jsonify({'error': 'Mail connection failed'}), 500
+            conn.select(folder, readonly=True)
+            _, data = conn.uid('FETCH', str(uid), '(RFC822)')
+            if not data or not data[0]:
+                return jsonify({'error': 'Message not found'}), 404
+
+            raw = data[0][1]
+            msg = email_lib.message_from_bytes(raw)
+
+            # Walk through parts to find the attachment at the given index
+            for i, part in enumerate(msg.walk()):
+                if i == att_index:
+                    cd = str(part.get('Content-Disposition', ''))
+                    if 'attachment' not in cd:
+                        return jsonify({'error': 'Part is not an attachment'}), 400
+
+                    payload = part.get_payload(decode=True)
+                    if not payload:
+                        return jsonify({'error': 'Empty attachment'}), 404
+
+                    filename = part.get_filename() or f'attachment_{i}'
+                    content_type = part.get_content_type() or 'application/octet-stream'
+
+                    from flask import Response
+                    response = Response(payload, content_type=content_type)
+                    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+                    response.headers['Content-Length'] = len(payload)
+                    return response
+
+            return jsonify({'error': 'Attachment not found'}), 404
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
-    finally:
-        try:
-            conn.logout()
-        except Exception:
-            pass
+        return error_response(e)
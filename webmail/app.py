@@ -1,12 +1,14 @@
 import os
+import gc
 import logging
 from datetime import datetime
 from flask import Flask, redirect, url_for, request
 from flask_login import LoginManager, current_user
 from flask_wtf.csrf import CSRFProtect
-from flask_session import Session
 from config import config
-from models import db, Account
+from models import db
+import mailpool, warmup, cache, resilience, singleflight, broadcast, metrics, profiling, sqlwatch
+import accounts, passwords, throttle, auditlog, sessions, tokens, settings, dashboard, loginlog, bulkimport, maildirs, mailqueue, usage, maillogs
 
 # Configure logging
 logging.basicConfig(
@@ -23,7 +25,6 @@ logger = logging.getLogger(__name__)
 # Extensions
 login_manager = LoginManager()
 csrf = CSRFProtect()
-sess = Session()
 
 
 def create_app(config_name=None):
@@ -33,12 +34,39 @@ def create_app(config_name=None):
 
     app = Flask(__name__)
     app.config.from_object(config.get(config_name, config['default']))
+    # First, so their timers wrap every other before_request hook
+    metrics.init_app(app)
+    profiling.init_app(app)
+    sqlwatch.init_app(app)
 
     # Initialize extensions
     db.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
-    sess.init_app(app)
+    cache.init_app(app)
+    if app.config.get('SESSION_TYPE') == 'filesystem':
+        from flask_session import Session
+        Session(app)
+    else:
+        sessions.init_app(app)
+    resilience.init_app(app)
+    mailpool.init_app(app)
+    warmup.init_app(app)
+    singleflight.init_app(app)
+    broadcast.init_app(app)
+    accounts.init_app(app)
+    passwords.init_app(app)
+    throttle.init_app(app)
+    auditlog.init_app(app)
+    tokens.init_app(app)
+    settings.init_app(app)
+    dashboard.init_app(app)
+    loginlog.init_app(app)
+    bulkimport.init_app(app)
+    maildirs.init_app(app)
+    mailqueue.init_app(app)
+    usage.init_app(app)
+    maillogs.init_app(app)
 
     # Login manager config
     login_manager.login_view = 'auth.login'
@@ -48,7 +76,7 @@ def create_app(config_name=None):
 
     @login_manager.user_loader
     def load_user(user_id):
-        return Account.query.get(int(user_id))
+        return accounts.get(user_id)
 
     # Register blueprints — template-based (legacy)
     from auth.routes import auth_bp
@@ -103,15 +131,26 @@ def create_app(config_name=None):
         logger.error(f"Server error: {e}")
         return '<h1>500 - Internal Server Error</h1>', 500
 
-    # Create tables if needed
-    with app.app_context():
+    # Schema changes are an explicit deploy step (`flask --app app migrate`), never
+    # part of boot: nothing here may open a DB connection before gunicorn forks.
+    @app.cli.command('migrate')
+    def migrate():
+        """Create any missing tables and indexes."""
         db.create_all()
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        logger.info("Schema up to date")
 
     return app
 
 
-# Create application instance
+# Create application instance (once, in the gunicorn master with --preload)
 app = create_app()
 
+# Keep boot-time objects out of the collector's scans so forked workers don't
+# copy their pages just by running a GC pass
+gc.freeze()
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000, debug=True)
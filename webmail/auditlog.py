@@ -0,0 +1,148 @@
+"""
+ProMail — buffered login audit writer
+Login attempts are queued in memory and written by a background thread as
+multi-row INSERTs whenever the batch fills up or the flush interval passes.
+``last_login`` updates are coalesced per account in the same transaction.
+Rows that can't be written are spooled to a local JSON-lines file and
+replayed on the next successful flush; pending rows are flushed at exit.
+"""
+
+import os, json, atexit, threading, logging
+from datetime import datetime
+
+from sqlalchemy import bindparam
+
+from models import db, Account, LoginLog
+
+logger = logging.getLogger(__name__)
+
+
+class AuditWriter:
+    def __init__(self, batch_size=200, interval=2.0, spool_path=None):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.spool_path = spool_path
+        self.app = None
+        self._rows = []
+        self._last_login = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+
+    def record_login(self, email, ip_address, user_agent, success, account_id=None):
+        row = {
+            'account_id': account_id, 'email': email, 'ip_address': ip_address,
+            'user_agent': (user_agent or '')[:500], 'success': bool(success),
+            'created_at': datetime.utcnow(),
+        }
+        with self._lock:
+            self._rows.append(row)
+            if success and account_id:
+                self._last_login[account_id] = row['created_at']
+            full = len(self._rows) >= self.batch_size
+        self._ensure_thread()
+        if full:
+            self._wakeup.set()
+
+    def pending(self):
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                last_login, self._last_login = self._last_login, {}
+            rows = self._read_spool() + rows
+            if not rows and not last_login:
+                return 0
+            try:
+                with self.app.app_context(), db.engine.begin() as conn:
+                    if rows:
+                        conn.execute(LoginLog.__table__.insert().values(rows))
+                    if last_login:
+                        conn.execute(
+                            Account.__table__.update()
+                            .where(Account.__table__.c.id == bindparam('aid'))
+                            .values(last_login=bindparam('ts')),
+                            [{'aid': aid, 'ts': ts} for aid, ts in last_login.items()],
+                        )
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"AUDIT_FLUSH_FAILED rows={len(rows)} error={e}")
+                self._spool(rows)
+                return 0
+            self.flushed += len(rows)
+            self.batches += 1
+            return len(rows)
+
+    def stats(self):
+        return {'pending': self.pending(), 'flushed': self.flushed,
+                'batches': self.batches, 'failures': self.failures}
+
+    # ── internals ──
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() or self.app is None:
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._loop, daemon=True, name='promail-audit').start()
+
+    def _loop(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"AUDIT_FLUSH_ERROR error={e}")
+
+    def _spool(self, rows):
+        if not rows:
+            return
+        if not self.spool_path:
+            # No spool configured: keep a bounded backlog in memory for the next attempt
+            with self._lock:
+                self._rows = (rows + self._rows)[-self.batch_size * 50:]
+            return
+        try:
+            os.makedirs(os.path.dirname(self.spool_path) or '.', exist_ok=True)
+            with open(self.spool_path, 'a') as fh:
+                for row in rows:
+                    fh.write(json.dumps(dict(row, created_at=row['created_at'].isoformat())) + '\n')
+        except OSError as e:
+            logger.error(f"AUDIT_SPOOL_FAILED rows={len(rows)} error={e}")
+
+    def _read_spool(self):
+        if not self.spool_path or not os.path.exists(self.spool_path):
+            return []
+        claimed = f'{self.spool_path}.{os.getpid()}'
+        try:
+            os.rename(self.spool_path, claimed)
+        except FileNotFoundError:
+            return []  # another worker claimed it first
+        try:
+            with open(claimed) as fh:
+                rows = [json.loads(line) for line in fh if line.strip()]
+            os.remove(claimed)
+        except (OSError, ValueError) as e:
+            logger.warning(f"AUDIT_SPOOL_READ_FAILED error={e}")
+            return []
+        for row in rows:
+            row['created_at'] = datetime.fromisoformat(row['created_at'])
+        return rows
+
+
+writer = AuditWriter()
+
+
+def init_app(app):
+    writer.app = app
+    writer.batch_size = app.config.get('AUDIT_BATCH_SIZE', writer.batch_size)
+    writer.interval = app.config.get('AUDIT_FLUSH_INTERVAL', writer.interval)
+    writer.spool_path = app.config.get('AUDIT_SPOOL_PATH', writer.spool_path)
+    atexit.register(writer.flush)
@@ -0,0 +1,75 @@
+"""
+ProMail — cross-worker invalidation messages
+Redis pub/sub when the shared cache is Redis-backed; otherwise only the
+local process is notified and callers fall back on their own TTLs.
+"""
+
+import os, json, socket, threading, time, logging
+from collections import defaultdict
+
+from cache import cache, RedisBackend
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'promail:'
+
+_handlers = defaultdict(list)
+_listener = {'pid': None}
+
+
+def _origin():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def subscribe(channel, handler):
+    """Call ``handler(message)`` for every message published on ``channel``, in any worker."""
+    _handlers[channel].append(handler)
+
+
+def publish(channel, message):
+    _deliver(channel, message)
+    backend = cache.backend
+    if isinstance(backend, RedisBackend):
+        try:
+            backend.client.publish(PREFIX + channel, json.dumps({'origin': _origin(), 'message': message}))
+        except Exception as e:
+            logger.warning(f"BROADCAST_FAILED channel={channel} error={e}")
+
+
+def _deliver(channel, message):
+    for handler in _handlers.get(channel, ()):
+        try:
+            handler(message)
+        except Exception as e:
+            logger.warning(f"BROADCAST_HANDLER_FAILED channel={channel} error={e}")
+
+
+def ensure_listener():
+    """Start this worker's subscriber thread (once per process, so it survives pre-fork loading)."""
+    backend = cache.backend
+    if not isinstance(backend, RedisBackend) or _listener['pid'] == os.getpid():
+        return
+    _listener['pid'] = os.getpid()
+    threading.Thread(target=_listen, args=(backend.client,), daemon=True,
+                     name='promail-broadcast').start()
+
+
+def _listen(client):
+    origin = _origin()
+    while True:
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.psubscribe(PREFIX + '*')
+            for item in pubsub.listen():
+                data = json.loads(item['data'])
+                if data.get('origin') == origin:
+                    continue  # already delivered locally
+                channel = item['channel'].decode()[len(PREFIX):]
+                _deliver(channel, data.get('message'))
+        except Exception as e:
+            logger.warning(f"BROADCAST_LISTENER_ERROR error={e}; reconnecting")
+            time.sleep(1)
+
+
+def init_app(app):
+    app.before_request(ensure_listener)
@@ -0,0 +1,307 @@
+"""
+ProMail — bulk account import
+A CSV or JSON batch is validated as a whole before anything is written: one
+query for the target domains and one per chunk for existing addresses.
+Passwords are hashed across all cores, and accounts go in as multi-row
+INSERTs in chunked transactions that also queue their maildirs for the
+provisioning worker. Imports run as background jobs whose progress is kept
+in ``import_jobs``, so any worker can report on it; a unique ``running``
+column lets only one import run at a time.
+"""
+
+import io, re, csv, json, time, uuid, threading, logging
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+import passwords, maildirs, settings
+from models import db, Account, Domain, ImportJob, _cipher
+
+logger = logging.getLogger(__name__)
+
+_LOCAL_RE = re.compile(r"^[a-z0-9!#$%&'*+/=?^_`{|}~-]+(\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*$")
+
+_settings = {
+    'max_rows': 50000, 'chunk_size': 500, 'processes': None, 'job_ttl': 86400, 'stale': 600,
+}
+
+
+class InvalidImport(ValueError):
+    pass
+
+
+# ── parsing and validation ──
+
+def parse(data, fmt='csv'):
+    """Rows from a CSV payload (header row required) or JSON (a list, or ``{"accounts": [...]}``)."""
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    if fmt == 'json':
+        try:
+            payload = json.loads(data) if isinstance(data, str) else data
+        except ValueError as e:
+            raise InvalidImport(f'Invalid JSON: {e}')
+        if isinstance(payload, dict):
+            payload = payload.get('accounts')
+        if not isinstance(payload, list) or not all(isinstance(row, dict) for row in payload):
+            raise InvalidImport('Expected a list of account objects')
+        rows = payload
+    else:
+        reader = csv.DictReader(io.StringIO(data))
+        header = [(name or '').strip().lower() for name in reader.fieldnames or []]
+        if 'password' not in header or not {'email', 'username'} & set(header):
+            raise InvalidImport('CSV needs a header row with email (or username) and password columns')
+        rows = [{(k or '').strip().lower(): (v or '').strip() for k, v in row.items() if isinstance(v, str)}
+                for row in reader]
+    if len(rows) > _settings['max_rows']:
+        raise InvalidImport(f"At most {_settings['max_rows']} accounts per import")
+    return rows
+
+
+def _flag(value, default):
+    if value in (None, ''):
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def validate(rows, default_domain=None):
+    """Check the whole batch; returns (accounts ready to create, per-row errors)."""
+    errors, candidates, seen = [], [], set()
+    for index, raw in enumerate(rows, 1):
+        email = str(raw.get('email') or '').strip().lower()
+        if not email and raw.get('username'):
+            domain = str(raw.get('domain') or default_domain or '').strip().lower()
+            email = f"{str(raw['username']).strip().lower()}@{domain}"
+        local, _, domain = email.partition('@')
+        password = str(raw.get('password') or '')
+        error = None
+        if not local or not domain or len(email) > 255 or not _LOCAL_RE.match(local):
+            error = 'Invalid email address'
+        elif len(password) < 8:
+            error = 'Password must be at least 8 characters'
+        elif email in seen:
+            error = 'Duplicate address in this import'
+        else:
+            try:
+                quota = int(raw['quota']) if raw.get('quota') not in (None, '') else None
+            except (TypeError, ValueError):
+                error = 'Quota must be a whole number of MB'
+        if error:
+            errors.append({'row': index, 'email': email, 'error': error})
+            continue
+        seen.add(email)
+        candidates.append({
+            'row': index, 'email': email, 'local': local, 'domain': domain, 'password': password,
+            'name': str(raw.get('name') or '')[:255], 'quota': quota,
+            'is_admin': _flag(raw.get('is_admin'), False), 'active': _flag(raw.get('active'), True),
+        })
+    if not candidates:
+        return [], errors
+
+    domains = {d.name: d for d in Domain.with_counts(
+        Domain.query.filter(Domain.name.in_({c['domain'] for c in candidates})))}
+    emails, existing = [c['email'] for c in candidates], set()
+    for start in range(0, len(emails), 1000):
+        existing.update(db.session.execute(
+            select(Account.email).where(Account.email.in_(emails[start:start + 1000]))).scalars())
+
+    default_quota = settings.get('default_quota', 1024)
+    accounts, added = [], {}
+    for c in candidates:
+        domain = domains.get(c['domain'])
+        c['quota'] = c['quota'] or default_quota
+        if domain is None:
+            error = 'Domain not found'
+        elif not domain.active:
+            error = 'Domain is inactive'
+        elif c['email'] in existing:
+            error = 'Account already exists'
+        elif domain.max_quota_mb and c['quota'] > domain.max_quota_mb:
+            error = f'Quota exceeds the domain limit of {domain.max_quota_mb} MB'
+        elif domain.max_accounts and domain.account_count + added.get(domain.id, 0) >= domain.max_accounts:
+            error = 'Domain account limit reached'
+        else:
+            error = None
+        if error:
+            errors.append({'row': c['row'], 'email': c['email'], 'error': error})
+            continue
+        c['domain_id'] = domain.id
+        added[domain.id] = added.get(domain.id, 0) + 1
+        accounts.append(c)
+    errors.sort(key=lambda e: e['row'])
+    return accounts, errors
+
+
+# ── import ──
+
+def run(accounts, errors=(), progress=None):
+    """Hash and insert ``accounts`` (from validate()) and queue their maildirs; returns the final report."""
+    report = {'status': 'hashing', 'total': len(accounts) + len(errors), 'valid': len(accounts),
+              'hashed': 0, 'created': 0, 'maildirs_queued': 0, 'errors': list(errors),
+              'started_at': time.time(), 'finished_at': None}
+
+    def step(**changes):
+        report.update(changes)
+        if progress:
+            progress(report)
+
+    step()
+    cipher, now = _cipher(), datetime.utcnow()
+    rows = []
+    hashes = passwords.hash_many([a['password'] for a in accounts], processes=_settings['processes'])
+    for n, (acct, password_hash) in enumerate(zip(accounts, hashes), 1):
+        password = acct.pop('password')
+        rows.append({
+            'email': acct['email'], 'domain_id': acct['domain_id'], 'name': acct['name'],
+            'password_hash': password_hash,
+            'encrypted_password': cipher.encrypt(password.encode('utf-8')).decode('utf-8'),
+            'quota': acct['quota'], 'is_admin': acct['is_admin'], 'active': acct['active'],
+            'created_at': now, 'updated_at': now,
+        })
+        if n % 100 == 0:
+            step(hashed=n)
+
+    step(status='inserting', hashed=len(rows))
+    table, created, size = Account.__table__, [], _settings['chunk_size']
+    for start in range(0, len(rows), size):
+        chunk = list(zip(accounts[start:start + size], rows[start:start + size]))
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.insert().values([row for _, row in chunk]))
+                maildirs.enqueue([row['email'] for _, row in chunk], 'create', conn)
+            created.extend(acct for acct, _ in chunk)
+        except IntegrityError:
+            # Someone created one of these addresses since validation; find which, row by row
+            for acct, row in chunk:
+                try:
+                    with db.engine.begin() as conn:
+                        conn.execute(table.insert().values(row))
+                        maildirs.enqueue(row['email'], 'create', conn)
+                    created.append(acct)
+                except IntegrityError:
+                    report['errors'].append({'row': acct['row'], 'email': acct['email'],
+                                             'error': 'Account already exists'})
+        step(created=len(created), maildirs_queued=len(created))
+
+    maildirs.worker.wake()
+    report['errors'].sort(key=lambda e: e['row'])
+    step(status='done', finished_at=time.time())
+    logger.info(f"ACCOUNTS_IMPORTED created={len(created)} failed={len(report['errors'])} "
+                f"seconds={report['finished_at'] - report['started_at']:.1f}")
+    return report
+
+
+# ── background jobs ──
+
+def _public(report):
+    """Progress snapshot; the error list is only included once the job has finished."""
+    snap = {k: v for k, v in report.items() if k != 'errors'}
+    snap['failed'] = len(report['errors'])
+    if report['status'] in ('done', 'failed'):
+        snap['errors'] = report['errors']
+    return snap
+
+
+def _claim(job_id, snap):
+    """Insert the job holding the running slot; False if another import holds it."""
+    table, now = ImportJob.__table__, datetime.utcnow()
+    with db.engine.begin() as conn:
+        # A job whose worker died keeps the slot; give it up once it stops reporting progress
+        conn.execute(table.update()
+                     .where(table.c.running.is_not(None),
+                            table.c.updated_at < now - timedelta(seconds=_settings['stale']))
+                     .values(running=None, status='failed', error='Import stopped reporting progress',
+                             updated_at=now))
+        conn.execute(table.delete().where(table.c.running.is_(None),
+                                          table.c.updated_at < now - timedelta(seconds=_settings['job_ttl'])))
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(table.insert().values(id=job_id, status=snap['status'], running=True,
+                                               progress=json.dumps(snap), created_at=now, updated_at=now))
+    except IntegrityError:
+        return False
+    return True
+
+
+def start(app, accounts, errors):
+    """Run the import on a background thread; returns the job id, or None if one is already running."""
+    job_id = uuid.uuid4().hex
+    table = ImportJob.__table__
+    queued = {'status': 'queued', 'total': len(accounts) + len(errors), 'valid': len(accounts),
+              'hashed': 0, 'created': 0, 'maildirs_queued': 0, 'errors': list(errors),
+              'started_at': time.time(), 'finished_at': None}
+    if not _claim(job_id, dict(_public(queued), id=job_id)):
+        return None
+
+    def publish(report):
+        snap = dict(_public(report), id=job_id)
+        values = {'status': snap['status'], 'progress': json.dumps(snap), 'updated_at': datetime.utcnow()}
+        if snap['status'] in ('done', 'failed'):
+            values.update(running=None, error=snap.get('error'))
+        with db.engine.begin() as conn:
+            conn.execute(table.update().where(table.c.id == job_id).values(**values))
+
+    def work():
+        with app.app_context():
+            try:
+                run(accounts, errors, publish)
+            except Exception as e:
+                logger.warning(f"ACCOUNTS_IMPORT_FAILED job={job_id} error={e}")
+                publish({'status': 'failed', 'error': str(e), 'errors': list(errors),
+                         'finished_at': time.time()})
+            finally:
+                db.session.remove()
+
+    threading.Thread(target=work, daemon=True, name=f'promail-import-{job_id[:8]}').start()
+    return job_id
+
+
+def status(job_id):
+    table = ImportJob.__table__
+    with db.engine.connect() as conn:
+        row = conn.execute(table.select().where(table.c.id == job_id)).first()
+    if row is None:
+        return None
+    snap = json.loads(row.progress)
+    # The row's status wins: a stale job is marked failed without rewriting its snapshot
+    snap['status'] = row.status
+    if row.error:
+        snap['error'] = row.error
+    return snap
+
+
+def init_app(app):
+    for key, name in (('max_rows', 'BULK_IMPORT_MAX_ROWS'), ('chunk_size', 'BULK_IMPORT_CHUNK_SIZE'),
+                      ('processes', 'BULK_IMPORT_PROCESSES'), ('job_ttl', 'BULK_IMPORT_JOB_TTL'),
+                      ('stale', 'BULK_IMPORT_STALE')):
+        _settings[key] = app.config.get(name, _settings[key])
+
+    @app.cli.command('accounts-import')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--domain', help='Domain for rows that only give a username.')
+    @click.option('--dry-run', is_flag=True, help='Validate only; write nothing.')
+    def import_command(path, domain, dry_run):
+        """Create accounts from a CSV or JSON file."""
+        with open(path, 'rb') as fh:
+            try:
+                rows = parse(fh.read(), 'json' if path.lower().endswith('.json') else 'csv')
+            except InvalidImport as e:
+                raise click.ClickException(str(e))
+        accounts, errors = validate(rows, domain)
+        click.echo(f'{len(rows)} rows: {len(accounts)} valid, {len(errors)} rejected')
+        if not dry_run and accounts:
+            last = [0.0]
+
+            def progress(report):
+                if report['status'] == 'done' or time.monotonic() - last[0] > 1:
+                    last[0] = time.monotonic()
+                    click.echo(f"  {report['status']}: hashed {report['hashed']}/{report['valid']}, "
+                               f"created {report['created']}")
+
+            errors = run(accounts, errors, progress)['errors']
+        for e in errors:
+            click.echo(f"row {e['row']} {e['email'] or '-'}: {e['error']}", err=True)
@@ -0,0 +1,112 @@
+"""
+ProMail — shared cache
+Redis when REDIS_URL is configured so every gunicorn worker sees the same
+entries; otherwise a per-process dict with TTLs.
+"""
+
+import json, threading, time, logging
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key):
+        with self._lock:
+            item = self._live(key, time.monotonic())
+            return item[0] if item else None
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        """Set only if absent; returns True if the key was set."""
+        now = time.monotonic()
+        with self._lock:
+            if self._live(key, now):
+                return False
+            self._data[key] = (value, now + ttl if ttl else None)
+            return True
+
+    def incr(self, key, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            item = self._live(key, now)
+            value = (item[0] if item else 0) + 1
+            expires = item[1] if item else (now + ttl if ttl else None)
+            self._data[key] = (value, expires)
+            return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+class RedisBackend:
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        raw = self.client.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, json.dumps(value), ex=ttl)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, json.dumps(value), ex=ttl, nx=True))
+
+    def incr(self, key, ttl=None):
+        value = self.client.incr(key)
+        if ttl and value == 1:
+            self.client.expire(key, ttl)
+        return value
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+class SharedCache:
+    """Thin facade so modules can import ``cache`` before the app picks a backend."""
+
+    def __init__(self):
+        self.backend = MemoryBackend()
+
+    def get(self, key):
+        value = self.backend.get(key)
+        metrics.cache_requests.labels(key.partition(':')[0], 'miss' if value is None else 'hit').inc()
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+
+cache = SharedCache()
+
+
+def init_app(app):
+    url = app.config.get('REDIS_URL')
+    if not url:
+        return
+    try:
+        backend = RedisBackend(url)
+        backend.client.ping()
+        cache.backend = backend
+    except Exception as e:
+        logger.warning(f"REDIS_UNAVAILABLE url={url} error={e}; using in-process cache")
@@ -2,14 +2,16 @@ import os
 from datetime import timedelta
 from dotenv import load_dotenv
 
+import keys
+
 basedir = os.path.abspath(os.path.dirname(__file__))
 load_dotenv(os.path.join(basedir, '..', 'config', 'production.env'))
 
 
 class Config:
     """Base configuration"""
-    SECRET_KEY = os.environ.get('SECRET_KEY', os.urandom(32).hex())
-    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', os.urandom(32).hex())
+    SECRET_KEY = keys.load('SECRET_KEY')
+    JWT_SECRET_KEY = keys.load('JWT_SECRET_KEY')
 
     # Database
     DB_HOST = os.environ.get('DB_HOST', '127.0.0.1')
@@ -17,7 +19,7 @@ class Config:
     DB_NAME = os.environ.get('DB_NAME', 'promail')
     DB_USER = os.environ.get('DB_USER', 'promail')
     DB_PASS = os.environ.get('DB_PASS', '')
-    SQLALCHEMY_DATABASE_URI = (
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or (
         f"mysql+pymysql://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
         f"?charset=utf8mb4"
     )
@@ -32,9 +34,105 @@ class Config:
     IMAP_PORT = int(os.environ.get('IMAP_PORT', 993))
     SMTP_HOST = os.environ.get('SMTP_HOST', '127.0.0.1')
     SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
-
-    # Session
-    SESSION_TYPE = 'filesystem'
+    SENT_FOLDER = os.environ.get('SENT_FOLDER', 'Sent')
+    IMAP_POOL_MAX_IDLE = int(os.environ.get('IMAP_POOL_MAX_IDLE', 2))
+    IMAP_POOL_IDLE_TIMEOUT = int(os.environ.get('IMAP_POOL_IDLE_TIMEOUT', 300))
+    IMAP_COMPRESS = os.environ.get('IMAP_COMPRESS', 'false').lower() == 'true'
+    IMAP_COMPRESS_LEVEL = int(os.environ.get('IMAP_COMPRESS_LEVEL', 6))
+
+    # Backend timeouts (seconds) and circuit breakers
+    IMAP_TIMEOUT = int(os.environ.get('IMAP_TIMEOUT', 10))
+    SMTP_TIMEOUT = int(os.environ.get('SMTP_TIMEOUT', 15))
+    SUBPROCESS_TIMEOUT = int(os.environ.get('SUBPROCESS_TIMEOUT', 5))
+    SUBPROCESS_MAX_TIMEOUT = int(os.environ.get('SUBPROCESS_MAX_TIMEOUT', 30))
+    REQUEST_DEADLINE = int(os.environ.get('REQUEST_DEADLINE', 25))
+    CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 5))
+    CIRCUIT_RESET_TIMEOUT = int(os.environ.get('CIRCUIT_RESET_TIMEOUT', 30))
+
+    # Cache / background work
+    REDIS_URL = os.environ.get('REDIS_URL', '')
+    MAIL_CACHE_TTL = int(os.environ.get('MAIL_CACHE_TTL', 30))
+    WARMUP_WORKERS = int(os.environ.get('WARMUP_WORKERS', 2))
+    WARMUP_MAX_PENDING = int(os.environ.get('WARMUP_MAX_PENDING', 32))
+    SINGLEFLIGHT_RESULT_TTL = int(os.environ.get('SINGLEFLIGHT_RESULT_TTL', 2))
+    SINGLEFLIGHT_LOCK_TTL = int(os.environ.get('SINGLEFLIGHT_LOCK_TTL', 15))
+    SINGLEFLIGHT_WAIT = int(os.environ.get('SINGLEFLIGHT_WAIT', 10))
+    SINGLEFLIGHT_DIR = os.environ.get('SINGLEFLIGHT_DIR', os.path.join(basedir, 'instance', 'singleflight'))
+    ACCOUNT_CACHE_TTL = int(os.environ.get('ACCOUNT_CACHE_TTL', 300))
+    ACCOUNT_CACHE_POLL = float(os.environ.get('ACCOUNT_CACHE_POLL', 2))
+    SETTINGS_POLL_INTERVAL = int(os.environ.get('SETTINGS_POLL_INTERVAL', 5))
+    SETTINGS_MAX_AGE = int(os.environ.get('SETTINGS_MAX_AGE', 300))
+    DASHBOARD_INTERVAL = int(os.environ.get('DASHBOARD_INTERVAL', 30))
+    DASHBOARD_IDLE_TIMEOUT = int(os.environ.get('DASHBOARD_IDLE_TIMEOUT', 600))
+    LOGIN_LOG_COUNT_CAP = int(os.environ.get('LOGIN_LOG_COUNT_CAP', 10000))
+    LOGIN_LOG_COUNT_TTL = int(os.environ.get('LOGIN_LOG_COUNT_TTL', 60))
+    LOGIN_ROLLUP_BATCH = int(os.environ.get('LOGIN_ROLLUP_BATCH', 50000))
+    LOGIN_ROLLUP_LAG = int(os.environ.get('LOGIN_ROLLUP_LAG', 60))
+    LOGIN_LOG_LIVE_MONTHS = int(os.environ.get('LOGIN_LOG_LIVE_MONTHS', 1))
+    LOGIN_LOG_RETENTION_MONTHS = int(os.environ.get('LOGIN_LOG_RETENTION_MONTHS', 12))
+    LOGIN_STATS_RETENTION_DAYS = int(os.environ.get('LOGIN_STATS_RETENTION_DAYS', 730))
+
+    # Bulk account import
+    BULK_IMPORT_MAX_ROWS = int(os.environ.get('BULK_IMPORT_MAX_ROWS', 50000))
+    BULK_IMPORT_CHUNK_SIZE = int(os.environ.get('BULK_IMPORT_CHUNK_SIZE', 500))
+    BULK_IMPORT_PROCESSES = int(os.environ.get('BULK_IMPORT_PROCESSES', 0)) or None  # 0 = every core
+    BULK_IMPORT_JOB_TTL = int(os.environ.get('BULK_IMPORT_JOB_TTL', 86400))
+    BULK_IMPORT_STALE = int(os.environ.get('BULK_IMPORT_STALE', 600))  # no progress for this long = worker died
+
+    # Maildir provisioning (layout matches dovecot's mail_location)
+    MAILDIR_ROOT = os.environ.get('MAILDIR_ROOT', '/var/vmail')
+    MAILDIR_OWNER = os.environ.get('MAILDIR_OWNER', 'vmail')
+    MAILDIR_DEPROVISION = os.environ.get('MAILDIR_DEPROVISION', 'archive')  # archive | delete
+    MAILDIR_MAX_ATTEMPTS = int(os.environ.get('MAILDIR_MAX_ATTEMPTS', 8))
+    MAILDIR_RETRY_BASE = int(os.environ.get('MAILDIR_RETRY_BASE', 5))
+    MAILDIR_POLL_INTERVAL = int(os.environ.get('MAILDIR_POLL_INTERVAL', 5))
+    MAILDIR_WORKER = os.environ.get('MAILDIR_WORKER', 'inprocess')  # inprocess | external
+
+    # Postfix queue inspection
+    MAILQUEUE_POSTQUEUE = os.environ.get('MAILQUEUE_POSTQUEUE', 'postqueue')
+    MAILQUEUE_POSTSUPER = os.environ.get('MAILQUEUE_POSTSUPER', 'sudo -n /usr/sbin/postsuper')
+    MAILQUEUE_SUMMARY_TTL = int(os.environ.get('MAILQUEUE_SUMMARY_TTL', 30))
+    MAILQUEUE_SCAN_TIMEOUT = int(os.environ.get('MAILQUEUE_SCAN_TIMEOUT', 25))
+
+    # Mailbox usage scanner
+    USAGE_SOURCE = os.environ.get('USAGE_SOURCE', 'auto')  # auto | disk | imap
+    USAGE_SCAN_WORKERS = int(os.environ.get('USAGE_SCAN_WORKERS', 4))
+    USAGE_CACHE_TTL = int(os.environ.get('USAGE_CACHE_TTL', 60))
+
+    # Mail server log viewer (name=path pairs; rotations next to each file are found automatically)
+    MAILLOG_SOURCES = os.environ.get(
+        'MAILLOG_SOURCES',
+        'mail=/var/log/mail.log,dovecot=/var/log/dovecot.log,dovecot-info=/var/log/dovecot-info.log')
+    MAILLOG_INDEX_STEP = int(os.environ.get('MAILLOG_INDEX_STEP', 1 << 20))
+    MAILLOG_GZIP_STEP = int(os.environ.get('MAILLOG_GZIP_STEP', 8 << 20))
+    MAILLOG_MAX_SCAN = int(os.environ.get('MAILLOG_MAX_SCAN', 256 << 20))
+    MAILLOG_MAX_FILES = int(os.environ.get('MAILLOG_MAX_FILES', 10))
+
+    # Prometheus metrics (/metrics on the gunicorn port; per-process files are merged on scrape)
+    METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(basedir, 'instance', 'metrics'))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+    # Request profiling (admins send X-Profile: cpu|sample|memory) and the slow-request log
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(basedir, 'instance', 'profiles'))
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.005))
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 200))
+    SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 2.0))
+
+    # N+1 detection: a statement shape run this often in one request is logged (or raised, for test runs)
+    SQL_REPEAT_THRESHOLD = int(os.environ.get('SQL_REPEAT_THRESHOLD', 5))
+    SQL_ASSERT_REPEATS = os.environ.get('SQL_ASSERT_REPEATS', 'false').lower() == 'true'
+
+    # Login audit log batching
+    AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 200))
+    AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 2.0))
+    AUDIT_SPOOL_PATH = os.environ.get('AUDIT_SPOOL_PATH', os.path.join(basedir, 'instance', 'audit_spool.jsonl'))
+
+    # Session: 'redis' or 'sqlalchemy' (server-side store), 'filesystem' is the legacy Flask-Session backend
+    SESSION_TYPE = os.environ.get('SESSION_TYPE', 'redis' if os.environ.get('REDIS_URL') else 'sqlalchemy')
+    SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL', os.environ.get('REDIS_URL', ''))
+    SESSION_SWEEP_PROBABILITY = float(os.environ.get('SESSION_SWEEP_PROBABILITY', 0.001))
+    SESSION_KEY_PREFIX = 'session:'
     SESSION_FILE_DIR = os.path.join(basedir, 'sessions')
     PERMANENT_SESSION_LIFETIME = timedelta(hours=1)
     SESSION_COOKIE_SECURE = True
@@ -45,7 +143,16 @@ class Config:
     WTF_CSRF_ENABLED = True
     MAX_LOGIN_ATTEMPTS = int(os.environ.get('MAX_LOGIN_ATTEMPTS', 5))
     LOCKOUT_DURATION = int(os.environ.get('LOCKOUT_DURATION', 900))
+    MAX_LOGIN_ATTEMPTS_IP = int(os.environ.get('MAX_LOGIN_ATTEMPTS_IP', 20))
+    MAX_LOGIN_ATTEMPTS_SUBNET = int(os.environ.get('MAX_LOGIN_ATTEMPTS_SUBNET', 100))
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_ATTACHMENT_SIZE', 26214400))
+    TOKEN_REVOCATION_REFRESH = int(os.environ.get('TOKEN_REVOCATION_REFRESH', 300))
+    TOKEN_REVOCATION_POLL = float(os.environ.get('TOKEN_REVOCATION_POLL', 2))
+    BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+    BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', 2))
+    BCRYPT_MAX_QUEUE = int(os.environ.get('BCRYPT_MAX_QUEUE', 16))
+    BCRYPT_TIMEOUT = int(os.environ.get('BCRYPT_TIMEOUT', 10))
+    BCRYPT_SLOT_DIR = os.environ.get('BCRYPT_SLOT_DIR', os.path.join(basedir, 'instance', 'bcrypt_slots'))
 
     # Upload
     UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
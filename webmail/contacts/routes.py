@@ -156,7 +156,7 @@ def toggle_favorite(contact_id):
 @contacts_bp.route('/api/groups', methods=['GET'])
 @login_required
 def list_groups():
-    groups = ContactGroup.query.filter_by(account_id=current_user.id).all()
+    groups = ContactGroup.with_counts(ContactGroup.query.filter_by(account_id=current_user.id))
     return jsonify([g.to_dict() for g in groups])
 
 
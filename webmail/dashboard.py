@@ -0,0 +1,190 @@
+"""
+ProMail — admin dashboard snapshot
+Counts, disk, uptime and service states are collected by a background thread
+on a fixed interval instead of on every page load. Service states come from
+one ``systemctl is-active`` call for all units. With a shared cache one worker
+collects per interval and the others read its result. The thread stops when
+nobody has looked at the dashboard for a while.
+"""
+
+import os, shutil, threading, time, logging
+
+from sqlalchemy import func, select
+
+import resilience, loginlog
+from cache import cache
+from models import db, Domain, Account, Alias, LoginLog
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_KEY = 'dashboard:snapshot'
+LOCK_KEY = 'dashboard:collecting'
+
+SERVICES = [
+    ('postfix', 'Postfix SMTP'),
+    ('dovecot', 'Dovecot IMAP'),
+    ('opendkim', 'OpenDKIM'),
+    ('spamassassin', 'SpamAssassin'),
+    ('clamav-daemon', 'ClamAV'),
+    ('nginx', 'Nginx'),
+    ('fail2ban', 'Fail2Ban'),
+    ('mariadb', 'MariaDB'),
+]
+
+
+def _count(model, *criteria):
+    return select(func.count()).select_from(model).where(*criteria).scalar_subquery()
+
+
+def collect_counts():
+    """Every entity counter in a single round trip; login counts come from the daily rollups."""
+    row = db.session.execute(select(
+        _count(Domain).label('total_domains'),
+        _count(Domain, Domain.active.is_(True)).label('active_domains'),
+        _count(Account).label('total_accounts'),
+        _count(Account, Account.active.is_(True)).label('active_accounts'),
+        _count(Alias).label('total_aliases'),
+    )).one()
+    counts = dict(row._mapping)
+    counts['logins_today'], counts['failed_logins_today'] = loginlog.today_counts()
+    return counts
+
+
+def collect_recent_logins(limit=15):
+    recent = LoginLog.query.order_by(LoginLog.created_at.desc()).limit(limit).all()
+    return [
+        {
+            'id': l.id, 'email': l.email, 'ip_address': l.ip_address,
+            'success': l.success, 'user_agent': l.user_agent or '',
+            'created_at': l.created_at.isoformat() if l.created_at else '',
+        }
+        for l in recent
+    ]
+
+
+def collect_system():
+    info = {'disk_percent': 0, 'disk_total_bytes': 0, 'disk_free_bytes': 0, 'uptime': 'Unknown'}
+    try:
+        usage = shutil.disk_usage('/')
+        info.update(disk_percent=round(usage.used / usage.total * 100, 1),
+                    disk_total_bytes=usage.total, disk_free_bytes=usage.free)
+    except OSError:
+        pass
+    try:
+        with open('/proc/uptime') as fh:
+            info['uptime'] = _format_uptime(float(fh.read().split()[0]))
+    except (OSError, ValueError, IndexError):
+        pass
+    return info
+
+
+def _format_uptime(seconds):
+    """Same wording as ``uptime -p``."""
+    minutes = int(seconds // 60)
+    parts = []
+    for unit, size in (('week', 10080), ('day', 1440), ('hour', 60), ('minute', 1)):
+        n, minutes = divmod(minutes, size)
+        if n:
+            parts.append(f"{n} {unit}{'s' if n != 1 else ''}")
+    return 'up ' + (', '.join(parts) or '0 minutes')
+
+
+def collect_services():
+    """{unit: True/False}, or None for every unit if systemd couldn't be asked."""
+    names = [name for name, _ in SERVICES]
+    try:
+        # One process for all units; prints one state per line, in order
+        result = resilience.run(['systemctl', 'is-active'] + names)
+        states = result.stdout.split()
+    except Exception as e:
+        logger.warning(f"DASHBOARD_SERVICES_FAILED error={e}")
+        return {name: None for name in names}
+    if len(states) != len(names):
+        return {name: None for name in names}
+    return {name: state == 'active' for name, state in zip(names, states)}
+
+
+def collect():
+    return {
+        'collected_at': time.time(),
+        'stats': collect_counts(),
+        'system': collect_system(),
+        'services': collect_services(),
+        'recent_logins': collect_recent_logins(),
+    }
+
+
+class DashboardCollector:
+    def __init__(self, interval=30, idle_timeout=600):
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.app = None
+        self._snapshot = None
+        self._last_read = 0.0
+        self._pid = None
+        self._lock = threading.Lock()
+        self.collections = 0
+        self.failures = 0
+
+    def snapshot(self):
+        """Return (snapshot, age_seconds); collects inline only if there is nothing usable yet."""
+        self._last_read = time.monotonic()
+        self._ensure_thread()
+        snap = self._freshest()
+        if snap is None or time.time() - snap['collected_at'] > self.interval * 4:
+            with self._lock:
+                snap = self._freshest()
+                if snap is None or time.time() - snap['collected_at'] > self.interval * 4:
+                    snap = self._collect()
+        return snap, max(0.0, round(time.time() - snap['collected_at'], 1))
+
+    def _freshest(self):
+        local = self._snapshot
+        if local and time.time() - local['collected_at'] < self.interval:
+            return local
+        shared = cache.get(SNAPSHOT_KEY)
+        if shared and (not local or shared['collected_at'] > local['collected_at']):
+            self._snapshot = shared
+        return self._snapshot
+
+    def _collect(self):
+        with self.app.app_context():
+            try:
+                snap = collect()
+            finally:
+                db.session.remove()
+        self._snapshot = snap
+        cache.set(SNAPSHOT_KEY, snap, ttl=self.interval * 10)
+        self.collections += 1
+        return snap
+
+    # ── background refresh ──
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() or self.app is None:
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self._loop, daemon=True, name='promail-dashboard').start()
+
+    def _loop(self):
+        while time.monotonic() - self._last_read < self.idle_timeout:
+            time.sleep(self.interval)
+            # One collector per interval across workers; the rest pick up its snapshot
+            if not cache.add(LOCK_KEY, os.getpid(), ttl=max(1, self.interval - 1)):
+                continue
+            try:
+                with self._lock:
+                    self._collect()
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"DASHBOARD_COLLECT_FAILED error={e}")
+        self._pid = None  # idle: the next read restarts the thread
+
+
+collector = DashboardCollector()
+
+
+def init_app(app):
+    collector.app = app
+    collector.interval = app.config.get('DASHBOARD_INTERVAL', collector.interval)
+    collector.idle_timeout = app.config.get('DASHBOARD_IDLE_TIMEOUT', collector.idle_timeout)
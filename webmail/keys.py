@@ -0,0 +1,53 @@
+"""
+ProMail — application secrets
+SECRET_KEY, JWT_SECRET_KEY and FERNET_KEY are read from the environment.
+A missing one is generated once and persisted under KEYS_DIR, so every
+worker and every restart agrees on it instead of inventing its own.
+"""
+
+import os, base64, secrets, tempfile, logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_KEYS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance')
+
+_loaded = {}
+
+
+def hex_key():
+    return secrets.token_hex(32)
+
+
+def fernet_key():
+    """Same format as Fernet.generate_key(), without importing cryptography."""
+    return base64.urlsafe_b64encode(os.urandom(32)).decode()
+
+
+def load(name, generate=hex_key):
+    if name not in _loaded:
+        _loaded[name] = os.environ.get(name) or _persisted(name, generate)
+    return _loaded[name]
+
+
+def _persisted(name, generate):
+    keys_dir = os.environ.get('KEYS_DIR', DEFAULT_KEYS_DIR)
+    path = os.path.join(keys_dir, name.lower())
+    try:
+        with open(path) as fh:
+            return fh.read().strip()
+    except FileNotFoundError:
+        pass
+    os.makedirs(keys_dir, mode=0o700, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=keys_dir)
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            fh.write(generate())
+        # link() fails if another process got there first; both then read the winner's file
+        os.link(tmp, path)
+        logger.warning(f"KEY_GENERATED name={name} path={path}; set {name} in production.env")
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp)
+    with open(path) as fh:
+        return fh.read().strip()
@@ -0,0 +1,363 @@
+"""
+ProMail — login audit log queries and maintenance
+Keyset pagination over (created_at, id), newest first, with filters that map
+onto the composite indexes declared on LoginLog. Totals are cached briefly and
+capped (or taken from table statistics when unfiltered), so a page never
+needs a full COUNT(*) over the table.
+
+An incremental rollup folds new rows into per-day domain and account counts
+(tracked by an id watermark), so dashboards and trends never scan raw rows.
+Rows older than the live window are moved into monthly ``login_log_YYYYMM``
+archive tables, which are dropped once past the retention period.
+"""
+
+import re, base64, hashlib, json, logging
+from datetime import datetime, date, timedelta
+
+import click
+from sqlalchemy import MetaData, Table, Column, Index, and_, or_, case, func, inspect, select, text
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from cache import cache
+from models import db, LoginLog, LoginStatDomain, LoginStatAccount, LoginRollupState
+
+logger = logging.getLogger(__name__)
+
+_settings = {
+    'count_cap': 10000, 'count_ttl': 60, 'max_per_page': 200,
+    'rollup_batch': 50000, 'rollup_lag': 60,
+    'live_months': 1, 'retention_months': 12, 'stats_retention_days': 730,
+}
+
+ROLLUP_NAME = 'login_log'
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+# ── cursors ──
+
+def encode_cursor(entry):
+    raw = f'{entry.created_at.isoformat()}|{entry.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, entry_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(entry_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidQuery('Invalid cursor')
+
+
+# ── filters ──
+
+def _parse_day(value, name):
+    try:
+        return datetime.combine(date.fromisoformat(value), datetime.min.time())
+    except ValueError:
+        raise InvalidQuery(f'Invalid {name} date (expected YYYY-MM-DD)')
+
+
+def parse_filters(args):
+    """Normalise request args into the filters ``page`` understands."""
+    filters = {}
+    log_type = args.get('type', 'all')
+    if log_type in ('success', 'failed'):
+        filters['success'] = log_type == 'success'
+    email = (args.get('email') or '').strip().lower()
+    if email:
+        filters['email'] = email
+    ip = (args.get('ip') or '').strip()
+    if ip:
+        filters['ip'] = ip
+    if args.get('from'):
+        filters['since'] = _parse_day(args['from'], 'from')
+    if args.get('to'):
+        filters['until'] = _parse_day(args['to'], 'to') + timedelta(days=1)
+    return filters
+
+
+def _apply(query, filters):
+    # Equality on the leading column of an index, then a range on created_at
+    if 'email' in filters:
+        email = filters['email']
+        if email.endswith('*'):
+            query = query.filter(LoginLog.email.startswith(email[:-1], autoescape=True))
+        else:
+            query = query.filter(LoginLog.email == email)
+    if 'ip' in filters:
+        query = query.filter(LoginLog.ip_address == filters['ip'])
+    if 'success' in filters:
+        query = query.filter(LoginLog.success == filters['success'])
+    if 'since' in filters:
+        query = query.filter(LoginLog.created_at >= filters['since'])
+    if 'until' in filters:
+        query = query.filter(LoginLog.created_at < filters['until'])
+    return query
+
+
+# ── pages ──
+
+def page(filters, cursor=None, direction='next', per_page=50):
+    """Return (entries, next_cursor, prev_cursor), newest first."""
+    per_page = max(1, min(per_page, _settings['max_per_page']))
+    query = _apply(LoginLog.query, filters)
+    if cursor:
+        created_at, entry_id = decode_cursor(cursor)
+        if direction == 'prev':
+            query = query.filter(or_(LoginLog.created_at > created_at,
+                                     and_(LoginLog.created_at == created_at, LoginLog.id > entry_id)))
+            query = query.order_by(LoginLog.created_at.asc(), LoginLog.id.asc())
+        else:
+            query = query.filter(or_(LoginLog.created_at < created_at,
+                                     and_(LoginLog.created_at == created_at, LoginLog.id < entry_id)))
+    if not cursor or direction != 'prev':
+        query = query.order_by(LoginLog.created_at.desc(), LoginLog.id.desc())
+
+    # One extra row tells us whether there is another page in this direction
+    rows = query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if cursor and direction == 'prev':
+        rows.reverse()
+        has_newer, has_older = more, True
+    else:
+        has_newer, has_older = bool(cursor), more
+    next_cursor = encode_cursor(rows[-1]) if rows and has_older else None
+    prev_cursor = encode_cursor(rows[0]) if rows and has_newer else None
+    return rows, next_cursor, prev_cursor
+
+
+def total(filters):
+    """(count, approximate): cached, capped at LOGIN_LOG_COUNT_CAP, table statistics when unfiltered."""
+    key = 'loginlog:count:' + hashlib.md5(
+        json.dumps(filters, sort_keys=True, default=str).encode()).hexdigest()
+    cached = cache.get(key)
+    if cached is not None:
+        return cached[0], cached[1]
+    count, approximate = None, True
+    if not filters:
+        count = _table_estimate()
+    if count is None:
+        cap = _settings['count_cap']
+        capped = _apply(db.session.query(LoginLog.id), filters).limit(cap + 1).subquery()
+        count = db.session.query(db.func.count()).select_from(capped).scalar()
+        approximate = count > cap
+        count = min(count, cap)
+    cache.set(key, [count, approximate], ttl=_settings['count_ttl'])
+    return count, approximate
+
+
+def _table_estimate():
+    if db.engine.dialect.name != 'mysql':
+        return None
+    try:
+        return db.session.execute(text(
+            "SELECT TABLE_ROWS FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :name"
+        ), {'name': LoginLog.__tablename__}).scalar()
+    except Exception as e:
+        logger.warning(f"LOGIN_LOG_ESTIMATE_FAILED error={e}")
+        return None
+
+
+def to_dict(entry):
+    return {
+        'id': entry.id, 'email': entry.email, 'ip_address': entry.ip_address,
+        'success': entry.success, 'user_agent': entry.user_agent or '',
+        'created_at': entry.created_at.isoformat() if entry.created_at else '',
+    }
+
+
+# ── rollups ──
+
+def _domain_of(email):
+    return email.rsplit('@', 1)[1] if '@' in email else ''
+
+
+def _watermark(conn, lock=False):
+    state = LoginRollupState.__table__
+    query = select(state.c.last_id).where(state.c.name == ROLLUP_NAME)
+    return conn.execute(query.with_for_update() if lock else query).scalar()
+
+
+def _add_counts(conn, table, counts, identity, chunk=1000):
+    """Add ``{key: [success, failure]}`` onto existing rows, inserting the missing ones."""
+    if conn.dialect.name == 'mysql':
+        rows = [dict(identity(key), success=ok, failure=failed) for key, (ok, failed) in counts.items()]
+        # One multi-row upsert per chunk (chunked only to stay well under max_allowed_packet)
+        for start in range(0, len(rows), chunk):
+            ins = mysql_insert(table).values(rows[start:start + chunk])
+            conn.execute(ins.on_duplicate_key_update(success=table.c.success + ins.inserted.success,
+                                                     failure=table.c.failure + ins.inserted.failure))
+        return
+    for key, (ok, failed) in counts.items():
+        ident = identity(key)
+        where = [table.c[name] == ident[name] for name in table.primary_key.columns.keys()]
+        updated = conn.execute(table.update().where(*where).values(
+            success=table.c.success + ok, failure=table.c.failure + failed)).rowcount
+        if not updated:
+            conn.execute(table.insert().values(success=ok, failure=failed, **ident))
+
+
+def rollup(batch_size=None, lag=None):
+    """Fold login_log rows past the watermark into the daily tables; returns rows processed."""
+    batch_size = batch_size or _settings['rollup_batch']
+    lag = _settings['rollup_lag'] if lag is None else lag
+    log, state = LoginLog.__table__, LoginRollupState.__table__
+    processed = 0
+    while True:
+        with db.engine.begin() as conn:
+            last_id = _watermark(conn, lock=True)
+            if last_id is None:
+                conn.execute(state.insert().values(name=ROLLUP_NAME, last_id=0, updated_at=datetime.utcnow()))
+                last_id = 0
+            # Skip the newest rows: a batch insert that allocated lower ids may still be committing
+            settled = datetime.utcnow() - timedelta(seconds=lag)
+            window = (select(log.c.id).where(log.c.id > last_id, log.c.created_at <= settled)
+                      .order_by(log.c.id).limit(batch_size).subquery())
+            upper = conn.execute(select(func.max(window.c.id))).scalar()
+            if upper is None:
+                break
+
+            day = func.date(log.c.created_at)
+            groups = conn.execute(
+                select(day, log.c.email, log.c.success, func.count())
+                .where(log.c.id > last_id, log.c.id <= upper)
+                .group_by(day, log.c.email, log.c.success)).all()
+            per_account, per_domain = {}, {}
+            for day_value, email, success, n in groups:
+                day_value, email = date.fromisoformat(str(day_value)), (email or '')[:255]
+                slot = 0 if success else 1
+                per_account.setdefault((email, day_value), [0, 0])[slot] += n
+                per_domain.setdefault((_domain_of(email), day_value), [0, 0])[slot] += n
+                processed += n
+            _add_counts(conn, LoginStatAccount.__table__, per_account,
+                        lambda k: {'email': k[0], 'day': k[1], 'domain': _domain_of(k[0])})
+            _add_counts(conn, LoginStatDomain.__table__, per_domain,
+                        lambda k: {'domain': k[0], 'day': k[1]})
+            conn.execute(state.update().where(state.c.name == ROLLUP_NAME)
+                         .values(last_id=upper, updated_at=datetime.utcnow()))
+    if processed:
+        logger.info(f"LOGIN_ROLLUP rows={processed}")
+    return processed
+
+
+def today_counts():
+    """(logins, failures) for the current UTC day: rollup totals plus rows not rolled up yet."""
+    today = datetime.utcnow().date()
+    stats, log = LoginStatDomain.__table__, LoginLog.__table__
+    with db.engine.connect() as conn:
+        ok, failed = conn.execute(select(
+            func.coalesce(func.sum(stats.c.success), 0),
+            func.coalesce(func.sum(stats.c.failure), 0)).where(stats.c.day == today)).one()
+        last_id = _watermark(conn) or 0
+        tail, tail_failed = conn.execute(select(
+            func.count(), func.coalesce(func.sum(case((log.c.success == False, 1), else_=0)), 0))
+            .where(log.c.id > last_id,
+                   log.c.created_at >= datetime.combine(today, datetime.min.time()))).one()
+    return int(ok + failed + tail), int(failed + tail_failed)
+
+
+def trend(days=30, domain=None, email=None):
+    """Per-day success/failure counts from the rollup tables, oldest first."""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    table = LoginStatAccount.__table__ if email else LoginStatDomain.__table__
+    query = (select(table.c.day, func.sum(table.c.success), func.sum(table.c.failure))
+             .where(table.c.day >= since).group_by(table.c.day).order_by(table.c.day))
+    if email:
+        query = query.where(table.c.email == email)
+    elif domain:
+        query = query.where(table.c.domain == domain)
+    with db.engine.connect() as conn:
+        return [{'day': str(d), 'success': int(ok or 0), 'failure': int(failed or 0)}
+                for d, ok, failed in conn.execute(query)]
+
+
+# ── archive rotation and retention ──
+
+def _month_start(when, offset=0):
+    month = when.year * 12 + when.month - 1 + offset
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def archive_table(month):
+    name = f'login_log_{month}'
+    columns = [Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False)
+               for c in LoginLog.__table__.columns]
+    return Table(name, MetaData(), *columns, Index(f'ix_{name}_created', 'created_at', 'id'))
+
+
+def archive(live_months=None, batch_size=5000):
+    """Move rolled-up rows older than the live window into monthly archive tables."""
+    live_months = _settings['live_months'] if live_months is None else live_months
+    cutoff = _month_start(datetime.utcnow(), -live_months)
+    log = LoginLog.__table__
+    moved = 0
+    while True:
+        with db.engine.connect() as conn:
+            last_id = _watermark(conn) or 0
+            rows = conn.execute(
+                log.select().where(log.c.created_at < cutoff, log.c.id <= last_id)
+                .order_by(log.c.created_at, log.c.id).limit(batch_size)).mappings().all()
+        if not rows:
+            break
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(row['created_at'].strftime('%Y%m'), []).append(dict(row))
+        tables = {month: archive_table(month) for month in by_month}
+        for table in tables.values():
+            table.create(db.engine, checkfirst=True)  # DDL outside the move transaction
+        with db.engine.begin() as conn:
+            for month, items in by_month.items():
+                conn.execute(tables[month].insert(), items)
+            conn.execute(log.delete().where(log.c.id.in_([row['id'] for row in rows])))
+        moved += len(rows)
+    if moved:
+        logger.info(f"LOGIN_LOG_ARCHIVED rows={moved} before={cutoff:%Y-%m-%d}")
+    return moved
+
+
+def apply_retention(retention_months=None, stats_retention_days=None):
+    """Drop archive tables and rollup rows older than the retention periods."""
+    retention_months = retention_months or _settings['retention_months']
+    stats_retention_days = stats_retention_days or _settings['stats_retention_days']
+    oldest = _month_start(datetime.utcnow(), -retention_months).strftime('%Y%m')
+    dropped = []
+    for name in inspect(db.engine).get_table_names():
+        match = re.fullmatch(r'login_log_(\d{6})', name)
+        if match and match.group(1) < oldest:
+            archive_table(match.group(1)).drop(db.engine, checkfirst=True)
+            dropped.append(name)
+    since = datetime.utcnow().date() - timedelta(days=stats_retention_days)
+    with db.engine.begin() as conn:
+        for table in (LoginStatDomain.__table__, LoginStatAccount.__table__):
+            conn.execute(table.delete().where(table.c.day < since))
+    if dropped:
+        logger.info(f"LOGIN_LOG_ARCHIVES_DROPPED tables={','.join(dropped)}")
+    return dropped
+
+
+def init_app(app):
+    for key, name in (('count_cap', 'LOGIN_LOG_COUNT_CAP'), ('count_ttl', 'LOGIN_LOG_COUNT_TTL'),
+                      ('rollup_batch', 'LOGIN_ROLLUP_BATCH'), ('rollup_lag', 'LOGIN_ROLLUP_LAG'),
+                      ('live_months', 'LOGIN_LOG_LIVE_MONTHS'),
+                      ('retention_months', 'LOGIN_LOG_RETENTION_MONTHS'),
+                      ('stats_retention_days', 'LOGIN_STATS_RETENTION_DAYS')):
+        _settings[key] = app.config.get(name, _settings[key])
+
+    @app.cli.command('loginlog-rollup')
+    def rollup_command():
+        """Fold new login_log rows into the daily rollup tables (run every few minutes)."""
+        click.echo(f'rolled up {rollup()} rows')
+
+    @app.cli.command('loginlog-rotate')
+    def rotate_command():
+        """Roll up, archive rows past the live window and apply retention (run daily)."""
+        rollup()
+        moved = archive()
+        dropped = apply_retention()
+        click.echo(f'archived {moved} rows, dropped {len(dropped)} archive tables')
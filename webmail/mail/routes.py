@@ -1,6 +1,5 @@
 import imaplib
 import email
-import smtplib
 import os
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
@@ -12,8 +11,10 @@ from datetime import datetime
 from flask import render_template, redirect, url_for, request, flash, jsonify, current_app
 from flask_login import login_required, current_user
 from mail import mail_bp
-import bleach
 import logging
+import resilience
+import metrics
+import profiling
 
 logger = logging.getLogger(__name__)
 
@@ -41,8 +42,10 @@ def get_imap_connection():
     try:
         host = current_app.config['IMAP_HOST']
         port = current_app.config['IMAP_PORT']
-        mail_conn = imaplib.IMAP4_SSL(host, port)
-        mail_conn.login(current_user.email, current_user._imap_password)
+        backend = f'imap:{host}:{port}'
+        with resilience.breaker(backend).guard():
+            mail_conn = imaplib.IMAP4_SSL(host, port, timeout=resilience.timeout_for('imap', backend))
+            mail_conn.login(current_user.email, current_user._imap_password)
         return mail_conn
     except Exception as e:
         logger.error(f"IMAP connection failed for {current_user.email}: {e}")
@@ -63,6 +66,7 @@ def decode_mime_header(header_value):
     return result
 
 
+@profiling.watch
 def parse_email_message(raw_email, uid):
     """Parse raw email into a structured dict"""
     msg = email.message_from_bytes(raw_email)
@@ -115,8 +119,9 @@ def parse_email_message(raw_email, uid):
             else:
                 body_text = payload.decode(msg.get_content_charset() or 'utf-8', errors='replace')
 
-    # Sanitize HTML
+    # Sanitize HTML (bleach pulls in html5lib; only load it when a message has HTML)
     if body_html:
+        import bleach
         body_html = bleach.clean(
             body_html,
             tags=['p', 'br', 'b', 'i', 'u', 'strong', 'em', 'a', 'ul', 'ol', 'li',
@@ -321,7 +326,10 @@ def compose():
             smtp_host = current_app.config['SMTP_HOST']
             smtp_port = current_app.config['SMTP_PORT']
 
-            with smtplib.SMTP(smtp_host, smtp_port) as smtp:
+            backend = f'smtp:{smtp_host}:{smtp_port}'
+            with resilience.breaker(backend).guard(), \
+                    metrics.SMTP(smtp_host, smtp_port,
+                                 timeout=resilience.timeout_for('smtp', backend)) as smtp:
                 smtp.starttls()
                 smtp.login(current_user.email, current_user._imap_password)
                 smtp.sendmail(current_user.email, all_recipients, msg.as_string())
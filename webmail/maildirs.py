@@ -0,0 +1,265 @@
+"""
+ProMail — maildir provisioning
+Account create/delete only enqueue a row in ``maildir_tasks``; a worker
+creates the Dovecot layout (``<root>/<domain>/<user>/Maildir/{cur,new,tmp}``)
+with os.mkdir/os.chown, or archives the mailbox on removal. Tasks are
+idempotent, failed ones are retried with backoff, and a newer task for the
+same address supersedes any still-pending one. The worker runs either as a
+thread in each web worker or as ``flask maildirs-worker`` under its own unit
+(which needs to be allowed to chown to vmail).
+"""
+
+import os, pwd, shutil, threading, time, logging
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import and_, or_, select
+
+from models import db, MaildirTask
+
+logger = logging.getLogger(__name__)
+
+ACTIONS = ('create', 'remove')
+OPEN = ('pending', 'retry')
+
+_settings = {
+    'root': '/var/vmail', 'owner': 'vmail', 'uid': None, 'gid': None,
+    'deprovision': 'archive', 'max_attempts': 8, 'retry_base': 5, 'lease': 300,
+    'poll_interval': 5, 'mode': 'inprocess',
+}
+
+
+class PermanentError(Exception):
+    """Retrying can't help (e.g. an address that doesn't map to a safe path)."""
+
+
+# ── filesystem ──
+
+def _owner():
+    if _settings['uid'] is None:
+        try:
+            entry = pwd.getpwnam(_settings['owner'])
+            _settings['uid'], _settings['gid'] = entry.pw_uid, entry.pw_gid
+        except KeyError:
+            _settings['uid'] = _settings['gid'] = 5000  # installer's fixed vmail ids
+    return _settings['uid'], _settings['gid']
+
+
+def _parts(email):
+    local, _, domain = (email or '').lower().rpartition('@')
+    for part in (local, domain):
+        if not part or part.startswith('.') or os.sep in part or '\0' in part:
+            raise PermanentError(f'unsafe mailbox path for {email!r}')
+    return domain, local
+
+
+def mailbox_path(email):
+    domain, local = _parts(email)
+    return os.path.join(_settings['root'], domain, local)
+
+
+def _mkdir(path, mode, uid, gid):
+    try:
+        os.mkdir(path, mode)
+    except FileExistsError:
+        pass
+    st = os.stat(path)
+    if (st.st_uid, st.st_gid) != (uid, gid):
+        os.chown(path, uid, gid)
+
+
+def provision(email):
+    """Create (or repair ownership of) the mailbox tree; safe to repeat."""
+    uid, gid = _owner()
+    domain_dir = os.path.join(_settings['root'], _parts(email)[0])
+    mailbox = mailbox_path(email)
+    maildir = os.path.join(mailbox, 'Maildir')
+    _mkdir(domain_dir, 0o770, uid, gid)
+    for path in (mailbox, maildir) + tuple(os.path.join(maildir, sub) for sub in ('cur', 'new', 'tmp')):
+        _mkdir(path, 0o700, uid, gid)
+
+
+def deprovision(email):
+    """Archive (or delete) the mailbox tree; a missing mailbox counts as done."""
+    mailbox = mailbox_path(email)
+    if not os.path.isdir(mailbox):
+        return
+    if _settings['deprovision'] == 'delete':
+        shutil.rmtree(mailbox)
+        return
+    domain, local = _parts(email)
+    archive_dir = os.path.join(_settings['root'], '.deleted', domain)
+    os.makedirs(archive_dir, mode=0o700, exist_ok=True)
+    os.rename(mailbox, os.path.join(archive_dir, f"{local}-{datetime.utcnow():%Y%m%d%H%M%S}"))
+
+
+# ── queue ──
+
+def enqueue(emails, action='create', conn=None):
+    """Queue ``action`` for each address, superseding open tasks for them.
+
+    Pass ``conn`` to queue inside the caller's transaction; the worker is then
+    woken on its next poll rather than immediately.
+    """
+    if action not in ACTIONS:
+        raise ValueError(f'unknown maildir action {action!r}')
+    emails = [emails] if isinstance(emails, str) else list(emails)
+    if not emails:
+        return 0
+    if conn is None:
+        with db.engine.begin() as conn:
+            enqueue(emails, action, conn)
+        worker.wake()
+        return len(emails)
+    table, now = MaildirTask.__table__, datetime.utcnow()
+    for start in range(0, len(emails), 1000):
+        batch = emails[start:start + 1000]
+        conn.execute(table.update().where(table.c.email.in_(batch), table.c.status.in_(OPEN))
+                     .values(status='superseded', updated_at=now))
+        conn.execute(table.insert().values([
+            {'email': e, 'action': action, 'status': 'pending', 'attempts': 0,
+             'next_attempt_at': now, 'created_at': now, 'updated_at': now} for e in batch]))
+    return len(emails)
+
+
+def latest(email):
+    return MaildirTask.query.filter_by(email=email).order_by(MaildirTask.id.desc()).first()
+
+
+def to_dict(task):
+    if task is None:
+        return {'status': 'none'}
+    return {
+        'id': task.id, 'email': task.email, 'action': task.action, 'status': task.status,
+        'attempts': task.attempts, 'last_error': task.last_error,
+        'next_attempt_at': task.next_attempt_at.isoformat() if task.next_attempt_at else None,
+        'created_at': task.created_at.isoformat() if task.created_at else None,
+        'updated_at': task.updated_at.isoformat() if task.updated_at else None,
+    }
+
+
+def _claim(conn, limit):
+    """Mark up to ``limit`` due tasks as running, at most one per address; stale leases are reclaimed."""
+    table, now = MaildirTask.__table__, datetime.utcnow()
+    stale = now - timedelta(seconds=_settings['lease'])
+    busy = select(table.c.email).where(table.c.status == 'running', table.c.updated_at >= stale)
+    due = conn.execute(
+        select(table.c.id, table.c.email, table.c.action, table.c.status, table.c.attempts, table.c.updated_at)
+        .where(or_(and_(table.c.status.in_(OPEN), table.c.next_attempt_at <= now),
+                   and_(table.c.status == 'running', table.c.updated_at < stale)),
+               table.c.email.not_in(busy))
+        .order_by(table.c.id).limit(limit)).all()
+    claimed, seen = [], set()
+    for task in due:
+        if task.email in seen:
+            continue
+        seen.add(task.email)
+        # Only one worker wins the row: the update matches the state we read
+        won = conn.execute(table.update().where(table.c.id == task.id, table.c.status == task.status,
+                                                table.c.updated_at == task.updated_at)
+                           .values(status='running', updated_at=now)).rowcount
+        if won:
+            claimed.append(task)
+    return claimed
+
+
+def _finish(task, error=None, permanent=False):
+    table, now = MaildirTask.__table__, datetime.utcnow()
+    attempts = task.attempts + 1
+    if error is None:
+        values = {'status': 'done', 'last_error': None}
+    elif permanent or attempts >= _settings['max_attempts']:
+        values = {'status': 'failed', 'last_error': str(error)[:2000]}
+    else:
+        delay = min(_settings['retry_base'] * 2 ** task.attempts, 3600)
+        values = {'status': 'retry', 'last_error': str(error)[:2000],
+                  'next_attempt_at': now + timedelta(seconds=delay)}
+    with db.engine.begin() as conn:
+        conn.execute(table.update().where(table.c.id == task.id, table.c.status == 'running')
+                     .values(attempts=attempts, updated_at=now, **values))
+    return values['status']
+
+
+def process(limit=50):
+    """Run one batch of due tasks; returns how many were attempted."""
+    with db.engine.begin() as conn:
+        tasks = _claim(conn, limit)
+    for task in tasks:
+        try:
+            (provision if task.action == 'create' else deprovision)(task.email)
+            _finish(task)
+        except PermanentError as e:
+            logger.warning(f"MAILDIR_TASK_FAILED id={task.id} email={task.email} action={task.action} error={e}")
+            _finish(task, e, permanent=True)
+        except OSError as e:
+            status = _finish(task, e)
+            logger.warning(f"MAILDIR_TASK_{status.upper()} id={task.id} email={task.email} "
+                           f"action={task.action} attempt={task.attempts + 1} error={e}")
+    return len(tasks)
+
+
+class ProvisioningWorker:
+    def __init__(self):
+        self.app = None
+        self._pid = None
+        self._wake = threading.Event()
+        self.processed = 0
+        self.failures = 0
+
+    def wake(self):
+        if _settings['mode'] == 'inprocess':
+            self._ensure_thread()
+        self._wake.set()
+
+    def run_forever(self):
+        while True:
+            self._run_once()
+            self._wake.wait(_settings['poll_interval'])
+            self._wake.clear()
+
+    def _run_once(self):
+        with self.app.app_context():
+            try:
+                while True:
+                    done = process()
+                    self.processed += done
+                    if not done:
+                        return
+            except Exception as e:
+                self.failures += 1
+                logger.warning(f"MAILDIR_WORKER_FAILED error={e}")
+                time.sleep(_settings['poll_interval'])
+            finally:
+                db.session.remove()
+
+    def _ensure_thread(self):
+        if self._pid == os.getpid() or self.app is None:
+            return
+        self._pid = os.getpid()
+        threading.Thread(target=self.run_forever, daemon=True, name='promail-maildirs').start()
+
+
+worker = ProvisioningWorker()
+
+
+def init_app(app):
+    worker.app = app
+    for key, name in (('root', 'MAILDIR_ROOT'), ('owner', 'MAILDIR_OWNER'),
+                      ('deprovision', 'MAILDIR_DEPROVISION'), ('max_attempts', 'MAILDIR_MAX_ATTEMPTS'),
+                      ('retry_base', 'MAILDIR_RETRY_BASE'), ('poll_interval', 'MAILDIR_POLL_INTERVAL'),
+                      ('mode', 'MAILDIR_WORKER')):
+        _settings[key] = app.config.get(name, _settings[key])
+
+    if _settings['mode'] == 'inprocess':
+        # Started lazily per worker process (after any fork) so queued tasks survive restarts
+        app.before_request(worker._ensure_thread)
+
+    @app.cli.command('maildirs-worker')
+    @click.option('--once', is_flag=True, help='Process what is due now, then exit.')
+    def worker_command(once):
+        """Create and remove maildirs queued by account changes."""
+        if once:
+            worker._run_once()
+            click.echo(f'processed {worker.processed} tasks')
+        else:
+            worker.run_forever()
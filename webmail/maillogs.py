@@ -0,0 +1,552 @@
+"""
+ProMail — mail server log viewer
+Postfix and Dovecot logs (the live file plus its rotations, plain or gzipped)
+are read in place. Each file gets a sparse index of line offsets and
+timestamps, sampled every MAILLOG_INDEX_STEP bytes through a memory map, so a
+time range or a page cursor becomes a seek rather than a scan from the top.
+Gzipped rotations are inflated once per worker to keep decompressor
+checkpoints, which makes them seekable as well. Rotated files never change;
+the live file is only indexed past the point seen last time.
+"""
+
+import os, re, glob, mmap, time, zlib, base64, bisect, threading, logging
+from datetime import datetime
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+LEVELS = {'debug': 0, 'info': 1, 'warning': 2, 'error': 3, 'fatal': 4, 'panic': 5}
+
+_ISO_RE = re.compile(rb'\d{4}-\d\d-\d\d[T ]\d\d:\d\d:\d\d(\.\d+)?(Z|[+-]\d\d:?\d\d)?')
+_BSD_RE = re.compile(rb'([A-Z][a-z]{2}) +(\d{1,2}) (\d\d):(\d\d):(\d\d)')
+_MONTHS = {m: n for n, m in enumerate(
+    (b'Jan', b'Feb', b'Mar', b'Apr', b'May', b'Jun', b'Jul', b'Aug', b'Sep', b'Oct', b'Nov', b'Dec'), 1)}
+_LEVEL_RE = re.compile(rb': (debug|info|warning|error|fatal|panic): ', re.I)
+# Short (hex) and long (no vowels) postfix queue ids
+_QUEUE_ID_RE = re.compile(r'\]: ([0-9A-F]{6,}|[0-9B-DF-HJ-NP-TV-Zb-df-hj-np-tv-z]{10,}): ')
+_ID_RE = re.compile(r'^[0-9A-Za-z]{5,20}$')
+_ROTATED_RE = r'(\.\d+|-\d{8})(\.gz)?$'
+
+_settings = {
+    'sources': {'mail': '/var/log/mail.log', 'dovecot': '/var/log/dovecot.log',
+                'dovecot-info': '/var/log/dovecot-info.log'},
+    'index_step': 1 << 20, 'gzip_step': 8 << 20, 'max_scan': 256 << 20,
+    'max_files': 10,
+}
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+# ── timestamps ──
+
+@lru_cache(maxsize=4096)
+def _hour_start(year, month, day, hour):
+    return time.mktime((year, month, day, hour, 0, 0, 0, 0, -1))
+
+
+@lru_cache(maxsize=256)
+def _year(ref):
+    return time.localtime(ref).tm_year
+
+
+def _stamp(buf, pos, ref):
+    """Epoch seconds for the line starting at ``pos``, or None if it has no timestamp.
+
+    Traditional syslog stamps carry no year; it is taken from the file's
+    mtime (``ref``), stepping back a year for lines that would land after it.
+    """
+    m = _BSD_RE.match(buf, pos)
+    if m:
+        month = _MONTHS.get(m.group(1))
+        if month is None:
+            return None
+        year, day, hour = _year(ref), int(m.group(2)), int(m.group(3))
+        seconds = int(m.group(4)) * 60 + int(m.group(5))
+        try:
+            ts = _hour_start(year, month, day, hour) + seconds
+            if ts > ref + 86400:
+                ts = _hour_start(year - 1, month, day, hour) + seconds
+        except (OverflowError, ValueError):
+            return None
+        return ts
+    m = _ISO_RE.match(buf, pos)
+    if m:
+        try:
+            return datetime.fromisoformat(m.group(0).decode()).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def _bisect(buf, ts, ref, after=False):
+    """A line start in ``buf`` near where stamps reach ``ts`` (or pass it, with ``after``).
+
+    Everything before the offset returned is earlier than that, and without
+    ``after`` it is at most a few KB early; callers still check each line.
+    """
+    lo, hi = 0, len(buf)
+    while hi - lo > 4096:
+        mid = buf.find(b'\n', (lo + hi) // 2, hi) + 1
+        stamp = _first_stamp(buf, mid, hi, ref) if 0 < mid < hi else None
+        if stamp is None:
+            break
+        if stamp < ts or (after and stamp == ts):
+            lo = mid
+        else:
+            hi = mid
+    return hi if after else lo
+
+
+def _first_stamp(buf, pos, end, ref, lines=20):
+    for _ in range(lines):
+        if pos >= end:
+            return None
+        ts = _stamp(buf, pos, ref)
+        if ts is not None:
+            return ts
+        nl = buf.find(b'\n', pos, end)
+        if nl < 0:
+            return None
+        pos = nl + 1
+    return None
+
+
+# ── files and indexes ──
+
+class _Index:
+    def __init__(self, key, source):
+        self.key, self.source = key, source
+        self.offsets, self.stamps = [], []
+        self.checkpoints = []  # gzip only, per block: (compressed offset, output offset, decompressor)
+        self.next_sample = 0
+        self.size = 0
+
+    def add(self, offset, ts):
+        if ts is None:
+            ts = self.stamps[-1] if self.stamps else 0.0
+        self.offsets.append(offset)
+        self.stamps.append(ts)
+
+
+class Segment:
+    """One log file (the live one or a rotation) with its sparse index."""
+
+    def __init__(self, source, path, st):
+        self.source, self.path = source, path
+        self.compressed = path.endswith('.gz')
+        self.key = (st.st_dev, st.st_ino)
+        self.mtime = st.st_mtime
+        self.file_size = st.st_size
+        self.index = None
+        self._map = None
+        self._fh = None
+
+    @property
+    def ino(self):
+        return self.key[1]
+
+    @property
+    def size(self):
+        return self.index.size
+
+    def open(self):
+        """Build or extend the index; plain files stay mapped until close()."""
+        if self.index is not None:
+            return self
+        with _lock:
+            index = _indexes.get(self.key)
+            if self.compressed:
+                if index is None:
+                    index = _indexes[self.key] = self._index_gzip(_Index(self.key, self.source))
+            else:
+                self._fh = open(self.path, 'rb')
+                size = os.fstat(self._fh.fileno()).st_size
+                self._map = mmap.mmap(self._fh.fileno(), size, access=mmap.ACCESS_READ) if size else b''
+                if index is None or index.size > size:  # new, or truncated in place
+                    index = _indexes[self.key] = _Index(self.key, self.source)
+                self._index_plain(index, size)
+        self.index = index
+        return self
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        if self._fh:
+            self._fh.close()
+        self._map = self._fh = None
+
+    def _index_plain(self, index, size):
+        buf, step = self._map, _settings['index_step']
+        # A line still being written isn't visible until it's complete
+        end = buf.rfind(b'\n', 0, size) + 1 if size else 0
+        pos = index.next_sample
+        while pos < end:
+            start = 0 if pos == 0 else buf.find(b'\n', pos - 1, end) + 1
+            if (pos and start <= 0) or start >= end:
+                break
+            index.add(start, _first_stamp(buf, start, end, self.mtime))
+            pos = start + step
+        index.next_sample = max(pos, index.next_sample)
+        index.size = end
+
+    def _index_gzip(self, index):
+        """Inflate once, keeping a decompressor copy every ``gzip_step`` bytes so blocks can be read on their own."""
+        step, started = _settings['gzip_step'], time.monotonic()
+        upos, carry = 0, b''
+        pending = (0, 0, zlib.decompressobj(31))
+        with open(self.path, 'rb') as fh:
+            for cpos, dobj, data in _inflate(fh, 0, zlib.decompressobj(31)):
+                upos += len(data)
+                if pending is not None:
+                    carry += data
+                    if self._checkpoint(index, pending, carry, len(carry) >= 64):
+                        pending = None
+                if pending is None and upos - index.offsets[-1] >= step:
+                    pending, carry = (cpos, upos, dobj.copy()), b''
+        if pending is not None:
+            self._checkpoint(index, pending, carry, True)
+        index.size = upos
+        logger.info(f"MAILLOG_INDEXED path={self.path} bytes={upos} blocks={len(index.offsets)} "
+                    f"seconds={time.monotonic() - started:.2f}")
+        return index
+
+    def _checkpoint(self, index, checkpoint, carry, enough):
+        """Record the block starting at the first line after ``checkpoint``, once ``carry`` shows where that is."""
+        start = 0 if checkpoint[1] == 0 else carry.find(b'\n') + 1
+        if (checkpoint[1] and not start) or start >= len(carry) or not (enough or len(carry) - start >= 64):
+            return False
+        index.add(checkpoint[1] + start, _first_stamp(carry, start, len(carry), self.mtime))
+        index.checkpoints.append(checkpoint)
+        return True
+
+    def read(self, start, end):
+        """Bytes [start, end) of the (uncompressed) file; ``start`` is a line start."""
+        if not self.compressed:
+            return self._map[start:end]
+        cpos, base, saved = self.index.checkpoints[self.block(start)]
+        out = []
+        with open(self.path, 'rb') as fh:
+            for _, _, data in _inflate(fh, cpos, saved.copy()):
+                lo, hi = max(start - base, 0), min(end - base, len(data))
+                if hi > lo:
+                    out.append(data[lo:hi])
+                base += len(data)
+                if base >= end:
+                    break
+        return b''.join(out)
+
+    def block(self, pos):
+        """Index of the block holding offset ``pos``."""
+        return max(bisect.bisect_right(self.index.offsets, pos) - 1, 0)
+
+    def block_end(self, k):
+        return self.index.offsets[k + 1] if k + 1 < len(self.index.offsets) else self.size
+
+
+def _inflate(fh, cpos, dobj, size=1 << 16):
+    """Yield (compressed offset, decompressor, output) from ``cpos`` on, at most ``size`` output bytes at a time.
+
+    The decompressor can be copied between steps to resume from that offset later.
+    """
+    fh.seek(cpos)
+    pending = b''
+    while True:
+        if not pending:
+            pending = fh.read(size)
+            if not pending:
+                return
+        try:
+            data = dobj.decompress(pending, size)
+        except zlib.error:
+            return  # trailing garbage after the last member
+        if dobj.eof:
+            # End of a gzip member; concatenated members simply continue
+            rest = dobj.unused_data
+            cpos += len(pending) - len(rest)
+            pending, dobj = rest, zlib.decompressobj(31)
+        else:
+            cpos += len(pending) - len(dobj.unconsumed_tail)
+            pending = dobj.unconsumed_tail
+        yield cpos, dobj, data
+
+
+def sources():
+    return list(_settings['sources'])
+
+
+def segments(source):
+    """The live file and its rotations (``.1``, ``.2.gz``, ``-YYYYMMDD``...), oldest first."""
+    path = _settings['sources'].get(source)
+    if path is None:
+        raise KeyError(source)
+    rotated = re.compile(re.escape(path) + _ROTATED_RE)
+    chain = []
+    for candidate in [p for p in glob.glob(glob.escape(path) + '[.-]*') if rotated.match(p)] + [path]:
+        try:
+            chain.append(Segment(source, candidate, os.stat(candidate)))
+        except FileNotFoundError:
+            continue
+    chain.sort(key=lambda s: (s.path == path, s.mtime))
+    chain = chain[-_settings['max_files']:]
+    keys = {s.key for s in chain}
+    with _lock:
+        for key in [k for k, i in _indexes.items() if i.source == source and k not in keys]:
+            del _indexes[key]  # rotated away or compressed
+    return chain
+
+
+# ── filters and cursors ──
+
+def _parse_time(value, name):
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()  # naive means server time, as syslog writes it
+    except ValueError:
+        raise InvalidQuery(f'Invalid {name} (expected an ISO date/time or epoch seconds)')
+
+
+def parse_filters(args):
+    """Normalise request args into the filters ``page`` understands."""
+    filters = {}
+    for name in ('since', 'until'):
+        if args.get(name):
+            filters[name] = _parse_time(args[name].strip(), name)
+    queue_id = (args.get('queue_id') or '').strip()
+    if queue_id:
+        if not _ID_RE.match(queue_id):
+            raise InvalidQuery('Invalid queue id')
+        filters['queue_id'] = queue_id
+    address = (args.get('address') or '').strip().lower()
+    if address:
+        filters['address'] = address[:255]
+    level = (args.get('level') or '').strip().lower()
+    if level:
+        if level not in LEVELS:
+            raise InvalidQuery(f"Level must be one of {', '.join(LEVELS)}")
+        filters['level'] = level
+    q = (args.get('q') or '').strip()
+    if q:
+        filters['q'] = q[:200]
+    return filters
+
+
+def _needles(filters):
+    """Patterns (for lowercased text) that every matching line contains.
+
+    The first one is what the scanner jumps between; each starts with a
+    literal so ``re`` can use its fast substring search. Queue ids are checked
+    for a leading word boundary per candidate line instead.
+    """
+    needles = []
+    if 'queue_id' in filters:
+        needles.append(re.compile(re.escape(filters['queue_id'].lower().encode()) + rb'(?![0-9a-z])'))
+    for name in ('address', 'q'):
+        if name in filters:
+            needles.append(re.compile(re.escape(filters[name].lower().encode())))
+    if LEVELS.get(filters.get('level'), 0) >= LEVELS['warning']:
+        names = b'|'.join(n.encode() for n, rank in LEVELS.items() if rank >= LEVELS[filters['level']])
+        needles.append(re.compile(rb': (' + names + rb'): '))
+    return needles
+
+
+def _wanted(raw, needles, filters):
+    hay = raw.lower()
+    if any(not needle.search(hay) for needle in needles[1:]):
+        return False
+    if 'queue_id' in filters:
+        return re.search(rb'(?<![0-9a-z])' + re.escape(filters['queue_id'].lower().encode()), hay) is not None
+    return True
+
+
+def encode_cursor(ino, offset, ts):
+    raw = f'{ino}|{offset}|{ts or 0:.0f}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        ino, offset, ts = (int(part) for part in raw.split('|'))
+        return ino, offset, float(ts)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidQuery('Invalid cursor')
+
+
+# ── reading ──
+
+def _lines(buf, base, needle=None):
+    """(offset, line) for the lines of ``buf`` (which starts at offset ``base``), only those containing ``needle`` if given."""
+    hay = buf.lower() if needle is not None else buf
+    pos, size = 0, len(buf)
+    while pos < size:
+        if needle is not None:
+            m = needle.search(hay, pos)
+            if m is None:
+                return
+            pos = hay.rfind(b'\n', 0, m.start()) + 1
+        nl = buf.find(b'\n', pos)
+        nl = size if nl < 0 else nl
+        yield base + pos, buf[pos:nl]
+        pos = nl + 1
+
+
+def _lines_reversed(buf, base, needle=None):
+    if needle is not None:
+        yield from reversed(list(_lines(buf, base, needle)))
+        return
+    end = len(buf)
+    while end > 0:
+        stop = end - 1 if buf[end - 1] == 0x0a else end
+        start = buf.rfind(b'\n', 0, stop) + 1
+        yield base + start, buf[start:stop]
+        end = start
+
+
+def _entry(name, ts, raw):
+    level = _LEVEL_RE.search(raw, 0, 200)
+    text = raw.decode('utf-8', 'replace').rstrip('\r')
+    queue_id = _QUEUE_ID_RE.search(text, 0, 200)
+    return {
+        'time': datetime.fromtimestamp(ts).isoformat() if ts is not None else None,
+        'level': level.group(1).decode().lower() if level else 'info',
+        'queue_id': queue_id.group(1) if queue_id else None,
+        'file': name,
+        'text': text,
+    }
+
+
+def _accept(entry, filters):
+    return LEVELS[entry['level']] >= LEVELS.get(filters.get('level'), 0)
+
+
+def _start(chain, filters, cursor, descending):
+    """(segment number, offset, time seeked to) to read from: the cursor, else the time bound, else the newest/oldest end."""
+    ts = None
+    if cursor:
+        ino, offset, ts = decode_cursor(cursor)
+        for n, seg in enumerate(chain):
+            if seg.ino == ino and offset <= seg.open().size:
+                return n, offset, None
+        # The file it pointed into was compressed or expired; resume by time instead
+    else:
+        ts = filters.get('until' if descending else 'since')
+    if ts is None:
+        return (len(chain) - 1, chain[-1].open().size, None) if descending else (0, 0, None)
+    n = next((n for n, seg in enumerate(chain) if seg.mtime >= ts), len(chain) - 1)
+    seg = chain[n].open()
+    if not seg.index.offsets:
+        return n, 0, ts
+    if descending:
+        k = bisect.bisect_right(seg.index.stamps, ts)
+        return n, seg.index.offsets[k] if k < len(seg.index.offsets) else seg.size, ts
+    return n, seg.index.offsets[max(bisect.bisect_left(seg.index.stamps, ts) - 1, 0)], ts
+
+
+def _blocks(chain, n, pos, descending):
+    """(segment, block, start, end) ranges from position (n, pos) outwards, each starting on a line."""
+    if descending:
+        for i in range(n, -1, -1):
+            seg = chain[i].open()
+            end = pos if i == n else seg.size
+            if not seg.index.offsets or end <= 0:
+                continue
+            for k in range(seg.block(end - 1), -1, -1):
+                yield seg, k, seg.index.offsets[k], min(seg.block_end(k), end)
+    else:
+        for i in range(n, len(chain)):
+            seg = chain[i].open()
+            start = pos if i == n else 0
+            if not seg.index.offsets or start >= seg.size:
+                continue
+            for k in range(seg.block(start), len(seg.index.offsets)):
+                yield seg, k, max(seg.index.offsets[k], start), seg.block_end(k)
+
+
+def page(source, filters, cursor=None, order='desc', limit=100):
+    """One page of matching lines, newest first (or oldest first with ``order='asc'``).
+
+    Returns (entries, next_cursor, truncated); ``truncated`` means the scan
+    budget ran out before the page filled, and next_cursor resumes there.
+    """
+    descending = order != 'asc'
+    chain = segments(source)
+    if not chain:
+        return [], None, False
+    needles = _needles(filters)
+    primary = needles[0] if needles else None
+    since, until = filters.get('since'), filters.get('until')
+    items, scanned, next_cursor, truncated = [], 0, None, False
+    try:
+        n, pos, seek = _start(chain, filters, cursor, descending)
+        if cursor and seek is not None:
+            # Resuming by time: the cursor's line is the bound
+            if descending:
+                until = seek if until is None else min(until, seek)
+            else:
+                since = seek if since is None else max(since, seek)
+        for seg, k, start, end in _blocks(chain, n, pos, descending):
+            block_ts = seg.index.stamps[k]
+            if not descending and until is not None and block_ts > until:
+                break
+            if scanned >= _settings['max_scan']:
+                next_cursor, truncated = encode_cursor(seg.ino, end if descending else start, block_ts), True
+                break
+            scanned += end - start
+            name, buf = os.path.basename(seg.path), seg.read(start, end)
+            if seek is not None:
+                # The index only narrows a time bound down to a block; bisect the rest
+                cut = _bisect(buf, seek, seg.mtime, after=descending)
+                buf, start, seek = (buf[:cut], start, None) if descending else (buf[cut:], start + cut, None)
+            for offset, raw in (_lines_reversed if descending else _lines)(buf, start, primary):
+                if needles and not _wanted(raw, needles, filters):
+                    continue
+                ts = _stamp(raw, 0, seg.mtime)
+                if ts is not None and ((since is not None and ts < since) or (until is not None and ts > until)):
+                    continue
+                entry = _entry(name, ts, raw)
+                if not _accept(entry, filters):
+                    continue
+                items.append(entry)
+                if len(items) >= limit:
+                    next_cursor = encode_cursor(seg.ino, offset if descending else offset + len(raw) + 1, ts)
+                    break
+            if len(items) >= limit:
+                break
+            if descending and since is not None and block_ts < since:
+                break
+        else:
+            if not descending:
+                # Caught up with the live file: hand back its end so the client can poll for more
+                live = chain[-1]
+                next_cursor = encode_cursor(live.ino, live.size, time.time())
+    finally:
+        for seg in chain:
+            seg.close()
+    return items, next_cursor, truncated
+
+
+def describe():
+    """Configured logs and the files currently behind each one."""
+    result = []
+    for source, path in _settings['sources'].items():
+        files = [{'file': os.path.basename(seg.path), 'size': seg.file_size, 'compressed': seg.compressed,
+                  'modified': datetime.fromtimestamp(seg.mtime).isoformat()} for seg in segments(source)]
+        result.append({'name': source, 'path': path, 'readable': os.access(path, os.R_OK), 'files': files})
+    return result
+
+
+def init_app(app):
+    sources = app.config.get('MAILLOG_SOURCES')
+    if sources:
+        _settings['sources'] = dict(item.strip().split('=', 1) for item in sources.split(',') if '=' in item)
+    for key, name in (('index_step', 'MAILLOG_INDEX_STEP'), ('gzip_step', 'MAILLOG_GZIP_STEP'),
+                      ('max_scan', 'MAILLOG_MAX_SCAN'), ('max_files', 'MAILLOG_MAX_FILES')):
+        _settings[key] = app.config.get(name, _settings[key])
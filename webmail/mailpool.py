@@ -0,0 +1,342 @@
+"""
+ProMail — IMAP connection pool
+Keeps authenticated IMAP sessions alive per account so request handlers and
+background jobs don't pay a TLS handshake + LOGIN on every call.
+"""
+
+import imaplib, threading, time, logging, zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import metrics, resilience
+
+logger = logging.getLogger(__name__)
+
+# imaplib refuses commands it doesn't know about (RFC 4978)
+imaplib.Commands.setdefault('COMPRESS', ('AUTH', 'SELECTED'))
+
+_BYTE_SERIES = (('in', 'raw'), ('in', 'wire'), ('out', 'raw'), ('out', 'wire'))
+
+
+class _DeflateMixin:
+    """Byte accounting plus optional COMPRESS=DEFLATE on top of imaplib's socket I/O.
+
+    ``bytes_*_raw`` count protocol bytes, ``bytes_*_wire`` what actually crossed the socket.
+    Each command is timed, and the bytes it moved are added to the shared
+    metrics once it completes rather than on every read.
+    """
+
+    _compressor = None
+    _decompressor = None
+    _breaker = None
+    _failed = False
+    _probing_idle = False
+
+    def _reset_counters(self):
+        self.bytes_in_raw = self.bytes_in_wire = 0
+        self.bytes_out_raw = self.bytes_out_wire = 0
+        self._reported = (0, 0, 0, 0)
+        self._inbuf = b''
+
+    def _simple_command(self, name, *args):
+        command = f'UID {args[0]}' if name == 'UID' and args else name
+        started = time.perf_counter()
+        try:
+            return super()._simple_command(name, *args)
+        except (TimeoutError, imaplib.IMAP4.abort) as e:
+            metrics.imap_failures.labels(command).inc()
+            # A server that dropped an idle session answers the pool's NOOP with EOF; only a hang counts then
+            if self._breaker is not None and not self._failed and (
+                    isinstance(e, TimeoutError) or not self._probing_idle):
+                self._failed = True
+                self._breaker.record_failure()
+            raise
+        except Exception:
+            metrics.imap_failures.labels(command).inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.imap_duration.labels(command).observe(elapsed)
+            metrics.charge('imap', elapsed)
+            self.report_bytes()
+
+    def report_bytes(self):
+        current = (self.bytes_in_raw, self.bytes_in_wire, self.bytes_out_raw, self.bytes_out_wire)
+        for series, now, before in zip(_BYTE_SERIES, current, self._reported):
+            if now != before:
+                metrics.imap_bytes.labels(*series).inc(now - before)
+        self._reported = current
+
+    def open(self, *args, **kwargs):
+        self._reset_counters()
+        started = time.perf_counter()
+        try:
+            super().open(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.imap_duration.labels('connect').observe(elapsed)
+            metrics.charge('imap', elapsed)
+
+    def enable_compression(self, level=6):
+        """Negotiate COMPRESS DEFLATE; returns True if the stream is now compressed."""
+        if self._compressor or 'COMPRESS=DEFLATE' not in self.capabilities:
+            return bool(self._compressor)
+        typ, _ = self._simple_command('COMPRESS', 'DEFLATE')
+        if typ != 'OK':
+            return False
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        self._decompressor = zlib.decompressobj(-15)
+        return True
+
+    def send(self, data):
+        self.bytes_out_raw += len(data)
+        if self._compressor:
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.bytes_out_wire += len(data)
+        super().send(data)
+
+    def _fill(self):
+        chunk = self.file.read1(16384)
+        if not chunk:
+            raise self.abort('socket error: EOF')
+        self.bytes_in_wire += len(chunk)
+        data = self._decompressor.decompress(chunk)
+        self.bytes_in_raw += len(data)
+        self._inbuf += data
+
+    def read(self, size):
+        if not self._decompressor:
+            data = super().read(size)
+            self.bytes_in_raw += len(data)
+            self.bytes_in_wire += len(data)
+            return data
+        while len(self._inbuf) < size:
+            self._fill()
+        data, self._inbuf = self._inbuf[:size], self._inbuf[size:]
+        return data
+
+    def readline(self):
+        if not self._decompressor:
+            line = super().readline()
+            self.bytes_in_raw += len(line)
+            self.bytes_in_wire += len(line)
+            return line
+        while b'\n' not in self._inbuf:
+            if len(self._inbuf) > imaplib._MAXLINE:
+                raise self.error('got more than %d bytes' % imaplib._MAXLINE)
+            self._fill()
+        idx = self._inbuf.index(b'\n') + 1
+        line, self._inbuf = self._inbuf[:idx], self._inbuf[idx:]
+        return line
+
+    def byte_counters(self):
+        return {
+            'in_raw': self.bytes_in_raw, 'in_wire': self.bytes_in_wire,
+            'out_raw': self.bytes_out_raw, 'out_wire': self.bytes_out_wire,
+            'compressed': bool(self._compressor),
+        }
+
+
+class CountingIMAP4(_DeflateMixin, imaplib.IMAP4):
+    pass
+
+
+class CountingIMAP4_SSL(_DeflateMixin, imaplib.IMAP4_SSL):
+    pass
+
+
+def refresh_capabilities(conn):
+    """Re-read CAPABILITY after LOGIN; servers advertise COMPRESS/LITERAL+ post-auth."""
+    typ, dat = conn.capability()
+    if typ == 'OK' and dat and dat[-1]:
+        conn.capabilities = tuple(dat[-1].decode('ascii', 'replace').upper().split())
+
+
+class ImapPool:
+    """Per-process pool of logged-in IMAP connections keyed by (host, port, user)."""
+
+    def __init__(self, max_idle=2, idle_timeout=300, compress=False, compress_level=6):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.compress = compress
+        self.compress_level = compress_level
+        self.conn_class = CountingIMAP4_SSL
+        self._idle = {}
+        self._lock = threading.Lock()
+        self._totals = {'in_raw': 0, 'in_wire': 0, 'out_raw': 0, 'out_wire': 0}
+
+    def _connect(self, host, port, user, password, timeout=None):
+        conn = self.conn_class(host, port, timeout=timeout)
+        conn.login(user, password)
+        refresh_capabilities(conn)
+        if self.compress:
+            try:
+                conn.enable_compression(self.compress_level)
+            except imaplib.IMAP4.error as e:
+                logger.warning(f"IMAP_COMPRESS_FAILED user={user} error={e}")
+        conn._pool_key = (host, port, user)
+        metrics.imap_connects.inc()
+        return conn
+
+    def acquire(self, host, port, user, password, timeout=None):
+        key = (host, port, user)
+        name = f'imap:{host}:{port}'
+        if timeout is None:
+            timeout = resilience.timeout_for('imap', name)
+        now = time.monotonic()
+        # Health is judged per checkout: commands that time out or abort record a failure on the
+        # breaker (see _DeflateMixin), a clean release() records the success. Counting a good
+        # LOGIN as success would reset the count on every request when only later commands hang.
+        cb = resilience.breaker(name)
+        cb.before_call()
+        while True:
+            with self._lock:
+                stack = self._idle.get(key)
+                if not stack:
+                    break
+                conn, released_at = stack.pop()
+            metrics.imap_idle.dec()
+            if now - released_at > self.idle_timeout:
+                self._close(conn)
+                continue
+            try:
+                conn.sock.settimeout(timeout)
+                conn._breaker, conn._failed, conn._probing_idle = cb, False, True
+                conn.noop()
+                conn._probing_idle = False
+                metrics.imap_in_use.inc()
+                return conn
+            except Exception:
+                if conn._failed:
+                    self._close(conn)
+                    raise
+                # Stale session; not a health signal on its own
+                self._close(conn)
+        try:
+            conn = self._connect(host, port, user, password, timeout)
+        except BaseException as e:
+            if resilience.is_failure(e):
+                cb.record_failure()
+            else:
+                cb.record_success()
+            raise
+        conn._breaker, conn._failed = cb, False
+        metrics.imap_in_use.inc()
+        return conn
+
+    def release(self, conn, broken=False):
+        key = getattr(conn, '_pool_key', None)
+        if key is not None:
+            metrics.imap_in_use.dec()
+        if conn._breaker is not None and not conn._failed:
+            conn._breaker.record_success()
+        if broken or key is None:
+            self._close(conn)
+            return
+        try:
+            # UNSELECT rather than CLOSE: CLOSE would silently expunge \Deleted mail
+            if conn.state == 'SELECTED' and 'UNSELECT' in conn.capabilities:
+                conn.unselect()
+        except Exception:
+            self._close(conn)
+            return
+        with self._lock:
+            stack = self._idle.setdefault(key, [])
+            if len(stack) < self.max_idle:
+                stack.append((conn, time.monotonic()))
+                metrics.imap_idle.inc()
+                return
+        self._close(conn)
+
+    @contextmanager
+    def connection(self, host, port, user, password):
+        conn = self.acquire(host, port, user, password)
+        try:
+            yield conn
+        except (imaplib.IMAP4.abort, OSError):
+            self.release(conn, broken=True)
+            raise
+        except Exception:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def discard(self, user):
+        """Drop every idle connection for an account (e.g. after a password change)."""
+        with self._lock:
+            keys = [k for k in self._idle if k[2] == user]
+            stale = [c for k in keys for c, _ in self._idle.pop(k)]
+        metrics.imap_idle.dec(len(stale))
+        for conn in stale:
+            self._close(conn)
+
+    def stats(self):
+        """Byte totals for closed connections plus everything currently idle."""
+        with self._lock:
+            totals = dict(self._totals)
+            idle = [c for stack in self._idle.values() for c, _ in stack]
+        for conn in idle:
+            for k, v in conn.byte_counters().items():
+                if k in totals:
+                    totals[k] += v
+        totals['idle_connections'] = len(idle)
+        return totals
+
+    def _close(self, conn):
+        try:
+            conn.logout()
+        except Exception:
+            pass
+        if hasattr(conn, 'byte_counters'):
+            counters = conn.byte_counters()
+            with self._lock:
+                for k in self._totals:
+                    self._totals[k] += counters[k]
+
+
+def append_message(conn, mailbox, raw, flags='(\\Seen)'):
+    """APPEND raw message bytes, using a non-synchronizing literal when the server has LITERAL+."""
+    if 'LITERAL+' not in conn.capabilities:
+        return conn.append(mailbox, flags, None, raw)
+    started = time.perf_counter()
+    try:
+        # What imaplib._command() does before sending; _command_complete() looks the tag up
+        for typ in ('OK', 'NO', 'BAD'):
+            conn.untagged_responses.pop(typ, None)
+        tag = conn._new_tag()
+        conn.tagged_commands[tag] = None
+        conn.send(b'%s APPEND %s %s {%d+}\r\n' % (
+            tag, conn._quote(mailbox).encode(), flags.encode(), len(raw)))
+        conn.send(raw + b'\r\n')
+        typ, dat = conn._command_complete('APPEND', tag)
+        return conn._untagged_response(typ, dat, 'APPEND')
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.imap_duration.labels('APPEND').observe(elapsed)
+        metrics.charge('imap', elapsed)
+        conn.report_bytes()
+
+
+pool = ImapPool()
+
+# Small executor for work that must not add to request latency (Sent copies etc.)
+background = ThreadPoolExecutor(max_workers=4, thread_name_prefix='promail-bg')
+
+
+def init_app(app):
+    pool.max_idle = app.config.get('IMAP_POOL_MAX_IDLE', pool.max_idle)
+    pool.idle_timeout = app.config.get('IMAP_POOL_IDLE_TIMEOUT', pool.idle_timeout)
+    pool.compress = app.config.get('IMAP_COMPRESS', pool.compress)
+    pool.compress_level = app.config.get('IMAP_COMPRESS_LEVEL', pool.compress_level)
+
+
+def store_sent_copy(host, port, user, password, raw, mailbox='Sent'):
+    """Append an already-serialized outgoing message to the Sent folder."""
+    try:
+        with pool.connection(host, port, user, password) as conn:
+            typ, data = append_message(conn, mailbox, raw)
+            if typ != 'OK':
+                logger.warning(f"SENT_APPEND_FAILED user={user} response={data}")
+    except Exception as e:
+        logger.warning(f"SENT_APPEND_FAILED user={user} error={e}")
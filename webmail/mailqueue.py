@@ -0,0 +1,171 @@
+"""
+ProMail — Postfix queue inspection
+``postqueue -j`` prints one JSON object per message; it is parsed as it
+streams, so memory stays flat however large the deferred queue gets. The
+aggregate view (per queue, recipient domain and deferral reason) is cached
+for a short interval and shared between workers. Listings stream the queue
+again with filters and keep only the requested page. Bulk actions go through
+``postsuper`` with the queue ids on stdin.
+"""
+
+import re, json, time, shlex, logging
+from collections import Counter
+
+import resilience, singleflight
+from cache import cache
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_KEY = 'mailqueue:summary'
+QUEUES = ('maildrop', 'incoming', 'active', 'deferred', 'hold', 'corrupt')
+ACTIONS = {'requeue': '-r', 'delete': '-d', 'hold': '-h', 'release': '-H'}
+
+_ID_RE = re.compile(r'^[0-9A-Za-z]{5,20}$')
+_REASON_NOISE = re.compile(r'\[[0-9A-Fa-f:.]+\](:\d+)?|\b\d{1,3}(\.\d{1,3}){3}\b|\s*\(in reply to [^)]*\)')
+_COUNT_RE = re.compile(r'(Requeued|Deleted|Placed on hold|Released from hold): (\d+) messages?')
+
+_settings = {
+    'postqueue': 'postqueue', 'postsuper': 'sudo -n /usr/sbin/postsuper',
+    'summary_ttl': 30, 'scan_timeout': 25, 'top': 20,
+}
+
+
+# ── streaming ──
+
+def entries():
+    """Yield one dict per queued message, straight off the postqueue pipe."""
+    with resilience.popen(shlex.split(_settings['postqueue']) + ['-j'], timeout=_settings['scan_timeout']) as out:
+        for line in out:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # "Mail queue is empty" or a truncated line
+            if isinstance(entry, dict):
+                yield entry
+
+
+def _domain(address):
+    return address.rpartition('@')[2].lower() or '(local)'
+
+
+def _reason(text):
+    return re.sub(r'\s+', ' ', _REASON_NOISE.sub('', text or '')).strip()[:160]
+
+
+# ── aggregates ──
+
+def collect():
+    by_queue = {name: {'messages': 0, 'bytes': 0} for name in QUEUES}
+    domains, reasons = Counter(), Counter()
+    messages = recipients = size = 0
+    oldest = None
+    for entry in entries():
+        queue = by_queue.setdefault(entry.get('queue_name', 'unknown'), {'messages': 0, 'bytes': 0})
+        queue['messages'] += 1
+        queue['bytes'] += entry.get('message_size') or 0
+        messages += 1
+        size += entry.get('message_size') or 0
+        arrival = entry.get('arrival_time')
+        if arrival and (oldest is None or arrival < oldest):
+            oldest = arrival
+        for rcpt in entry.get('recipients') or ():
+            recipients += 1
+            domains[_domain(rcpt.get('address', ''))] += 1
+            if rcpt.get('delay_reason'):
+                reasons[_reason(rcpt['delay_reason'])] += 1
+    top = _settings['top']
+    return {
+        'collected_at': time.time(),
+        'messages': messages, 'recipients': recipients, 'bytes': size,
+        'oldest_arrival': oldest,
+        'queues': by_queue,
+        'domains': [{'domain': d, 'recipients': n} for d, n in domains.most_common(top)],
+        'reasons': [{'reason': r, 'recipients': n} for r, n in reasons.most_common(top)],
+    }
+
+
+def summary(refresh=False):
+    """Cached aggregates as (summary, age_seconds); a failed refresh falls back to the last good one."""
+    snap = cache.get(SUMMARY_KEY)
+    if refresh or snap is None or time.time() - snap['collected_at'] > _settings['summary_ttl']:
+        try:
+            snap = singleflight.do(SUMMARY_KEY, collect)
+            # Kept past the refresh interval so a slow or broken postqueue can still be answered from it
+            cache.set(SUMMARY_KEY, snap, ttl=_settings['summary_ttl'] * 20)
+        except Exception as e:
+            logger.warning(f"MAILQUEUE_SCAN_FAILED error={e}")
+            if snap is None:
+                raise
+    return snap, max(0.0, round(time.time() - snap['collected_at'], 1))
+
+
+# ── listing ──
+
+def _matches(entry, filters):
+    if filters.get('queue') and entry.get('queue_name') != filters['queue']:
+        return False
+    if filters.get('sender') and filters['sender'] not in (entry.get('sender') or '').lower():
+        return False
+    if filters.get('id') and not (entry.get('queue_id') or '').startswith(filters['id']):
+        return False
+    rcpts = entry.get('recipients') or ()
+    if filters.get('domain') and not any(_domain(r.get('address', '')) == filters['domain'] for r in rcpts):
+        return False
+    if filters.get('reason') and not any(filters['reason'] in (r.get('delay_reason') or '').lower() for r in rcpts):
+        return False
+    return True
+
+
+def to_dict(entry):
+    return {
+        'id': entry.get('queue_id'), 'queue': entry.get('queue_name'),
+        'sender': entry.get('sender'), 'size': entry.get('message_size'),
+        'arrival_time': entry.get('arrival_time'),
+        'recipients': [{'address': r.get('address'), 'reason': r.get('delay_reason')}
+                       for r in entry.get('recipients') or ()],
+    }
+
+
+def listing(filters, offset=0, limit=50):
+    """One page of matching messages and the number of matches, holding only that page in memory."""
+    filters = {k: v.strip() if k == 'id' else v.strip().lower() for k, v in filters.items() if v and v.strip()}
+    if filters.get('queue') and filters['queue'] not in QUEUES:
+        raise ValueError(f"Unknown queue {filters['queue']!r}")
+    page, total = [], 0
+    for entry in entries():
+        if not _matches(entry, filters):
+            continue
+        if offset <= total < offset + limit:
+            page.append(to_dict(entry))
+        total += 1
+    return page, total
+
+
+# ── actions ──
+
+def act(action, ids=None, queue=None, actor=None):
+    """Run a postsuper action on ``ids`` or on every message in ``queue``; returns how many it touched."""
+    if action not in ACTIONS:
+        raise ValueError(f'Unknown action {action!r}')
+    command = shlex.split(_settings['postsuper']) + [ACTIONS[action]]
+    if ids:
+        bad = [i for i in ids if not isinstance(i, str) or not _ID_RE.match(i)]
+        if bad:
+            raise ValueError(f'Invalid queue id {bad[0]!r}')
+        result = resilience.run(command + ['-'], input='\n'.join(ids) + '\n', timeout=_settings['scan_timeout'])
+    elif queue in QUEUES:
+        result = resilience.run(command + ['ALL', queue], timeout=_settings['scan_timeout'])
+    else:
+        raise ValueError('Give queue ids or a queue name')
+    if result.returncode:
+        raise RuntimeError((result.stderr or '').strip() or f'postsuper exited with {result.returncode}')
+    cache.delete(SUMMARY_KEY)
+    count = sum(int(m.group(2)) for m in _COUNT_RE.finditer(result.stderr or ''))
+    logger.warning(f"MAILQUEUE_{action.upper()} count={count} target={'ids' if ids else queue} by={actor}")
+    return count
+
+
+def init_app(app):
+    for key, name in (('postqueue', 'MAILQUEUE_POSTQUEUE'), ('postsuper', 'MAILQUEUE_POSTSUPER'),
+                      ('summary_ttl', 'MAILQUEUE_SUMMARY_TTL'), ('scan_timeout', 'MAILQUEUE_SCAN_TIMEOUT')):
+        _settings[key] = app.config.get(name, _settings[key])
@@ -0,0 +1,458 @@
+"""
+ProMail — Prometheus metrics
+Every process keeps its counters, gauges and histogram buckets in its own
+small memory-mapped file under METRICS_DIR, so recording a value is a dict
+lookup and an 8-byte write: no syscalls, and no locks shared with other
+workers. ``GET /metrics`` merges all the files into the text exposition
+format. Exited workers still count toward counters and histograms; their
+gauges are dropped. The endpoint is only reachable on the gunicorn port
+(nginx proxies /api/ alone), and METRICS_TOKEN adds a bearer check.
+"""
+
+import os, hmac, json, glob, mmap, time, bisect, struct, smtplib, threading, logging
+from collections import defaultdict
+
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_settings = {'dir': None, 'token': None}
+
+_HEADER = struct.Struct('q')    # bytes in use
+_LENGTH = struct.Struct('i')
+_VALUE = struct.Struct('d')
+
+
+# ── per-process storage ──
+
+class _ValueFile:
+    """``key -> float`` slots appended to an mmap; readers in other processes only trust the used length."""
+
+    def __init__(self, path, size=1 << 16):
+        self.path = path
+        self._fh = open(path, 'w+b')
+        self._fh.truncate(size)
+        self._map = mmap.mmap(self._fh.fileno(), size)
+        self._used = _HEADER.size
+        _HEADER.pack_into(self._map, 0, self._used)
+        self._positions = {}
+
+    def _slot(self, key):
+        pos = self._positions.get(key)
+        if pos is None:
+            encoded = key.encode()
+            # Values stay 8-byte aligned so a reader never sees half a write
+            padded = encoded + b' ' * (-(_LENGTH.size + len(encoded)) % 8)
+            needed = _LENGTH.size + len(padded) + _VALUE.size
+            if self._used + needed > len(self._map):
+                self._grow(self._used + needed)
+            _LENGTH.pack_into(self._map, self._used, len(padded))
+            self._map[self._used + _LENGTH.size:self._used + _LENGTH.size + len(padded)] = padded
+            pos = self._used + _LENGTH.size + len(padded)
+            _VALUE.pack_into(self._map, pos, 0.0)
+            self._used += needed
+            _HEADER.pack_into(self._map, 0, self._used)
+            self._positions[key] = pos
+        return pos
+
+    def _grow(self, needed):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        self._map.close()
+        self._fh.truncate(size)
+        self._map = mmap.mmap(self._fh.fileno(), size)
+
+    def add(self, key, amount):
+        pos = self._slot(key)
+        _VALUE.pack_into(self._map, pos, _VALUE.unpack_from(self._map, pos)[0] + amount)
+
+    def set(self, key, value):
+        _VALUE.pack_into(self._map, self._slot(key), value)
+
+
+def _read(path):
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    if len(data) < _HEADER.size:
+        return
+    used, pos = min(_HEADER.unpack_from(data, 0)[0], len(data)), _HEADER.size
+    while pos + _LENGTH.size <= used:
+        length = _LENGTH.unpack_from(data, pos)[0]
+        start = pos + _LENGTH.size
+        if length <= 0 or start + length + _VALUE.size > used:
+            return
+        yield data[start:start + length].decode().rstrip(' '), _VALUE.unpack_from(data, start + length)[0]
+        pos = start + length + _VALUE.size
+
+
+class _Store:
+    """Values go to memory until the process serves a request, then to its file.
+
+    CLI commands and the preloading master therefore never leave files
+    behind, and a forked worker starts from zero rather than the master's values.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._file = None
+        self._memory = defaultdict(float)
+
+    def _target(self):
+        if self._pid != os.getpid():
+            self._pid, self._file, self._memory = os.getpid(), None, defaultdict(float)
+        return self._file
+
+    def add(self, key, amount):
+        with self._lock:
+            target = self._target()
+            if target is None:
+                self._memory[key] += amount
+            else:
+                target.add(key, amount)
+
+    def set(self, key, value):
+        with self._lock:
+            target = self._target()
+            if target is None:
+                self._memory[key] = value
+            else:
+                target.set(key, value)
+
+    def activate(self):
+        if self._file is not None and self._pid == os.getpid():
+            return
+        directory = _settings['dir']
+        if not directory:
+            return
+        with self._lock:
+            self._target()
+            try:
+                os.makedirs(directory, exist_ok=True)
+                self._file = _ValueFile(os.path.join(directory, f'{os.getpid()}.db'))
+            except OSError as e:
+                logger.warning(f"METRICS_DISABLED dir={directory} error={e}")
+                _settings['dir'] = None
+                return
+            for key, value in self._memory.items():
+                self._file.set(key, value)
+            self._memory.clear()
+
+
+_store = _Store()
+
+
+# ── metric types ──
+
+_registry = {}
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labels)
+        self._children = {}
+        _registry[name] = self
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._child(tuple(str(v) for v in values))
+        return child
+
+    def _key(self, labels, suffix='', extra=()):
+        return json.dumps([self.name, suffix, list(zip(self.labelnames, labels)) + list(extra)])
+
+
+class _CounterChild:
+    def __init__(self, key):
+        self.key = key
+
+    def inc(self, amount=1):
+        _store.add(self.key, amount)
+
+    def dec(self, amount=1):
+        _store.add(self.key, -amount)
+
+    def set(self, value):
+        _store.set(self.key, value)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _child(self, labels):
+        return _CounterChild(self._key(labels))
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(Counter):
+    """Summed over live processes (e.g. connections checked out across all workers)."""
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+
+class _HistogramChild:
+    def __init__(self, metric, labels):
+        self.bounds = metric.buckets
+        self.bucket_keys = [metric._key(labels, '_bucket', [('le', _format(b))]) for b in metric.buckets]
+        self.bucket_keys.append(metric._key(labels, '_bucket', [('le', '+Inf')]))
+        self.sum_key = metric._key(labels, '_sum')
+
+    def observe(self, value):
+        # Buckets are stored per range and made cumulative when rendered
+        _store.add(self.bucket_keys[bisect.bisect_left(self.bounds, value)], 1)
+        _store.add(self.sum_key, value)
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.started)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labels)
+
+    def _child(self, labels):
+        return _HistogramChild(self, labels)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+
+# ── application metrics ──
+
+http_requests = Counter('promail_http_requests_total', 'HTTP requests by route and status.',
+                        ('blueprint', 'route', 'method', 'status'))
+http_duration = Histogram('promail_http_request_duration_seconds', 'Time to build the response.',
+                          ('blueprint', 'route', 'method'))
+http_queries = Histogram('promail_http_request_db_queries', 'SQL statements issued per request.',
+                         ('blueprint', 'route'), buckets=QUERY_BUCKETS)
+http_sql = Histogram('promail_http_request_db_seconds', 'Time per request spent waiting on SQL.',
+                     ('blueprint', 'route'))
+db_queries = Counter('promail_db_queries_total', 'SQL statements issued, in requests or not.')
+db_checked_out = Gauge('promail_db_pool_checked_out', 'Database connections currently checked out.')
+imap_duration = Histogram('promail_imap_command_duration_seconds', 'IMAP command round trips.', ('command',))
+imap_failures = Counter('promail_imap_command_failures_total', 'IMAP commands that raised.', ('command',))
+imap_bytes = Counter('promail_imap_bytes_total', 'IMAP traffic; raw is protocol bytes, wire is after COMPRESS.',
+                     ('direction', 'layer'))
+imap_connects = Counter('promail_imap_connects_total', 'New IMAP logins (pool misses).')
+imap_idle = Gauge('promail_imap_pool_idle', 'Logged-in IMAP connections parked in the pools.')
+imap_in_use = Gauge('promail_imap_pool_in_use', 'IMAP connections currently lent out by the pools.')
+smtp_duration = Histogram('promail_smtp_command_duration_seconds', 'SMTP command round trips.', ('command',))
+smtp_bytes = Counter('promail_smtp_bytes_total', 'Bytes written to the SMTP server.')
+cache_requests = Counter('promail_cache_requests_total', 'Shared cache lookups by key namespace.',
+                         ('namespace', 'result'))
+bcrypt_depth = Gauge('promail_bcrypt_queue_depth', 'bcrypt jobs running or queued.')
+bcrypt_duration = Histogram('promail_bcrypt_duration_seconds', 'bcrypt wait plus hashing time.',
+                            buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+bcrypt_rejected = Counter('promail_bcrypt_rejected_total', 'bcrypt jobs turned away with a 503.')
+
+
+class SMTP(smtplib.SMTP):
+    """smtplib.SMTP that times each command (plus the greeting, as ``connect``) and counts bytes sent."""
+
+    _command = 'connect'
+
+    def connect(self, *args, **kwargs):
+        self._command, self._sent_at = 'connect', time.perf_counter()
+        return super().connect(*args, **kwargs)
+
+    def putcmd(self, cmd, args=''):
+        self._command, self._sent_at = cmd.split(' ', 1)[0].lower(), time.perf_counter()
+        super().putcmd(cmd, args)
+
+    def send(self, s):
+        super().send(s)
+        smtp_bytes.inc(len(s))
+
+    def getreply(self):
+        try:
+            return super().getreply()
+        finally:
+            now = time.perf_counter()
+            smtp_duration.labels(self._command).observe(now - self._sent_at)
+            charge('smtp', now - self._sent_at)
+            # DATA gets a second reply once the body is sent; time that from here
+            self._sent_at = now
+
+
+# ── exposition ──
+
+def _format(value):
+    return repr(float(value)) if value != int(value) else f'{value:.1f}'
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """Merged samples: {metric name: {(suffix, labels): value}}."""
+    merged = defaultdict(lambda: defaultdict(float))
+    paths = glob.glob(os.path.join(_settings['dir'], '*.db')) if _settings['dir'] else []
+    for path in paths:
+        try:
+            pid = int(os.path.basename(path)[:-3])
+            alive = _alive(pid)
+            for key, value in _read(path):
+                name, suffix, labels = json.loads(key)
+                metric = _registry.get(name)
+                if metric is None or (metric.kind == 'gauge' and not alive):
+                    continue
+                merged[name][(suffix, tuple(tuple(pair) for pair in labels))] += value
+        except (OSError, ValueError) as e:
+            logger.warning(f"METRICS_READ_FAILED path={path} error={e}")
+    if not paths:
+        # Not activated (tests, or METRICS_DIR unusable): this process only
+        with _store._lock:
+            _store._target()
+            for key, value in _store._memory.items():
+                name, suffix, labels = json.loads(key)
+                merged[name][(suffix, tuple(tuple(pair) for pair in labels))] += value
+    return merged
+
+
+def render():
+    merged, lines = collect(), []
+    for name, metric in _registry.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        samples = merged.get(name, {})
+        if metric.kind == 'histogram':
+            series = defaultdict(dict)
+            for (suffix, labels), value in samples.items():
+                base = tuple(pair for pair in labels if pair[0] != 'le')
+                le = dict(labels).get('le') if suffix == '_bucket' else suffix
+                series[base][le] = value
+            for base, values in sorted(series.items()):
+                running = 0
+                for le in [_format(b) for b in metric.buckets] + ['+Inf']:
+                    running += values.get(le, 0)
+                    lines.append(_sample(name + '_bucket', base + (('le', le),), running))
+                lines.append(_sample(name + '_sum', base, values.get('_sum', 0)))
+                lines.append(_sample(name + '_count', base, running))
+        else:
+            for (suffix, labels), value in sorted(samples.items()):
+                lines.append(_sample(name + suffix, labels, value))
+    return '\n'.join(lines) + '\n'
+
+
+def _sample(name, labels, value):
+    text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f"{name}{{{text}}} {value:g}" if text else f"{name} {value:g}"
+
+
+# ── per-request time breakdown ──
+
+def charge(kind, seconds):
+    """Add ``seconds`` spent waiting on ``kind`` (imap, smtp, sql, bcrypt) to the current request."""
+    if has_request_context():
+        spent = g.get('_metrics_time')
+        if spent is not None:
+            spent[kind] = spent.get(kind, 0.0) + seconds
+
+
+def breakdown():
+    """Seconds charged so far in this request, by kind."""
+    return dict(g.get('_metrics_time') or {})
+
+
+# ── hooks ──
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    db_queries.inc()
+    if has_request_context():
+        g._metrics_queries = g.get('_metrics_queries', 0) + 1
+
+
+@event.listens_for(Pool, 'checkout')
+def _checkout(dbapi_connection, record, proxy):
+    db_checked_out.inc()
+
+
+@event.listens_for(Pool, 'checkin')
+def _checkin(dbapi_connection, record):
+    db_checked_out.dec()
+
+
+def init_app(app):
+    _settings['dir'] = app.config.get('METRICS_DIR')
+    _settings['token'] = app.config.get('METRICS_TOKEN')
+    if _settings['dir'] and os.path.isdir(_settings['dir']):
+        # Left over from a previous run of the service (with --preload this runs once, in the master)
+        for path in glob.glob(os.path.join(_settings['dir'], '*.db')):
+            try:
+                if not _alive(int(os.path.basename(path)[:-3])):
+                    os.unlink(path)
+            except (OSError, ValueError):
+                pass
+
+    @app.before_request
+    def _start_timer():
+        _store.activate()
+        g._metrics_started = time.perf_counter()
+        g._metrics_queries = 0
+        g._metrics_time = {}
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            blueprint = request.blueprint or 'app'
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            http_duration.labels(blueprint, route, request.method).observe(time.perf_counter() - started)
+            http_requests.labels(blueprint, route, request.method, response.status_code).inc()
+            http_queries.labels(blueprint, route).observe(g.pop('_metrics_queries', 0))
+            http_sql.labels(blueprint, route).observe(g.get('_metrics_time', {}).get('sql', 0.0))
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        token = _settings['token']
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(401)
+        return Response(render(), mimetype='text/plain; version=0.0.4')
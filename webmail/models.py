@@ -1,15 +1,22 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func, case
 from flask_login import UserMixin
-import bcrypt
-import os
-from cryptography.fernet import Fernet
+import keys
+import passwords
 
 db = SQLAlchemy()
 
-# Encryption key for storing IMAP/SMTP passwords (reversible encryption)
-_FERNET_KEY = os.environ.get('FERNET_KEY', Fernet.generate_key().decode())
-_fernet = Fernet(_FERNET_KEY.encode() if isinstance(_FERNET_KEY, str) else _FERNET_KEY)
+# Encryption for storing IMAP/SMTP passwords (reversible); built on first use
+_fernet = None
+
+
+def _cipher():
+    global _fernet
+    if _fernet is None:
+        from cryptography.fernet import Fernet
+        _fernet = Fernet(keys.load('FERNET_KEY', keys.fernet_key).encode())
+    return _fernet
 
 
 class Domain(db.Model):
@@ -28,9 +35,44 @@ class Domain(db.Model):
     accounts = db.relationship('Account', backref='domain', lazy='dynamic')
     aliases = db.relationship('Alias', backref='domain', lazy='dynamic')
 
+    @classmethod
+    def with_counts(cls, query=None):
+        """Run ``query`` (default: all domains) with account/alias counts joined in, in one round trip."""
+        accounts = (db.session.query(
+                        Account.domain_id.label('domain_id'),
+                        func.count(Account.id).label('total'),
+                        func.sum(case((Account.active.is_(True), 1), else_=0)).label('active'))
+                    .group_by(Account.domain_id).subquery())
+        aliases = (db.session.query(Alias.domain_id.label('domain_id'), func.count(Alias.id).label('total'))
+                   .group_by(Alias.domain_id).subquery())
+        rows = ((query if query is not None else cls.query)
+                .outerjoin(accounts, accounts.c.domain_id == cls.id)
+                .outerjoin(aliases, aliases.c.domain_id == cls.id)
+                .add_columns(func.coalesce(accounts.c.total, 0), func.coalesce(accounts.c.active, 0),
+                             func.coalesce(aliases.c.total, 0))
+                .all())
+        domains = []
+        for domain, total, active, alias_total in rows:
+            domain._counts = {'accounts': int(total), 'active_accounts': int(active), 'aliases': int(alias_total)}
+            domains.append(domain)
+        return domains
+
+    def _count(self, name, query):
+        counts = self.__dict__.get('_counts')
+        return counts[name] if counts is not None else query.count()
+
     @property
     def account_count(self):
-        return self.accounts.filter_by(active=True).count()
+        """Active accounts (preloaded by with_counts(), otherwise one COUNT)."""
+        return self._count('active_accounts', self.accounts.filter_by(active=True))
+
+    @property
+    def account_total(self):
+        return self._count('accounts', self.accounts)
+
+    @property
+    def alias_count(self):
+        return self._count('aliases', self.aliases)
 
     def to_dict(self):
         return {
@@ -42,6 +84,7 @@ class Domain(db.Model):
             'max_quota_mb': self.max_quota_mb,
             'active': self.active,
             'account_count': self.account_count,
+            'alias_count': self.alias_count,
             'created_at': self.created_at.isoformat() if self.created_at else None,
         }
 
@@ -66,21 +109,25 @@ class Account(UserMixin, db.Model):
     contacts = db.relationship('Contact', backref='account', lazy='dynamic')
 
     def set_password(self, password):
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        self.password_hash = passwords.pool.hash(password)
         # Also store encrypted version for IMAP/SMTP auth
-        self.encrypted_password = _fernet.encrypt(password.encode('utf-8')).decode('utf-8')
+        self.encrypted_password = _cipher().encrypt(password.encode('utf-8')).decode('utf-8')
 
     def check_password(self, password):
+        """Verify on the bcrypt pool; upgrades the hash if BCRYPT_ROUNDS changed (caller commits)."""
         try:
-            return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+            ok = passwords.pool.verify(password, self.password_hash)
         except (ValueError, AttributeError):
             return False
+        if ok and passwords.pool.needs_rehash(self.password_hash):
+            self.password_hash = passwords.pool.hash(password)
+        return ok
 
     def _decrypt_password(self):
         """Decrypt the stored password for IMAP/SMTP authentication."""
         if self.encrypted_password:
             try:
-                return _fernet.decrypt(self.encrypted_password.encode('utf-8')).decode('utf-8')
+                return _cipher().decrypt(self.encrypted_password.encode('utf-8')).decode('utf-8')
             except Exception:
                 return ''
         return ''
@@ -215,11 +262,32 @@ class ContactGroup(db.Model):
     name = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    @classmethod
+    def with_counts(cls, query=None):
+        """Run ``query`` (default: all groups) with member counts joined in, in one round trip."""
+        members = (db.session.query(contact_group_members.c.group_id.label('group_id'),
+                                    func.count().label('total'))
+                   .group_by(contact_group_members.c.group_id).subquery())
+        rows = ((query if query is not None else cls.query)
+                .outerjoin(members, members.c.group_id == cls.id)
+                .add_columns(func.coalesce(members.c.total, 0))
+                .all())
+        groups = []
+        for group, total in rows:
+            group._member_count = int(total)
+            groups.append(group)
+        return groups
+
+    @property
+    def member_count(self):
+        count = self.__dict__.get('_member_count')
+        return count if count is not None else len(self.contacts)
+
     def to_dict(self):
         return {
             'id': self.id,
             'name': self.name,
-            'member_count': len(self.contacts),
+            'member_count': self.member_count,
         }
 
 
@@ -233,6 +301,13 @@ contact_group_members = db.Table(
 
 class LoginLog(db.Model):
     __tablename__ = 'login_log'
+    __table_args__ = (
+        # Keyset pagination (created_at, id) plus one index per filter column
+        db.Index('ix_login_log_created', 'created_at', 'id'),
+        db.Index('ix_login_log_success_created', 'success', 'created_at', 'id'),
+        db.Index('ix_login_log_email_created', 'email', 'created_at', 'id'),
+        db.Index('ix_login_log_ip_created', 'ip_address', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     account_id = db.Column(db.Integer, db.ForeignKey('accounts.id'), nullable=True)
@@ -243,6 +318,100 @@ class LoginLog(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class LoginStatDomain(db.Model):
+    """Daily login outcomes per domain, maintained incrementally from login_log."""
+    __tablename__ = 'login_stats_domain_daily'
+
+    day = db.Column(db.Date, primary_key=True)
+    domain = db.Column(db.String(255), primary_key=True)
+    success = db.Column(db.Integer, nullable=False, default=0)
+    failure = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LoginStatAccount(db.Model):
+    """Daily login outcomes per address (including unknown ones)."""
+    __tablename__ = 'login_stats_account_daily'
+
+    email = db.Column(db.String(255), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    domain = db.Column(db.String(255), nullable=False, default='', index=True)
+    success = db.Column(db.Integer, nullable=False, default=0)
+    failure = db.Column(db.Integer, nullable=False, default=0)
+
+
+class LoginRollupState(db.Model):
+    __tablename__ = 'login_rollup_state'
+
+    name = db.Column(db.String(64), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class MailboxUsage(db.Model):
+    """Last measured mailbox size per account, written by the usage scanner."""
+    __tablename__ = 'mailbox_usage'
+
+    account_id = db.Column(db.Integer, db.ForeignKey('accounts.id', ondelete='CASCADE'), primary_key=True)
+    domain_id = db.Column(db.Integer, nullable=False, index=True)
+    bytes = db.Column(db.BigInteger, nullable=False, default=0)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+    source = db.Column(db.String(16))               # maildirsize | walk | imap
+    scan_state = db.Column(db.Text)                 # walker's per-directory mtimes and totals (JSON)
+    scanned_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class MaildirTask(db.Model):
+    """Queued maildir (de)provisioning; no FK so removals outlive the account row."""
+    __tablename__ = 'maildir_tasks'
+    __table_args__ = (
+        db.Index('ix_maildir_tasks_status_next', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(255), nullable=False, index=True)
+    action = db.Column(db.String(16), nullable=False)    # create | remove
+    status = db.Column(db.String(16), nullable=False, default='pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ImportJob(db.Model):
+    """Bulk import progress. ``running`` is True only while the job runs and is unique, so one import runs at a time."""
+    __tablename__ = 'import_jobs'
+
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    running = db.Column(db.Boolean, unique=True)
+    progress = db.Column(db.Text, nullable=False)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class ApiSession(db.Model):
+    """One row per issued API token; kept (without a FK) until the token expires so revocations outlive the account."""
+    __tablename__ = 'api_sessions'
+
+    jti = db.Column(db.String(32), primary_key=True)
+    account_id = db.Column(db.Integer, nullable=False, index=True)
+    ip_address = db.Column(db.String(45))
+    user_agent = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    revoked_at = db.Column(db.DateTime, nullable=True, index=True)
+
+
+class WebSession(db.Model):
+    __tablename__ = 'web_sessions'
+
+    sid = db.Column(db.String(128), primary_key=True)
+    data = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
 class Setting(db.Model):
     __tablename__ = 'settings'
 
@@ -254,17 +423,11 @@ class Setting(db.Model):
 
     @staticmethod
     def get(key_name, default=None):
-        s = Setting.query.filter_by(key=key_name).first()
-        return s.value if s else default
+        """Typed value from the per-worker settings registry (no query)."""
+        import settings
+        return settings.get(key_name, default)
 
     @staticmethod
     def set(key_name, val, description=None):
-        s = Setting.query.filter_by(key=key_name).first()
-        if s:
-            s.value = str(val)
-            if description:
-                s.description = description
-        else:
-            s = Setting(key=key_name, value=str(val), description=description)
-            db.session.add(s)
-        db.session.commit()
+        import settings
+        settings.update({key_name: val}, {key_name: description} if description else None)
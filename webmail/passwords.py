@@ -0,0 +1,180 @@
+"""
+ProMail — password hashing pool
+bcrypt runs on a small dedicated pool with a hard cap on queued work, so a
+burst of logins turns into fast 503s instead of starving every worker. The
+cap is shared by every gunicorn worker on the host: each admitted hash holds
+an flock on one of BCRYPT_WORKERS + BCRYPT_MAX_QUEUE slot files in
+BCRYPT_SLOT_DIR, which the kernel also drops if the worker dies.
+Hashes made with a different cost than BCRYPT_ROUNDS are upgraded on the
+next successful login. Bulk imports hash in a separate process pool across
+all cores instead, since they have no latency budget to protect.
+"""
+
+import os, fcntl, random, bcrypt, threading, time, logging, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from itertools import repeat
+
+import metrics
+from resilience import BackendUnavailable
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Overloaded(BackendUnavailable):
+    def __init__(self):
+        super().__init__('bcrypt', retry_after=2)
+
+
+class HashPool:
+    def __init__(self, workers=2, max_queue=16, rounds=12, timeout=10, slot_dir=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.rounds = rounds
+        self.timeout = timeout
+        self.slot_dir = slot_dir
+        self._executor = None
+        self._lock = threading.Lock()
+        self.depth = 0
+        self.max_depth = 0
+        self.completed = 0
+        self.rejected = 0
+        self.latency_sum = 0.0
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def _claim(self):
+        """Lock a free slot file and return its fd (None without a slot dir); Overloaded if the host is full."""
+        if not self.slot_dir:
+            return None
+        capacity = self.workers + self.max_queue
+        start = random.randrange(capacity)  # spread claims so each rarely tries more than a few files
+        try:
+            os.makedirs(self.slot_dir, exist_ok=True)
+            for i in range(capacity):
+                fd = os.open(os.path.join(self.slot_dir, f'{(start + i) % capacity}.lock'),
+                             os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return fd
+                except BlockingIOError:
+                    os.close(fd)
+        except OSError as e:
+            logger.warning(f"BCRYPT_SLOTS_DISABLED dir={self.slot_dir} error={e}")
+            self.slot_dir = None
+            return None
+        raise self._reject()
+
+    def _reject(self, slot=None):
+        if slot is not None:
+            os.close(slot)
+        with self._lock:
+            self.rejected += 1
+        metrics.bcrypt_rejected.inc()
+        return Overloaded()
+
+    def _run(self, fn, *args):
+        slot = self._claim()
+        with self._lock:
+            full = self.depth >= self.workers + self.max_queue
+            if not full:
+                self.depth += 1
+                self.max_depth = max(self.max_depth, self.depth)
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.workers, thread_name_prefix='promail-bcrypt')
+        if full:
+            raise self._reject(slot)
+        metrics.bcrypt_depth.inc()
+        started = time.monotonic()
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._release(slot)
+            raise
+        # The slot is held until the job actually leaves the executor, not until we stop waiting
+        future.add_done_callback(lambda _: self._release(slot))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()  # only succeeds while it is still queued; a running hash finishes first
+            raise Overloaded()
+        finally:
+            elapsed = time.monotonic() - started
+            metrics.bcrypt_duration.observe(elapsed)
+            metrics.charge('bcrypt', elapsed)
+            with self._lock:
+                self.completed += 1
+                self.latency_sum += elapsed
+                self.latency_buckets[_bucket(elapsed)] += 1
+
+    def _release(self, slot=None):
+        if slot is not None:
+            os.close(slot)  # drops the flock
+        metrics.bcrypt_depth.dec()
+        with self._lock:
+            self.depth -= 1
+
+    def verify(self, password, hashed):
+        return self._run(_checkpw, password, hashed)
+
+    def hash(self, password):
+        return self._run(_hashpw, password, self.rounds)
+
+    def needs_rehash(self, hashed):
+        try:
+            return int(hashed.split('$')[2]) != self.rounds
+        except (AttributeError, IndexError, ValueError):
+            return False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers, 'max_queue': self.max_queue, 'rounds': self.rounds,
+                'depth': self.depth, 'max_depth': self.max_depth,
+                'completed': self.completed, 'rejected': self.rejected,
+                'latency_sum': round(self.latency_sum, 4),
+                'latency_buckets': dict(zip([str(b) for b in LATENCY_BUCKETS] + ['+Inf'],
+                                            self.latency_buckets)),
+            }
+
+
+def _bucket(elapsed):
+    for i, bound in enumerate(LATENCY_BUCKETS):
+        if elapsed <= bound:
+            return i
+    return len(LATENCY_BUCKETS)
+
+
+def _checkpw(password, hashed):
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def _hashpw(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+pool = HashPool()
+
+
+def hash_many(passwords, rounds=None, processes=None):
+    """Yield bcrypt hashes for ``passwords`` in order, computed on every core."""
+    rounds = rounds or pool.rounds
+    processes = min(processes or os.cpu_count() or 1, len(passwords))
+    if processes <= 1:
+        for password in passwords:
+            yield _hashpw(password, rounds)
+        return
+    # spawn, not fork: the caller is a threaded web worker
+    context = multiprocessing.get_context('spawn')
+    chunksize = max(1, min(64, len(passwords) // (processes * 4)))
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        yield from executor.map(_hashpw, passwords, repeat(rounds), chunksize=chunksize)
+
+
+def init_app(app):
+    pool.workers = app.config.get('BCRYPT_WORKERS', pool.workers)
+    pool.max_queue = app.config.get('BCRYPT_MAX_QUEUE', pool.max_queue)
+    pool.rounds = app.config.get('BCRYPT_ROUNDS', pool.rounds)
+    pool.timeout = app.config.get('BCRYPT_TIMEOUT', pool.timeout)
+    pool.slot_dir = app.config.get('BCRYPT_SLOT_DIR', pool.slot_dir)
@@ -0,0 +1,393 @@
+"""
+ProMail — request profiling and the slow-request log
+An admin can profile a single request by sending ``X-Profile: cpu``
+(cProfile), ``sample`` (a stack-sampling thread; folded stacks for
+flamegraph.pl or speedscope) or ``memory`` (tracemalloc: peak and retained
+allocations by line, plus per-call figures for functions wrapped in
+``watch``, e.g. parse_email). PROFILE_SAMPLE_RATE runs the sampler on that
+fraction of all requests. Results are written under PROFILE_DIR and served by
+the admin API. Any request slower than SLOW_REQUEST_SECONDS is logged with its
+time split into IMAP, SMTP, SQL, bcrypt and CPU.
+"""
+
+import os, re, sys, json, time, uuid, random, pstats, cProfile, threading, tracemalloc, logging
+from collections import Counter
+from functools import wraps
+
+import click
+from flask import g, has_request_context, request
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'X-Profile'
+MODES = ('cpu', 'sample', 'memory')
+WAITS = ('imap', 'smtp', 'sql', 'bcrypt')
+SLOW_LOG = 'slow.jsonl'
+
+_ID_RE = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{8}$')
+
+_settings = {
+    'dir': None, 'sample_rate': 0.0, 'interval': 0.005, 'keep': 200,
+    'slow_seconds': 2.0, 'slow_log_bytes': 5 * 1024 * 1024, 'top': 40, 'frames': 25,
+}
+
+# cProfile (on 3.12+) and tracemalloc are process-wide: one request at a time each
+_exclusive = {'cpu': threading.Lock(), 'memory': threading.Lock()}
+
+
+# ── collectors ──
+
+class Sampler(threading.Thread):
+    """Records one thread's stack every ``interval`` seconds as folded-stack counts."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True, name='promail-sampler')
+        self.thread_id, self.interval = thread_id, interval
+        self.stacks = Counter()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.stacks
+
+
+def _snapshot():
+    # Leave out the profiler's own bookkeeping
+    return tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, __file__),
+                                                      tracemalloc.Filter(False, tracemalloc.__file__)))
+
+
+def _allocations(stats):
+    top = _settings['top']
+    return [{'where': f'{s.traceback[0].filename}:{s.traceback[0].lineno}',
+             'bytes': getattr(s, 'size_diff', s.size), 'count': getattr(s, 'count_diff', s.count)}
+            for s in stats[:top]]
+
+
+def _functions(profiler):
+    stats = pstats.Stats(profiler).strip_dirs().sort_stats('cumulative')
+    rows = []
+    for func in stats.fcn_list[:_settings['top']]:
+        _, calls, own, cumulative, _ = stats.stats[func]
+        rows.append({'function': pstats.func_std_string(func), 'calls': calls,
+                     'tottime': round(own, 6), 'cumtime': round(cumulative, 6)})
+    return rows
+
+
+class _Profile:
+    def __init__(self, mode, lock):
+        self.mode, self.lock = mode, lock
+        self.calls, self.peak = {}, 0
+        if mode == 'cpu':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        elif mode == 'sample':
+            self.sampler = Sampler(threading.get_ident(), _settings['interval'])
+            self.sampler.start()
+        else:
+            self.was_tracing = tracemalloc.is_tracing()
+            if not self.was_tracing:
+                tracemalloc.start(_settings['frames'])
+            self.baseline = _snapshot()
+            tracemalloc.reset_peak()
+
+    def measure(self, fn, args, kwargs):
+        """Run ``fn`` and record the memory it peaked at and kept (memory mode only)."""
+        self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+        before = _snapshot()
+        start = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = fn(*args, **kwargs)
+        current, peak = tracemalloc.get_traced_memory()
+        self.peak = max(self.peak, peak)
+        entry = self.calls.setdefault(fn.__qualname__, {'calls': 0, 'peak_bytes': 0, 'retained_bytes': 0,
+                                                        'top': []})
+        entry['calls'] += 1
+        entry['retained_bytes'] += current - start
+        if peak - start > entry['peak_bytes']:
+            # Allocations are only listed for the heaviest call
+            entry['peak_bytes'] = peak - start
+            entry['top'] = _allocations(_snapshot().compare_to(before, 'lineno'))
+        return result
+
+    def stop(self):
+        """Stop collecting; returns (summary dict, sidecar suffix, writer) for save()."""
+        try:
+            if self.mode == 'cpu':
+                self.profiler.disable()
+                return {'functions': _functions(self.profiler)}, 'pstats', self.profiler.dump_stats
+            if self.mode == 'sample':
+                stacks = self.sampler.stop()
+                leaves = Counter()
+                for stack, n in stacks.items():
+                    leaves[stack.rsplit(';', 1)[-1]] += n
+                folded = ''.join(f'{stack} {n}\n' for stack, n in stacks.most_common())
+
+                def write(path):
+                    with open(path, 'w') as fh:
+                        fh.write(folded)
+                summary = {'samples': sum(stacks.values()), 'interval': _settings['interval'],
+                           'leaves': [{'function': f, 'samples': n} for f, n in leaves.most_common(_settings['top'])]}
+                return summary, 'folded', write
+            current, peak = tracemalloc.get_traced_memory()
+            diff = _snapshot().compare_to(self.baseline, 'lineno')
+            if not self.was_tracing:
+                tracemalloc.stop()
+            return {'peak_bytes': max(self.peak, peak), 'retained': _allocations(diff),
+                    'calls': self.calls}, None, None
+        finally:
+            if self.lock is not None:
+                self.lock.release()
+
+
+def watch(fn):
+    """Record peak and retained memory per call of ``fn`` while a memory profile is running."""
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        run = g.get('_profile') if has_request_context() else None
+        if run is None or run.mode != 'memory':
+            return fn(*args, **kwargs)
+        return run.measure(fn, args, kwargs)
+    return wrapper
+
+
+# ── storage ──
+
+def _path(*parts):
+    return os.path.join(_settings['dir'], *parts)
+
+
+def save(meta, suffix=None, writer=None):
+    """Write a profile's summary (and its pstats/folded file); returns its id."""
+    os.makedirs(_settings['dir'], exist_ok=True)
+    profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    if writer:
+        writer(_path(f'{profile_id}.{suffix}'))
+        meta['artifact'] = suffix
+    with open(_path(f'{profile_id}.json.tmp'), 'w') as fh:
+        json.dump(dict(meta, id=profile_id), fh, separators=(',', ':'))
+    os.replace(_path(f'{profile_id}.json.tmp'), _path(f'{profile_id}.json'))
+    _prune()
+    return profile_id
+
+
+def _prune():
+    ids = sorted(name[:-5] for name in os.listdir(_settings['dir']) if name.endswith('.json'))
+    for old in ids[:-_settings['keep']]:
+        for suffix in ('json', 'pstats', 'folded'):
+            try:
+                os.unlink(_path(f'{old}.{suffix}'))
+            except FileNotFoundError:
+                pass  # another worker got there first
+
+
+def get(profile_id):
+    if not _ID_RE.match(profile_id or ''):
+        return None
+    try:
+        with open(_path(f'{profile_id}.json')) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return None
+
+
+def artifact(profile_id):
+    """(path, suffix) of the pstats or folded-stack file behind a profile, or None."""
+    meta = get(profile_id)
+    if not meta or not meta.get('artifact'):
+        return None
+    path = _path(f"{profile_id}.{meta['artifact']}")
+    return (path, meta['artifact']) if os.path.exists(path) else None
+
+
+def recent(limit=50):
+    """Newest profiles first, without their per-function tables."""
+    try:
+        ids = sorted((name[:-5] for name in os.listdir(_settings['dir']) if name.endswith('.json')), reverse=True)
+    except FileNotFoundError:
+        return []
+    found = []
+    for profile_id in ids[:limit]:
+        meta = get(profile_id)
+        if meta:
+            found.append({k: v for k, v in meta.items() if k not in ('functions', 'leaves', 'retained', 'calls')})
+    return found
+
+
+# ── slow requests ──
+
+def _log_slow(entry):
+    line = (json.dumps(entry, separators=(',', ':')) + '\n').encode()
+    try:
+        os.makedirs(_settings['dir'], exist_ok=True)
+        path = _path(SLOW_LOG)
+        try:
+            if os.path.getsize(path) > _settings['slow_log_bytes']:
+                os.replace(path, path + '.1')
+        except FileNotFoundError:
+            pass
+        # One O_APPEND write per line, so lines from different workers don't interleave
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        logger.warning(f"SLOW_LOG_WRITE_FAILED error={e}")
+
+
+def slow_requests(limit=100):
+    """Most recent slow requests, newest first."""
+    entries = []
+    for path in (_path(SLOW_LOG), _path(SLOW_LOG + '.1')):
+        try:
+            with open(path, 'rb') as fh:
+                lines = fh.read().splitlines()
+        except FileNotFoundError:
+            continue
+        for line in reversed(lines):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue  # a line cut short by rotation
+            if len(entries) >= limit:
+                return entries
+    return entries
+
+
+# ── request hooks ──
+
+def _is_admin():
+    from api import get_current_user  # api imports this module
+    user = get_current_user()
+    if user:
+        return bool(user.get('is_admin'))
+    from flask_login import current_user
+    return bool(current_user.is_authenticated and current_user.is_admin)
+
+
+def _requested_mode():
+    mode = request.headers.get(HEADER, '').strip().lower()
+    if mode:
+        return mode if mode in MODES and _is_admin() else None
+    if _settings['sample_rate'] and random.random() < _settings['sample_rate']:
+        return 'sample'
+    return None
+
+
+def _finish(response):
+    """Stop the request's profile (if any) and save it; returns its id."""
+    run = g.pop('_profile', None)
+    if run is None:
+        return None
+    summary, suffix, writer = run.stop()
+    if response is None:
+        return None
+    meta = dict(summary, mode=run.mode, method=request.method, path=request.path,
+                route=request.url_rule.rule if request.url_rule else None, status=response.status_code,
+                seconds=round(time.perf_counter() - g._profile_started, 4), created_at=time.time(),
+                user=(g.get('user') or {}).get('email'))
+    try:
+        return save(meta, suffix, writer)
+    except OSError as e:
+        logger.warning(f"PROFILE_SAVE_FAILED path={request.path} error={e}")
+        return None
+
+
+def init_app(app):
+    for key, name in (('dir', 'PROFILE_DIR'), ('sample_rate', 'PROFILE_SAMPLE_RATE'),
+                      ('interval', 'PROFILE_SAMPLE_INTERVAL'), ('keep', 'PROFILE_KEEP'),
+                      ('slow_seconds', 'SLOW_REQUEST_SECONDS')):
+        _settings[key] = app.config.get(name, _settings[key])
+
+    @app.before_request
+    def _start_profile():
+        g._profile_started = time.perf_counter()
+        g._profile_cpu = time.thread_time()
+        mode = _requested_mode()
+        if mode is None:
+            return
+        lock = _exclusive.get(mode)
+        if lock is not None and not lock.acquire(blocking=False):
+            logger.info(f"PROFILE_BUSY mode={mode} path={request.path}")
+            return
+        g._profile = _Profile(mode, lock)
+
+    @app.after_request
+    def _finish_request(response):
+        started = g.get('_profile_started')
+        if started is None:
+            return response
+        profile_id = _finish(response)
+        if profile_id:
+            response.headers['X-Profile-Id'] = profile_id
+        elapsed = time.perf_counter() - started
+        if _settings['slow_seconds'] and elapsed >= _settings['slow_seconds']:
+            spent = metrics.breakdown()
+            cpu = time.thread_time() - g._profile_cpu
+            entry = {'at': time.time(), 'method': request.method, 'path': request.path,
+                     'route': request.url_rule.rule if request.url_rule else None,
+                     'status': response.status_code, 'seconds': round(elapsed, 3),
+                     'cpu': round(cpu, 3), 'queries': g.get('_metrics_queries', 0),
+                     'user': (g.get('user') or {}).get('email'), 'profile': profile_id}
+            entry.update({kind: round(spent.get(kind, 0.0), 3) for kind in WAITS})
+            # Locks, the pool queue, GC pauses and anything else not charged above
+            entry['other'] = round(max(0.0, elapsed - cpu - sum(spent.values())), 3)
+            logger.warning('SLOW_REQUEST ' + ' '.join(f'{k}={entry[k]}' for k in (
+                'method', 'path', 'status', 'seconds', 'cpu') + WAITS + ('other', 'queries')))
+            _log_slow(entry)
+        return response
+
+    @app.teardown_request
+    def _discard_profile(exc):
+        # after_request doesn't run when the response itself failed; never leave a profiler running
+        if g.get('_profile') is not None:
+            _finish(None)
+
+    @app.cli.command('profile-parse')
+    @click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+    @click.option('--repeat', default=1, show_default=True, help='Parse each message this many times.')
+    @click.option('--legacy', is_flag=True, help='Profile the template views\' parser (with bleach).')
+    def profile_parse_command(paths, repeat, legacy):
+        """Run the message parser on .eml files under cProfile and tracemalloc."""
+        if legacy:
+            from mail.routes import parse_email_message as parse
+        else:
+            from api import parse_email as parse
+        messages = []
+        for path in paths:
+            with open(path, 'rb') as fh:
+                messages.append(fh.read())
+        tracemalloc.start(_settings['frames'])
+        before = _snapshot()
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        parsed = [parse(raw, n) for _ in range(repeat) for n, raw in enumerate(messages, 1)]
+        profiler.disable()
+        elapsed = time.perf_counter() - started
+        current, peak = tracemalloc.get_traced_memory()
+        diff = _snapshot().compare_to(before, 'lineno')
+        tracemalloc.stop()
+        click.echo(f'{len(parsed)} parses in {elapsed:.3f}s; peak {peak / 1024:.0f} KiB, '
+                   f'retained {current / 1024:.0f} KiB')
+        click.echo('\nallocations still held by the results:')
+        for row in _allocations(diff)[:15]:
+            click.echo(f"  {row['bytes'] / 1024:10.1f} KiB {row['count']:8d}  {row['where']}")
+        click.echo('\nslowest functions (cumulative):')
+        for row in _functions(profiler)[:25]:
+            click.echo(f"  {row['cumtime']:9.4f}s {row['tottime']:9.4f}s {row['calls']:8d}  {row['function']}")
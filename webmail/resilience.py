@@ -0,0 +1,192 @@
+"""
+ProMail — timeouts and circuit breakers for backend calls
+Every IMAP, SMTP and subprocess call gets a bounded timeout (capped by the
+request's deadline) and goes through a per-backend circuit breaker, so a hung
+dovecot/postfix/systemd fails fast with a 503 instead of pinning every worker.
+"""
+
+import imaplib, smtplib, subprocess, threading, time, logging
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean "the backend is unhealthy" as opposed to "the backend said no"
+FAILURE_ERRORS = (OSError, imaplib.IMAP4.abort, subprocess.TimeoutExpired)
+HEALTHY_ERRORS = (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)
+
+
+def is_failure(exc):
+    return isinstance(exc, FAILURE_ERRORS) and not isinstance(exc, HEALTHY_ERRORS)
+
+
+class BackendUnavailable(Exception):
+    def __init__(self, backend, retry_after=1):
+        super().__init__(f'{backend} is unavailable, retry in {retry_after}s')
+        self.backend = backend
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(BackendUnavailable):
+    def __init__(self, backend):
+        super().__init__(backend, retry_after=1)
+        self.args = (f'request deadline exceeded before calling {backend}',)
+
+
+class CircuitBreaker:
+    """Closed → open after ``threshold`` consecutive failures; one half-open probe after ``reset_timeout``."""
+
+    def __init__(self, name, threshold=5, reset_timeout=30):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejections = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        return max(1, int(self.opened_at + self.reset_timeout - time.monotonic()) + 1)
+
+    def before_call(self):
+        with self._lock:
+            if self.state == 'closed':
+                return
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return
+            self.rejections += 1
+            raise BackendUnavailable(self.name, self.retry_after())
+
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info(f"CIRCUIT_CLOSED backend={self.name}")
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.threshold):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                logger.warning(f"CIRCUIT_OPEN backend={self.name} failures={self.failures}")
+
+    @contextmanager
+    def guard(self):
+        self.before_call()
+        try:
+            yield
+        except BaseException as e:
+            if is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        else:
+            self.record_success()
+
+    def to_dict(self):
+        return {
+            'state': self.state, 'failures': self.failures,
+            'trips': self.trips, 'rejections': self.rejections,
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_settings = {'threshold': 5, 'reset_timeout': 30, 'timeouts': {}}
+
+
+def breaker(name):
+    with _breakers_lock:
+        cb = _breakers.get(name)
+        if cb is None:
+            cb = _breakers[name] = CircuitBreaker(
+                name, _settings['threshold'], _settings['reset_timeout'])
+        return cb
+
+
+def stats():
+    with _breakers_lock:
+        return {name: cb.to_dict() for name, cb in _breakers.items()}
+
+
+def timeout_for(operation, backend=None):
+    """Per-operation timeout, shortened to whatever is left of the request deadline."""
+    timeout = _settings['timeouts'].get(operation, 10)
+    if has_request_context() and getattr(g, 'deadline', None):
+        remaining = g.deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(backend or operation)
+        timeout = min(timeout, remaining)
+    return timeout
+
+
+def run(args, timeout=None, **kwargs):
+    """subprocess.run() with capture, a bounded timeout and a breaker per executable."""
+    name = f'subprocess:{args[0]}'
+    timeout = min(timeout or timeout_for('subprocess', name), timeout_for('subprocess_max', name))
+    with breaker(name).guard():
+        return subprocess.run(args, capture_output=True, text=True, timeout=timeout, **kwargs)
+
+
+@contextmanager
+def popen(args, timeout=None):
+    """Stream a command's stdout line by line; same breaker and timeout cap as run(), killed on overrun."""
+    name = f'subprocess:{args[0]}'
+    timeout = min(timeout or timeout_for('subprocess', name), timeout_for('subprocess_max', name))
+    expired = threading.Event()
+    with breaker(name).guard():
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+
+        def expire():
+            expired.set()
+            proc.kill()
+
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+        try:
+            yield proc.stdout
+        finally:
+            # A reader that stopped early makes the command exit on SIGPIPE; the timer stays armed until it does
+            proc.stdout.close()
+            stderr = proc.stderr.read()
+            proc.stderr.close()
+            proc.wait()
+            timer.cancel()
+        if expired.is_set():
+            raise subprocess.TimeoutExpired(args, timeout)
+        if proc.returncode > 0:
+            raise subprocess.CalledProcessError(proc.returncode, args, stderr=stderr)
+
+
+def start_deadline(seconds):
+    g.deadline = time.monotonic() + seconds
+
+
+def init_app(app):
+    _settings['threshold'] = app.config.get('CIRCUIT_FAILURE_THRESHOLD', 5)
+    _settings['reset_timeout'] = app.config.get('CIRCUIT_RESET_TIMEOUT', 30)
+    _settings['timeouts'] = {
+        'imap': app.config.get('IMAP_TIMEOUT', 10),
+        'smtp': app.config.get('SMTP_TIMEOUT', 15),
+        'subprocess': app.config.get('SUBPROCESS_TIMEOUT', 5),
+        'subprocess_max': app.config.get('SUBPROCESS_MAX_TIMEOUT', 30),
+    }
+    deadline = app.config.get('REQUEST_DEADLINE', 25)
+
+    @app.before_request
+    def _request_deadline():
+        start_deadline(deadline)
@@ -0,0 +1,199 @@
+"""
+ProMail — server-side sessions
+Session data lives in Redis or in the ``web_sessions`` table, keyed by a
+random id carried in the session cookie. Nothing is written for anonymous
+requests or for sessions that didn't change; expiry is the store's job
+(Redis key TTLs, an indexed ``expires_at`` swept opportunistically).
+"""
+
+import re, random, hashlib, secrets, logging
+from datetime import datetime, timedelta
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from cache import cache, RedisBackend
+from models import db, WebSession
+
+logger = logging.getLogger(__name__)
+
+_SID_RE = re.compile(r'^[A-Za-z0-9_-]{20,128}$')
+
+# Entries copied over from Flask-Session's filesystem store are keyed by
+# md5(prefix + sid), which is all the file name tells us about the cookie.
+LEGACY_PREFIX = 'legacy:'
+
+
+def legacy_key(sid, key_prefix='session:'):
+    return LEGACY_PREFIX + hashlib.md5((key_prefix + sid).encode('utf-8')).hexdigest()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, ttl_left=None):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.ttl_left = ttl_left
+        self.modified = False
+
+
+# ── Stores: load(sid) -> (data, seconds_left) | None, save, touch, delete ──
+
+class RedisSessionStore:
+    def __init__(self, client, prefix='sess:'):
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, sid):
+        pipe = self.client.pipeline()
+        pipe.get(self.prefix + sid)
+        pipe.ttl(self.prefix + sid)
+        data, ttl = pipe.execute()
+        if data is None:
+            return None
+        return data.decode('utf-8'), ttl if ttl >= 0 else None
+
+    def save(self, sid, data, ttl):
+        self.client.set(self.prefix + sid, data, ex=ttl)
+
+    def touch(self, sid, ttl):
+        self.client.expire(self.prefix + sid, ttl)
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+
+class DBSessionStore:
+    """Uses Core statements on their own connection so they never join the request's ORM transaction."""
+
+    def __init__(self, sweep_probability=0.001):
+        self.table = WebSession.__table__
+        self.sweep_probability = sweep_probability
+
+    def load(self, sid):
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                self.table.select().where(self.table.c.sid == sid)).first()
+        if row is None:
+            return None
+        left = (row.expires_at - datetime.utcnow()).total_seconds()
+        if left <= 0:
+            return None
+        return row.data, int(left)
+
+    def save(self, sid, data, ttl):
+        expires = datetime.utcnow() + timedelta(seconds=ttl)
+        with db.engine.begin() as conn:
+            updated = conn.execute(
+                self.table.update().where(self.table.c.sid == sid)
+                .values(data=data, expires_at=expires)).rowcount
+            if not updated:
+                conn.execute(self.table.insert().values(sid=sid, data=data, expires_at=expires))
+        if random.random() < self.sweep_probability:
+            self.sweep()
+
+    def touch(self, sid, ttl):
+        with db.engine.begin() as conn:
+            conn.execute(
+                self.table.update().where(self.table.c.sid == sid)
+                .values(expires_at=datetime.utcnow() + timedelta(seconds=ttl)))
+
+    def delete(self, sid):
+        with db.engine.begin() as conn:
+            conn.execute(self.table.delete().where(self.table.c.sid == sid))
+
+    def sweep(self):
+        with db.engine.begin() as conn:
+            removed = conn.execute(
+                self.table.delete().where(self.table.c.expires_at < datetime.utcnow())).rowcount
+        if removed:
+            logger.info(f"SESSION_SWEEP removed={removed}")
+        return removed
+
+
+class ServerSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, key_prefix='session:', refresh_ratio=0.5):
+        self.store = store
+        self.key_prefix = key_prefix
+        self.refresh_ratio = refresh_ratio
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid or not _SID_RE.match(sid):
+            return ServerSession()
+        try:
+            item = self.store.load(sid)
+            if item is None:
+                return self._adopt_legacy(sid)
+            data, ttl_left = item
+            return ServerSession(self.serializer.loads(data), sid=sid, ttl_left=ttl_left)
+        except Exception as e:
+            logger.warning(f"SESSION_LOAD_FAILED error={e}")
+            return ServerSession()
+
+    def _adopt_legacy(self, sid):
+        key = legacy_key(sid, self.key_prefix)
+        item = self.store.load(key)
+        if item is None:
+            return ServerSession()
+        self.store.delete(key)
+        session = ServerSession(self.serializer.loads(item[0]), sid=sid)
+        session.modified = True  # re-save under the real id
+        return session
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.sid and session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app))
+            return
+
+        ttl = int(app.permanent_session_lifetime.total_seconds())
+        try:
+            if session.modified or session.sid is None:
+                session.sid = session.sid or secrets.token_urlsafe(32)
+                self.store.save(session.sid, self.serializer.dumps(dict(session)), ttl)
+            elif session.ttl_left is not None and session.ttl_left < ttl * self.refresh_ratio:
+                # Sliding expiry without rewriting the payload on every request
+                self.store.touch(session.sid, ttl)
+            else:
+                return
+        except Exception as e:
+            logger.warning(f"SESSION_SAVE_FAILED error={e}")
+            return
+
+        response.set_cookie(
+            name, session.sid, expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+def build_store(app, session_type=None):
+    session_type = session_type or app.config.get('SESSION_TYPE')
+    if session_type == 'redis':
+        url = app.config.get('SESSION_REDIS_URL') or app.config.get('REDIS_URL')
+        if isinstance(cache.backend, RedisBackend) and url == app.config.get('REDIS_URL'):
+            return RedisSessionStore(cache.backend.client)
+        try:
+            backend = RedisBackend(url)
+            backend.client.ping()
+            return RedisSessionStore(backend.client)
+        except Exception as e:
+            logger.warning(f"REDIS_UNAVAILABLE url={url} error={e}; storing sessions in the database")
+    return DBSessionStore(app.config.get('SESSION_SWEEP_PROBABILITY', 0.001))
+
+
+def init_app(app):
+    store = build_store(app)
+    app.session_interface = ServerSessionInterface(
+        store, key_prefix=app.config.get('SESSION_KEY_PREFIX', 'session:'))
+    logger.info(f"SESSION_STORE type={type(store).__name__}")
@@ -0,0 +1,193 @@
+"""
+ProMail — system settings registry
+All ``settings`` rows are loaded once per worker into a typed map, so reads
+on request paths are dict lookups. Updates are written as one bulk upsert
+that stamps updated_at. Every SETTINGS_POLL_INTERVAL each worker re-reads
+only the rows stamped since the newest one it holds, so a change made on any
+worker is seen everywhere within seconds with or without Redis; a broadcast
+(when Redis is configured) just makes it immediate.
+"""
+
+import threading, time, logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+
+import broadcast
+from models import db, Setting
+
+logger = logging.getLogger(__name__)
+
+# Polls re-read rows this much older than the newest one seen: covers writes
+# stamped in the same second and transactions that committed late
+_SLACK = timedelta(seconds=5)
+
+
+def _bool(value):
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+# Known keys and their types; anything else is kept as a string
+TYPES = {
+    'max_attachment_size': int,
+    'default_quota': int,
+    'allow_registration': _bool,
+    'smtp_banner': str,
+    'spam_threshold': float,
+    'virus_scanning': _bool,
+    'dkim_enabled': _bool,
+    'spf_enabled': _bool,
+    'dmarc_enabled': _bool,
+    'rate_limit_per_hour': int,
+    'system_name': str,
+    'system_version': str,
+}
+
+
+def _parse(key, raw):
+    if raw is None:
+        return None
+    try:
+        return TYPES.get(key, str)(raw)
+    except (TypeError, ValueError):
+        logger.warning(f"SETTING_INVALID key={key} value={raw!r}")
+        return None
+
+
+def _dump(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '' if value is None else str(value)
+
+
+class SettingsRegistry:
+    def __init__(self, poll_interval=5, max_age=300):
+        self.poll_interval = poll_interval
+        self.max_age = max_age
+        self.app = None
+        self._watermark = None  # newest updated_at loaded
+        self._rows = {}     # key -> (raw value, description)
+        self._values = {}   # key -> typed value
+        self._loaded_at = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def get(self, key, default=None):
+        self._ensure_fresh()
+        value = self._values.get(key)
+        return default if value is None else value
+
+    def all(self):
+        self._ensure_fresh()
+        return [{'key': k, 'value': v, 'description': d or ''}
+                for k, (v, d) in sorted(self._rows.items())]
+
+    def update(self, values, descriptions=None):
+        """Upsert ``{key: value}`` in one transaction and tell every worker."""
+        if not values:
+            return
+        descriptions = descriptions or {}
+        table = Setting.__table__
+        now = datetime.utcnow()
+        for attempt in (1, 2):
+            try:
+                with self._context(), db.engine.begin() as conn:
+                    existing = {row.key for row in conn.execute(
+                        db.select(table.c.key).where(table.c.key.in_(list(values))))}
+                    updates = [{'k': k, 'v': _dump(v), 'ts': now} for k, v in values.items() if k in existing]
+                    inserts = [{'key': k, 'value': _dump(v), 'description': descriptions.get(k), 'updated_at': now}
+                               for k, v in values.items() if k not in existing]
+                    if updates:
+                        conn.execute(table.update().where(table.c.key == bindparam('k'))
+                                     .values(value=bindparam('v'), updated_at=bindparam('ts')), updates)
+                    for k, d in descriptions.items():
+                        if d and k in existing:
+                            conn.execute(table.update().where(table.c.key == k)
+                                         .values(description=d, updated_at=now))
+                    if inserts:
+                        conn.execute(table.insert().values(inserts))
+                break
+            except IntegrityError:
+                # A concurrent writer inserted one of the keys first; the retry updates it instead
+                if attempt == 2:
+                    raise
+        self.invalidate()
+        broadcast.publish('settings', list(values))
+
+    def invalidate(self, keys=None):
+        self._loaded_at = None
+
+    # ── internals ──
+
+    def _context(self):
+        # Usable from CLI commands and background threads as well as requests
+        return self.app.app_context()
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._loaded_at is not None and now - self._loaded_at < self.max_age:
+            if now - self._checked_at >= self.poll_interval:
+                self._poll()
+            return
+        with self._lock:
+            if self._loaded_at is None or self._loaded_at < now:  # not reloaded while we waited
+                self._load()
+
+    def _select(self):
+        table = Setting.__table__
+        return db.select(table.c.key, table.c.value, table.c.description, table.c.updated_at)
+
+    def _load(self):
+        with self._context(), db.engine.connect() as conn:
+            rows = conn.execute(self._select()).all()
+        self._apply(rows, replace=True)
+        self._loaded_at = self._checked_at = time.monotonic()
+        self.reloads += 1
+
+    def _poll(self):
+        # One thread polls; the rest keep answering from the current map
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            query = self._select()
+            if self._watermark is not None:
+                query = query.where(Setting.__table__.c.updated_at >= self._watermark - _SLACK)
+            with self._context(), db.engine.connect() as conn:
+                rows = conn.execute(query).all()
+            self._apply(rows)
+        except Exception as e:
+            logger.warning(f"SETTINGS_POLL_FAILED error={e}")
+        finally:
+            self._checked_at = time.monotonic()
+            self._lock.release()
+
+    def _apply(self, rows, replace=False):
+        # Built aside and swapped in, so readers never see a half-updated map
+        raw = {} if replace else dict(self._rows)
+        values = {} if replace else dict(self._values)
+        for r in rows:
+            raw[r.key] = (r.value, r.description)
+            values[r.key] = _parse(r.key, r.value)
+            if r.updated_at and (self._watermark is None or r.updated_at > self._watermark):
+                self._watermark = r.updated_at
+        self._rows, self._values = raw, values
+
+
+registry = SettingsRegistry()
+broadcast.subscribe('settings', registry.invalidate)
+
+
+def get(key, default=None):
+    return registry.get(key, default)
+
+
+def update(values, descriptions=None):
+    registry.update(values, descriptions)
+
+
+def init_app(app):
+    registry.app = app
+    registry.poll_interval = app.config.get('SETTINGS_POLL_INTERVAL', registry.poll_interval)
+    registry.max_age = app.config.get('SETTINGS_MAX_AGE', registry.max_age)
@@ -0,0 +1,175 @@
+"""
+ProMail — request coalescing (single-flight)
+Concurrent callers asking for the same key share one backend round trip.
+Inside a worker, followers wait on the leader's thread. Across workers the
+leader holds a lock and publishes its result for a short reuse window: in
+Redis when it is configured, otherwise as an flock'ed file per key in
+SINGLEFLIGHT_DIR with the JSON result beside it.
+"""
+
+import os, json, fcntl, hashlib, threading, time, logging
+
+from cache import cache, RedisBackend
+
+logger = logging.getLogger(__name__)
+
+_settings = {'result_ttl': 2, 'lock_ttl': 15, 'wait': 10, 'dir': None}
+_pruned = {'at': 0.0}
+_calls = {}
+_calls_lock = threading.Lock()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def do(key, fn):
+    """Return ``fn()``, running it at most once for overlapping callers of ``key``."""
+    hit = cache.get(f'sf:{key}:result')
+    if hit is not None:
+        return hit['value']
+
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        if call.done.wait(_settings['wait']):
+            if call.error is not None:
+                raise call.error
+            return call.value
+        return fn()
+
+    try:
+        call.value = _shared(key, fn)
+        return call.value
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _calls_lock:
+            _calls.pop(key, None)
+        call.done.set()
+
+
+def _shared(key, fn):
+    if isinstance(cache.backend, RedisBackend):
+        return _shared_cache(key, fn)
+    if _settings['dir']:
+        return _shared_file(key, fn)
+    return fn()
+
+
+def _shared_cache(key, fn):
+    lock_key, result_key = f'sf:{key}:lock', f'sf:{key}:result'
+    if cache.add(lock_key, 1, _settings['lock_ttl']):
+        try:
+            value = fn()
+            cache.set(result_key, {'value': value}, _settings['result_ttl'])
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    # Another worker is already on it: poll for its result, bail out if it gives up
+    deadline = time.monotonic() + _settings['wait']
+    delay = 0.01
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.2)
+        hit = cache.get(result_key)
+        if hit is not None:
+            return hit['value']
+        if cache.get(lock_key) is None:
+            break
+    return fn()
+
+
+def _shared_file(key, fn):
+    directory = _settings['dir']
+    base = os.path.join(directory, hashlib.sha1(key.encode()).hexdigest())
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        fd = os.open(base + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    except OSError as e:
+        logger.warning(f"SINGLEFLIGHT_DISABLED dir={directory} error={e}")
+        _settings['dir'] = None
+        return fn()
+    try:
+        if not _lock_file(fd):
+            return fn()  # the other worker's leader is taking too long; don't queue behind it
+        # Got the lock: either nobody was on it, or a leader just finished and left its result
+        hit = _read_result(base + '.result')
+        if hit is not None:
+            return hit['value']
+        value = fn()
+        _write_result(base + '.result', value)
+        return value
+    finally:
+        os.close(fd)  # drops the flock
+
+
+def _lock_file(fd):
+    deadline = time.monotonic() + _settings['wait']
+    delay = 0.01
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.2)
+
+
+def _read_result(path):
+    try:
+        if time.time() - os.stat(path).st_mtime > _settings['result_ttl']:
+            return None
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_result(path, value):
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}'
+    try:
+        with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            json.dump({'value': value}, f)
+        os.replace(tmp, path)
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning(f"SINGLEFLIGHT_WRITE_FAILED path={path} error={e}")
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+    _prune()
+
+
+def _prune():
+    """Delete results past any reuse and locks idle for an hour; a lock lost in a race only costs a duplicate call."""
+    now = time.time()
+    if now - _pruned['at'] < 60:
+        return
+    _pruned['at'] = now
+    try:
+        with os.scandir(_settings['dir']) as entries:
+            for entry in entries:
+                age = now - entry.stat().st_mtime
+                if age > (3600 if entry.name.endswith('.lock') else 60):
+                    os.unlink(entry.path)
+    except OSError:
+        pass
+
+
+def init_app(app):
+    _settings['result_ttl'] = app.config.get('SINGLEFLIGHT_RESULT_TTL', 2)
+    _settings['lock_ttl'] = app.config.get('SINGLEFLIGHT_LOCK_TTL', 15)
+    _settings['wait'] = app.config.get('SINGLEFLIGHT_WAIT', 10)
+    _settings['dir'] = app.config.get('SINGLEFLIGHT_DIR', _settings['dir'])
@@ -0,0 +1,145 @@
+"""
+ProMail — per-request SQL accounting and N+1 detection
+Every statement a request runs is counted and timed under its shape: the SQL
+text with placeholder lists and multi-row VALUES collapsed. One shape run
+SQL_REPEAT_THRESHOLD or more times in a request is nearly always a lazy
+relationship loaded once per row. It is logged with the route and counted in
+promail_db_repeated_queries_total, and with SQL_ASSERT_REPEATS set (test and
+CI runs) the request raises RepeatedQueries instead of answering.
+``capture()`` gathers the same figures around a block of test code.
+"""
+
+import re, time, threading, logging
+from contextlib import contextmanager
+from functools import lru_cache
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_PARAM = r'(?:\?|%s|%\(\w+\)s|:\w+|\$\d+)'
+_PARAM_LIST_RE = re.compile(rf'{_PARAM}(?:\s*,\s*{_PARAM})+')
+_ROWS_RE = re.compile(r'(\([^()]*\))(?:\s*,\s*\1)+')
+_SPACE_RE = re.compile(r'\s+')
+
+_settings = {'threshold': 5, 'assert': False}
+_local = threading.local()
+
+repeated_queries = metrics.Counter('promail_db_repeated_queries_total',
+                                   'Statement shapes run SQL_REPEAT_THRESHOLD+ times in one request (N+1).',
+                                   ('blueprint', 'route'))
+
+
+class RepeatedQueries(AssertionError):
+    def __init__(self, route, repeated):
+        self.route, self.repeated = route, repeated
+        lines = '\n'.join(f'  {count}x {statement}' for statement, count, _ in repeated)
+        super().__init__(f'{route} repeated {len(repeated)} statement(s):\n{lines}')
+
+
+@lru_cache(maxsize=1024)
+def shape(statement):
+    """``statement`` with whitespace folded and IN-lists / VALUES rows collapsed to one."""
+    text = _PARAM_LIST_RE.sub('?, ...', _SPACE_RE.sub(' ', statement).strip())
+    return _ROWS_RE.sub(r'\1, ...', text)
+
+
+def _add(shapes, key, elapsed):
+    entry = shapes.get(key)
+    if entry is None:
+        shapes[key] = [1, elapsed]
+    else:
+        entry[0] += 1
+        entry[1] += elapsed
+
+
+def repeated(shapes, threshold=None):
+    """(statement, count, seconds) for each shape at or over ``threshold``, most frequent first."""
+    threshold = threshold or _settings['threshold']
+    found = [(key, count, seconds) for key, (count, seconds) in shapes.items() if count >= threshold]
+    return sorted(found, key=lambda item: -item[1])
+
+
+# ── test helper ──
+
+class Capture:
+    def __init__(self):
+        self.shapes = {}
+
+    @property
+    def count(self):
+        return sum(count for count, _ in self.shapes.values())
+
+    @property
+    def seconds(self):
+        return sum(seconds for _, seconds in self.shapes.values())
+
+    def repeated(self, threshold=None):
+        return repeated(self.shapes, threshold)
+
+    def assert_no_repeats(self, threshold=None):
+        found = self.repeated(threshold)
+        if found:
+            raise RepeatedQueries('capture', found)
+
+
+@contextmanager
+def capture():
+    """Statements run on this thread inside the block, test-client requests included."""
+    captured = Capture()
+    stack = _local.__dict__.setdefault('captures', [])
+    stack.append(captured)
+    try:
+        yield captured
+    finally:
+        stack.remove(captured)
+
+
+# ── hooks ──
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and (has_request_context() or getattr(_local, 'captures', None)):
+        context._sqlwatch_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _finish_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_sqlwatch_started', None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    key = shape(statement)
+    if has_request_context():
+        metrics.charge('sql', elapsed)
+        shapes = g.get('_sql_shapes')
+        if shapes is None:
+            shapes = g._sql_shapes = {}
+        _add(shapes, key, elapsed)
+    for captured in getattr(_local, 'captures', ()):
+        _add(captured.shapes, key, elapsed)
+
+
+def init_app(app):
+    for key, name in (('threshold', 'SQL_REPEAT_THRESHOLD'), ('assert', 'SQL_ASSERT_REPEATS')):
+        _settings[key] = app.config.get(name, _settings[key])
+
+    @app.after_request
+    def _check_repeats(response):
+        shapes = g.pop('_sql_shapes', None)
+        found = repeated(shapes) if shapes else None
+        if not found:
+            return response
+        blueprint = request.blueprint or 'app'
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        for statement, count, seconds in found:
+            repeated_queries.labels(blueprint, route).inc()
+            logger.warning(f"SQL_REPEATED method={request.method} route={route} count={count} "
+                           f"seconds={seconds:.3f} statement={statement[:300]}")
+        if _settings['assert']:
+            raise RepeatedQueries(f'{request.method} {route}', found)
+        return response
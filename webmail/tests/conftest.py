@@ -0,0 +1,56 @@
+"""
+ProMail — shared test setup
+Points the app at an in-memory SQLite database and throwaway key/session
+directories before any test module imports it.
+"""
+
+import os, sys, tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('KEYS_DIR', tempfile.mkdtemp(prefix='promail-keys-'))
+
+import config
+
+config.Config.SQLALCHEMY_DATABASE_URI = 'sqlite://'
+config.Config.SQLALCHEMY_ENGINE_OPTIONS = {}
+config.Config.SESSION_FILE_DIR = tempfile.mkdtemp(prefix='promail-sessions-')
+_scratch = tempfile.mkdtemp(prefix='promail-tests-')
+config.Config.BCRYPT_SLOT_DIR = os.path.join(_scratch, 'bcrypt_slots')
+config.Config.METRICS_DIR = os.path.join(_scratch, 'metrics')
+config.Config.SINGLEFLIGHT_DIR = os.path.join(_scratch, 'singleflight')
+config.Config.AUDIT_SPOOL_PATH = os.path.join(_scratch, 'audit_spool.jsonl')
+
+
+@pytest.fixture(scope='session')
+def app():
+    import passwords
+    from app import app as flask_app
+    from models import db
+    passwords.pool.rounds = 4
+    with flask_app.app_context():
+        db.create_all()
+    return flask_app
+
+
+@pytest.fixture(scope='session')
+def create_account(app):
+    """Factory for accounts in their own domain; returns the account id."""
+    from models import db, Domain, Account
+
+    def create(email, password='password123', **fields):
+        with app.app_context():
+            name = email.split('@')[1]
+            domain = Domain.query.filter_by(name=name).first()
+            if domain is None:
+                domain = Domain(name=name)
+                db.session.add(domain)
+                db.session.flush()
+            account = Account(email=email, domain_id=domain.id, name=email.split('@')[0], **fields)
+            account.set_password(password)
+            db.session.add(account)
+            db.session.commit()
+            return account.id
+
+    return create
@@ -0,0 +1,89 @@
+"""
+ProMail — minimal IMAP server for tests
+Listens on localhost and speaks just enough IMAP4rev1 for the pool and the
+mail endpoints: LOGIN, CAPABILITY, SELECT/EXAMINE, STATUS, FETCH, STORE,
+APPEND (synchronizing and LITERAL+), UNSELECT and LOGOUT. Commands named in
+``hang`` are read but never answered, so the client hits its timeout.
+"""
+
+import re, socket, threading
+
+MESSAGE = b'From: bob@example.com\r\nSubject: stub\r\n\r\nhello\r\n'
+_APPEND_RE = re.compile(r'^("(?:[^"\\]|\\.)*"|\S+) .*\{(\d+)(\+?)\}$')
+
+
+class StubIMAP:
+    def __init__(self, capabilities=('IMAP4rev1', 'LITERAL+', 'UNSELECT'), folders=('INBOX', 'Sent')):
+        self.capabilities = ' '.join(capabilities)
+        self.folders = set(folders)
+        self.appended = []  # (mailbox, literal, synchronizing)
+        self.commands = []
+        self.hang = set()
+        self._closed = threading.Event()
+        self._sock = socket.create_server(('127.0.0.1', 0))
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def close(self):
+        self._closed.set()
+        self._sock.close()
+
+    def _serve(self):
+        while True:
+            try:
+                client, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._session, args=(client,), daemon=True).start()
+
+    def _session(self, client):
+        reader = client.makefile('rb')
+
+        def say(line):
+            client.sendall(line.encode() + b'\r\n')
+
+        with client, reader:
+            say('* OK stub ready')
+            for line in reader:
+                tag, _, rest = line.decode().rstrip('\r\n').partition(' ')
+                command, _, args = rest.partition(' ')
+                command = command.upper()
+                if command == 'UID':
+                    command, _, args = args.partition(' ')
+                    command = command.upper()
+                self.commands.append(command)
+                if command in self.hang:
+                    self._closed.wait()
+                    return
+                if command == 'CAPABILITY':
+                    say(f'* CAPABILITY {self.capabilities}')
+                elif command in ('SELECT', 'EXAMINE'):
+                    if args.strip('"') not in self.folders:
+                        say(f'{tag} NO [NONEXISTENT] Unknown mailbox')
+                        continue
+                    say('* 1 EXISTS')
+                elif command == 'STATUS':
+                    mailbox = args.split(' (')[0]
+                    say(f'* STATUS {mailbox} (MESSAGES 1 UNSEEN 0)')
+                elif command == 'FETCH':
+                    if 'RFC822' in args:
+                        say(f'* 1 FETCH (FLAGS (\\Seen) RFC822 {{{len(MESSAGE)}}}')
+                        client.sendall(MESSAGE + b')\r\n')
+                    else:
+                        say('* 1 FETCH (FLAGS (\\Seen))')
+                elif command == 'APPEND':
+                    m = _APPEND_RE.match(args)
+                    size, plus = int(m.group(2)), m.group(3)
+                    if not plus:
+                        say('+ go ahead')
+                    literal = reader.read(size)
+                    reader.readline()
+                    self.appended.append((m.group(1).strip('"'), literal, not plus))
+                elif command == 'LOGOUT':
+                    say('* BYE stub closing')
+                    say(f'{tag} OK LOGOUT completed')
+                    return
+                elif command not in ('LOGIN', 'NOOP', 'STORE', 'EXPUNGE', 'UNSELECT'):
+                    say(f'{tag} BAD unknown command')
+                    continue
+                say(f'{tag} OK {command} completed')
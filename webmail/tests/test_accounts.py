@@ -0,0 +1,55 @@
+"""
+ProMail — cached account snapshots follow changes made by other workers
+Changes are written with Core statements, which fire no ORM hooks and so no
+broadcast: exactly what a worker without Redis sees when another one commits.
+"""
+
+from datetime import datetime
+
+import pytest
+
+import accounts
+from models import db, Account
+
+table = Account.__table__
+
+
+@pytest.fixture
+def account_id(app, create_account, monkeypatch, request):
+    monkeypatch.setitem(accounts._settings, 'poll_interval', 0)
+    account_id = create_account(f'{request.node.name[5:25]}@accounts.test', is_admin=True)
+    with app.app_context():
+        accounts.get(account_id)  # cached, and the poll has a watermark
+    return account_id
+
+
+def change(app, account_id, **values):
+    with app.app_context(), db.engine.begin() as conn:
+        conn.execute(table.update().where(table.c.id == account_id).values(**values))
+
+
+def test_deactivation_reaches_cached_snapshot(app, account_id):
+    change(app, account_id, active=False)
+    with app.app_context():
+        assert accounts.get(account_id).is_active is False
+
+
+def test_admin_removal_reaches_cached_snapshot(app, account_id):
+    change(app, account_id, is_admin=False)
+    with app.app_context():
+        assert accounts.get(account_id).is_admin is False
+
+
+def test_deleted_account_is_dropped(app, account_id):
+    with app.app_context(), db.engine.begin() as conn:
+        conn.execute(table.delete().where(table.c.id == account_id))
+    with app.app_context():
+        assert accounts.get(account_id) is None
+
+
+def test_last_login_stamp_keeps_snapshot(app, account_id):
+    with app.app_context():
+        before = accounts.get(account_id)
+    change(app, account_id, last_login=datetime.utcnow())
+    with app.app_context():
+        assert accounts.get(account_id) is before
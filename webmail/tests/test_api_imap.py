@@ -0,0 +1,75 @@
+"""
+ProMail — mail endpoints hand their IMAP connection back on every path
+"""
+
+import time
+
+import pytest
+
+import mailpool, metrics, resilience, warmup
+from imapstub import StubIMAP
+
+EMAIL = 'imap@imap.test'
+
+
+def in_use():
+    return metrics.collect().get('promail_imap_pool_in_use', {}).get(('', ()), 0)
+
+
+@pytest.fixture
+def server(app, monkeypatch):
+    stub = StubIMAP(folders=('INBOX',))
+    imap_pool = mailpool.ImapPool()
+    imap_pool.conn_class = mailpool.CountingIMAP4
+    monkeypatch.setattr(mailpool, 'pool', imap_pool)
+    monkeypatch.setitem(app.config, 'MAIL_SERVER', '127.0.0.1')
+    monkeypatch.setitem(app.config, 'IMAP_PORT', stub.port)
+    yield stub
+    stub.close()
+
+
+@pytest.fixture(scope='module')
+def user(app, create_account):
+    create_account(EMAIL)
+
+
+@pytest.fixture
+def client(app, user, server, monkeypatch):
+    monkeypatch.setattr(warmup.queue, 'enqueue', lambda *args: None)
+    test_client = app.test_client()
+    assert test_client.post('/api/auth/login', json={'email': EMAIL, 'password': 'password123'}).status_code == 200
+    return test_client
+
+
+def breaker(server):
+    return resilience.breaker(f'imap:127.0.0.1:{server.port}')
+
+
+def test_error_after_checkout_releases_connection(client, server):
+    before = in_use()
+    # SELECT is refused, so the FETCH that follows raises inside the handler
+    response = client.get('/api/mail/messages/1?folder=Missing')
+    assert response.status_code == 500
+    assert in_use() == before
+    assert client.get('/api/mail/messages/1').status_code == 200
+
+
+def test_half_open_probe_is_settled_by_a_failed_request(client, server):
+    cb = breaker(server)
+    cb.state, cb.opened_at = 'open', time.monotonic() - cb.reset_timeout - 1
+    assert client.post('/api/mail/messages/1/star', json={'folder': 'Missing'}).status_code == 500
+    assert cb.state == 'closed' and not cb._probing
+    assert client.post('/api/mail/messages/1/star', json={'folder': 'INBOX'}).status_code == 200
+
+
+def test_folder_timeout_stops_the_load(client, server, monkeypatch):
+    monkeypatch.setitem(resilience._settings['timeouts'], 'imap', 0.3)
+    server.hang.add('STATUS')
+    before = in_use()
+    response = client.get('/api/mail/folders')
+    assert response.status_code == 200
+    assert all(f['count'] == 0 for f in response.get_json()['folders'])
+    assert server.commands.count('STATUS') == 1
+    assert in_use() == before
+    assert not mailpool.pool._idle.get(('127.0.0.1', server.port, EMAIL))
+    assert breaker(server).failures == 1
@@ -0,0 +1,50 @@
+"""
+ProMail — IMAP pool against a stub server
+"""
+
+import pytest
+
+import mailpool
+from imapstub import StubIMAP
+
+RAW = b'From: alice@example.com\r\nSubject: hello\r\n\r\nbody\r\n'
+
+
+@pytest.fixture
+def server():
+    stub = StubIMAP()
+    yield stub
+    stub.close()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    imap_pool = mailpool.ImapPool()
+    imap_pool.conn_class = mailpool.CountingIMAP4
+    monkeypatch.setattr(mailpool, 'pool', imap_pool)
+    return imap_pool
+
+
+def test_append_uses_literal_plus(server, pool):
+    conn = pool.acquire('127.0.0.1', server.port, 'alice@example.com', 'secret', timeout=5)
+    assert 'LITERAL+' in conn.capabilities
+    typ, _ = mailpool.append_message(conn, 'Sent', RAW)
+    assert typ == 'OK'
+    assert server.appended == [('Sent', RAW, False)]
+    # The tagged reply was consumed, so the session is still in step
+    assert conn.noop()[0] == 'OK'
+    pool.release(conn)
+
+
+def test_append_without_literal_plus(server, pool):
+    server.capabilities = 'IMAP4rev1'
+    conn = pool.acquire('127.0.0.1', server.port, 'alice@example.com', 'secret', timeout=5)
+    assert mailpool.append_message(conn, 'Sent', RAW)[0] == 'OK'
+    assert server.appended == [('Sent', RAW, True)]
+    pool.release(conn)
+
+
+def test_store_sent_copy(server, pool, caplog):
+    mailpool.store_sent_copy('127.0.0.1', server.port, 'alice@example.com', 'secret', RAW)
+    assert server.appended == [('Sent', RAW, False)]
+    assert 'SENT_APPEND_FAILED' not in caplog.text
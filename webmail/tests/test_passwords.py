@@ -0,0 +1,89 @@
+"""
+ProMail — bcrypt pool admission
+"""
+
+import fcntl, os, subprocess, sys, threading, time
+
+import pytest
+
+import passwords
+from passwords import HashPool, Overloaded
+
+WEBMAIL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# A second "gunicorn worker": fills its own pool with hashes that block until stdin closes
+HOLDER = '''
+import sys, threading
+sys.path.insert(0, sys.argv[1])
+from passwords import HashPool
+pool = HashPool(workers=1, max_queue=1, slot_dir=sys.argv[2], timeout=60)
+release = threading.Event()
+for _ in range(2):
+    threading.Thread(target=pool._run, args=(release.wait,)).start()
+while pool.depth < 2:
+    pass
+print('ready', flush=True)
+sys.stdin.read()
+release.set()
+'''
+
+
+def wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def fill(pool, count):
+    release = threading.Event()
+    threads = [threading.Thread(target=pool._run, args=(release.wait,)) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: pool.depth == count)
+    return release, threads
+
+
+def test_rejects_once_queue_is_full():
+    pool = HashPool(workers=1, max_queue=1, timeout=5)
+    release, threads = fill(pool, 2)
+    with pytest.raises(Overloaded):
+        pool._run(lambda: None)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert pool.stats()['rejected'] == 1
+    assert pool._run(lambda: 'ok') == 'ok'
+
+
+def test_queue_is_shared_with_other_processes(tmp_path):
+    holder = subprocess.Popen([sys.executable, '-c', HOLDER, WEBMAIL_DIR, str(tmp_path)],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == 'ready'
+        pool = HashPool(workers=1, max_queue=1, slot_dir=str(tmp_path), timeout=5)
+        with pytest.raises(Overloaded):
+            pool._run(lambda: None)
+    finally:
+        holder.stdin.close()
+        holder.wait(timeout=10)
+    # The holder's slots are free again once it is gone
+    assert pool._run(lambda: 'ok') == 'ok'
+
+
+def test_login_gets_503_when_host_queue_is_full(app, create_account, tmp_path, monkeypatch):
+    create_account('hash@hash.test')
+    monkeypatch.setattr(passwords.pool, 'slot_dir', str(tmp_path))
+    held = []
+    for n in range(passwords.pool.workers + passwords.pool.max_queue):
+        fd = os.open(tmp_path / f'{n}.lock', os.O_RDWR | os.O_CREAT)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        held.append(fd)
+    try:
+        response = app.test_client().post('/api/auth/login',
+                                          json={'email': 'hash@hash.test', 'password': 'password123'})
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '2'
+    finally:
+        for fd in held:
+            os.close(fd)
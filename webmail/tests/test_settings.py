@@ -0,0 +1,43 @@
+"""
+ProMail — settings changes reach workers that never hear the broadcast
+"""
+
+import pytest
+
+import settings
+
+
+@pytest.fixture
+def worker(app):
+    """A second worker's registry: same database, no broadcast subscription, no shared cache."""
+    other = settings.SettingsRegistry(poll_interval=0, max_age=300)
+    other.app = app
+    return other
+
+
+def test_update_is_seen_by_another_worker(worker):
+    settings.update({'spam_threshold': 5.0})
+    assert worker.get('spam_threshold') == 5.0
+    reloads = worker.reloads
+    settings.update({'spam_threshold': 7.5})
+    assert worker.get('spam_threshold') == 7.5
+    # Picked up by the incremental poll, not a full reload
+    assert worker.reloads == reloads
+
+
+def test_writes_in_the_same_second_are_not_missed(worker):
+    settings.update({'system_name': 'first'})
+    assert worker.get('system_name') == 'first'
+    settings.update({'system_name': 'second', 'rate_limit_per_hour': 42})
+    assert worker.get('system_name') == 'second'
+    assert worker.get('rate_limit_per_hour') == 42
+
+
+def test_poll_waits_for_its_interval(worker):
+    settings.update({'default_quota': 100})
+    worker.poll_interval = 3600
+    assert worker.get('default_quota') == 100
+    settings.update({'default_quota': 200})
+    assert worker.get('default_quota') == 100
+    worker.poll_interval = 0
+    assert worker.get('default_quota') == 200
@@ -0,0 +1,69 @@
+"""
+ProMail — single-flight across worker processes without Redis
+"""
+
+import os, subprocess, sys, threading, time
+
+import pytest
+
+import singleflight
+
+WEBMAIL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Another worker leading the call: signals once it is inside fn, finishes when stdin closes
+LEADER = '''
+import sys
+sys.path.insert(0, sys.argv[1])
+import singleflight
+singleflight._settings['dir'] = sys.argv[2]
+
+def fn():
+    print('leading', flush=True)
+    sys.stdin.read()
+    return {'from': 'leader'}
+
+print(singleflight.do('folders:1', fn), flush=True)
+'''
+
+
+@pytest.fixture
+def directory(tmp_path, monkeypatch):
+    monkeypatch.setitem(singleflight._settings, 'dir', str(tmp_path))
+    return tmp_path
+
+
+def test_follower_in_another_process_gets_leaders_result(directory):
+    leader = subprocess.Popen([sys.executable, '-c', LEADER, WEBMAIL_DIR, str(directory)],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert leader.stdout.readline().strip() == 'leading'
+        calls, result = [], {}
+        follower = threading.Thread(target=lambda: result.update(
+            value=singleflight.do('folders:1', lambda: calls.append(1) or {'from': 'follower'})))
+        follower.start()
+        time.sleep(0.3)  # the follower is now waiting on the leader's lock
+        assert follower.is_alive()
+        leader.stdin.close()
+        follower.join(timeout=10)
+    finally:
+        leader.wait(timeout=10)
+    assert result['value'] == {'from': 'leader'}
+    assert calls == []
+
+
+def test_follower_gives_up_on_a_slow_leader(directory, monkeypatch):
+    monkeypatch.setitem(singleflight._settings, 'wait', 0.2)
+    leader = subprocess.Popen([sys.executable, '-c', LEADER, WEBMAIL_DIR, str(directory)],
+                              stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    try:
+        assert leader.stdout.readline().strip() == 'leading'
+        assert singleflight.do('folders:1', lambda: {'from': 'follower'}) == {'from': 'follower'}
+    finally:
+        leader.stdin.close()
+        leader.wait(timeout=10)
+
+
+def test_stale_result_is_not_reused(directory):
+    assert singleflight.do('folders:2', lambda: 'first') == 'first'
+    os.utime(next(directory.glob('*.result')), (0, 0))
+    assert singleflight.do('folders:2', lambda: 'second') == 'second'
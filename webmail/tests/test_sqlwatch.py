@@ -0,0 +1,53 @@
+"""
+ProMail — list endpoints must not issue one query per row
+Runs against an in-memory SQLite database with several rows behind each list,
+so a lazy relationship loaded per row shows up as a repeated statement.
+"""
+
+import pytest
+
+import passwords, sqlwatch
+from app import app
+from models import db, Domain, Account, Alias, Contact, ContactGroup
+
+
+@pytest.fixture(scope='module')
+def client():
+    passwords.pool.rounds = 4
+    with app.app_context():
+        db.create_all()
+        admin = None
+        for d in range(6):
+            domain = Domain(name=f'example{d}.com')
+            db.session.add(domain)
+            db.session.flush()
+            for n in range(2):
+                account = Account(email=f'user{n}@example{d}.com', domain_id=domain.id,
+                                  name=f'User {n}', is_admin=(d == 0 and n == 0))
+                account.set_password('password123')
+                db.session.add(account)
+                admin = admin or account
+                db.session.add(Alias(domain_id=domain.id, source=f'alias{n}@example{d}.com',
+                                     destination=f'user{n}@example{d}.com'))
+        db.session.flush()
+        contacts = [Contact(account_id=admin.id, first_name=f'Contact {n}', email=f'c{n}@example.org')
+                    for n in range(6)]
+        db.session.add_all(contacts)
+        for n in range(5):
+            db.session.add(ContactGroup(account_id=admin.id, name=f'Group {n}', contacts=contacts[n:]))
+        db.session.commit()
+        email = admin.email
+
+    test_client = app.test_client()
+    response = test_client.post('/api/auth/login', json={'email': email, 'password': 'password123'})
+    assert response.status_code == 200
+    return test_client
+
+
+def test_list_endpoints_have_no_repeated_queries(client):
+    with sqlwatch.capture() as captured:
+        for path in ('/api/admin/accounts', '/api/admin/aliases', '/api/contacts/groups'):
+            response = client.get(path)
+            assert response.status_code == 200, path
+    assert captured.count
+    captured.assert_no_repeats()
@@ -0,0 +1,41 @@
+"""
+ProMail — usage-scan only touches the accounts it was asked about
+"""
+
+import pytest
+
+import usage
+
+
+@pytest.fixture(scope='module')
+def mailboxes(create_account):
+    create_account('scanned@usage.test')
+    create_account('other@usage.test')
+
+
+@pytest.fixture
+def measured(app, mailboxes, monkeypatch):
+    seen = []
+    monkeypatch.setattr(usage, '_measure_row', lambda account, state: seen.append(account.email))
+    return seen
+
+
+def test_unknown_account_does_not_scan_everything(app, measured):
+    result = app.test_cli_runner().invoke(args=['usage-scan', '--account', 'nobody@usage.test'])
+    assert result.exit_code != 0
+    assert 'nobody@usage.test: no such account' in result.output
+    assert measured == []
+
+
+def test_unknown_addresses_are_reported_alongside_known_ones(app, measured):
+    result = app.test_cli_runner().invoke(
+        args=['usage-scan', '--account', 'scanned@usage.test', '--account', 'nobody@usage.test'])
+    assert result.exit_code == 0
+    assert 'nobody@usage.test: no such account' in result.output
+    assert measured == ['scanned@usage.test']
+
+
+def test_empty_id_list_scans_nothing(app, measured):
+    with app.app_context():
+        assert usage.scan([]) == 0
+    assert measured == []
@@ -0,0 +1,94 @@
+"""
+ProMail — login throttling
+Sliding-window failure counters per client IP, per account and per subnet,
+kept in the shared cache so limits hold across workers and nodes and can't
+be reset by dropping a cookie. Checked before any DB or bcrypt work.
+"""
+
+import ipaddress, time, logging
+
+from flask import request
+
+from cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+def client_ip():
+    """Peer address, or nginx's X-Real-IP when the request came through the local proxy."""
+    remote = request.remote_addr or ''
+    if remote in ('127.0.0.1', '::1'):
+        return request.headers.get('X-Real-IP', remote)
+    return remote
+
+
+def _subnet(ip):
+    try:
+        addr = ipaddress.ip_address(ip)
+    except ValueError:
+        return ip
+    prefix = 24 if addr.version == 4 else 64
+    return str(ipaddress.ip_network(f'{addr}/{prefix}', strict=False))
+
+
+class LoginThrottle:
+    """Two-bucket sliding window: estimate = previous * (1 - elapsed fraction) + current."""
+
+    def __init__(self, window=900, per_account=5, per_ip=20, per_subnet=100):
+        self.window = window
+        self.limits = {'account': per_account, 'ip': per_ip, 'subnet': per_subnet}
+        self.lockouts = 0
+
+    def _scopes(self, ip, email):
+        return [('ip', ip), ('account', email), ('subnet', _subnet(ip))]
+
+    def _key(self, scope, ident, index):
+        return f'lt:{scope}:{ident}:{index}'
+
+    def _window(self, now):
+        return int(now // self.window), (now % self.window) / self.window
+
+    def check(self, ip, email):
+        """Return (scope, retry_after_seconds) if the attempt must be refused, else None."""
+        index, elapsed = self._window(time.time())
+        for scope, ident in self._scopes(ip, email):
+            limit = self.limits[scope]
+            current = cache.get(self._key(scope, ident, index)) or 0
+            previous = cache.get(self._key(scope, ident, index - 1)) or 0
+            if previous * (1 - elapsed) + current < limit:
+                continue
+            if current < limit and previous:
+                # Blocked only by the decaying previous bucket: wait until it has decayed enough
+                wait = (1 - (limit - current) / previous) - elapsed
+            else:
+                wait = 1 - elapsed
+            return scope, max(1, int(wait * self.window) + 1)
+        return None
+
+    def record_failure(self, ip, email):
+        index, elapsed = self._window(time.time())
+        for scope, ident in self._scopes(ip, email):
+            limit = self.limits[scope]
+            current = cache.incr(self._key(scope, ident, index), ttl=self.window * 2)
+            previous = cache.get(self._key(scope, ident, index - 1)) or 0
+            estimate = previous * (1 - elapsed) + current
+            if estimate >= limit > estimate - 1:
+                self.lockouts += 1
+                logger.warning(f"LOGIN_LOCKED scope={scope} key={ident} ip={ip} email={email}")
+
+    def reset_account(self, email):
+        index, _ = self._window(time.time())
+        cache.delete(self._key('account', email, index))
+        cache.delete(self._key('account', email, index - 1))
+
+
+limiter = LoginThrottle()
+
+
+def init_app(app):
+    limiter.window = app.config.get('LOCKOUT_DURATION', limiter.window)
+    limiter.limits = {
+        'account': app.config.get('MAX_LOGIN_ATTEMPTS', 5),
+        'ip': app.config.get('MAX_LOGIN_ATTEMPTS_IP', 20),
+        'subnet': app.config.get('MAX_LOGIN_ATTEMPTS_SUBNET', 100),
+    }
@@ -0,0 +1,153 @@
+"""
+ProMail — API session registry and token revocation
+Every issued JWT carries a ``jti`` recorded in ``api_sessions``. Each worker
+keeps the revoked, not-yet-expired ids in a local set, so the per-request
+check rarely leaves the process. Revocations are broadcast to the other
+workers (with Redis); without it, each worker picks up rows revoked since its
+last look with one indexed query every few seconds. The full set is reloaded
+from the table periodically as a backstop.
+"""
+
+import os, secrets, threading, time, logging
+from datetime import datetime
+
+import broadcast
+from models import db, ApiSession
+
+logger = logging.getLogger(__name__)
+
+_table = ApiSession.__table__
+
+
+class RevocationList:
+    def __init__(self, refresh_interval=300, poll_interval=2.0):
+        self.refresh_interval = refresh_interval
+        self.poll_interval = poll_interval
+        self._revoked = set()
+        self._loaded_at = 0.0
+        self._polled_at = 0.0
+        self._watermark = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def __contains__(self, jti):
+        now = time.monotonic()
+        if self._pid != os.getpid() or now - self._loaded_at > self.refresh_interval:
+            self._reload()
+        elif self.poll_interval and now - self._polled_at > self.poll_interval:
+            self._poll()
+        return jti in self._revoked
+
+    def __len__(self):
+        return len(self._revoked)
+
+    def add(self, jtis):
+        self._revoked.update(jtis)
+
+    def _reload(self):
+        # One thread reloads; the rest keep answering from the current set
+        if not self._lock.acquire(blocking=self._pid != os.getpid()):
+            return
+        try:
+            now = datetime.utcnow()
+            with db.engine.begin() as conn:
+                conn.execute(_table.delete().where(_table.c.expires_at < now))
+                revoked = {row.jti for row in conn.execute(
+                    db.select(_table.c.jti)
+                    .where(_table.c.revoked_at.is_not(None), _table.c.expires_at >= now))}
+            self._revoked = revoked
+            self._watermark = now
+            self.reloads += 1
+        except Exception as e:
+            logger.warning(f"REVOCATION_RELOAD_FAILED error={e}")
+        finally:
+            # Back off a full interval even on failure; broadcasts still arrive meanwhile
+            self._pid = os.getpid()
+            self._loaded_at = self._polled_at = time.monotonic()
+            self._lock.release()
+
+    def _poll(self):
+        # Revocations made by other workers since the last look; ties on revoked_at are re-read, harmlessly
+        if self._watermark is None or not self._lock.acquire(blocking=False):
+            return
+        try:
+            with db.engine.connect() as conn:
+                rows = conn.execute(db.select(_table.c.jti, _table.c.revoked_at)
+                                    .where(_table.c.revoked_at >= self._watermark)).all()
+            if rows:
+                self._revoked.update(row.jti for row in rows)
+                self._watermark = max(row.revoked_at for row in rows)
+        except Exception as e:
+            logger.warning(f"REVOCATION_POLL_FAILED error={e}")
+        finally:
+            self._polled_at = time.monotonic()
+            self._lock.release()
+
+
+revoked = RevocationList()
+broadcast.subscribe('tokens', revoked.add)
+
+
+def issue(account_id, expires_at, ip_address=None, user_agent=None):
+    """Register a new API session and return its jti."""
+    jti = secrets.token_hex(16)
+    with db.engine.begin() as conn:
+        conn.execute(_table.insert().values(
+            jti=jti, account_id=account_id, ip_address=ip_address,
+            user_agent=(user_agent or '')[:500], created_at=datetime.utcnow(),
+            expires_at=expires_at))
+    return jti
+
+
+def is_revoked(jti):
+    return jti in revoked
+
+
+def revoke(jti, account_id=None):
+    """Revoke one session (optionally only if it belongs to ``account_id``); returns True if it was active."""
+    query = _table.update().where(_table.c.jti == jti, _table.c.revoked_at.is_(None))
+    if account_id is not None:
+        query = query.where(_table.c.account_id == account_id)
+    with db.engine.begin() as conn:
+        changed = conn.execute(query.values(revoked_at=datetime.utcnow())).rowcount
+    if changed:
+        broadcast.publish('tokens', [jti])
+    return bool(changed)
+
+
+def revoke_account(account_id):
+    """Revoke every live session of an account; returns how many were revoked."""
+    now = datetime.utcnow()
+    live = (_table.c.account_id == account_id) & _table.c.revoked_at.is_(None) & (_table.c.expires_at >= now)
+    with db.engine.begin() as conn:
+        jtis = [row.jti for row in conn.execute(db.select(_table.c.jti).where(live))]
+        if jtis:
+            conn.execute(_table.update().where(_table.c.jti.in_(jtis)).values(revoked_at=now))
+    if jtis:
+        broadcast.publish('tokens', jtis)
+        logger.info(f"SESSIONS_REVOKED account_id={account_id} count={len(jtis)}")
+    return len(jtis)
+
+
+def active_sessions(account_id):
+    now = datetime.utcnow()
+    with db.engine.connect() as conn:
+        rows = conn.execute(
+            _table.select()
+            .where(_table.c.account_id == account_id, _table.c.revoked_at.is_(None),
+                   _table.c.expires_at >= now)
+            .order_by(_table.c.created_at.desc())).all()
+    return [
+        {
+            'jti': r.jti, 'ip_address': r.ip_address or '', 'user_agent': r.user_agent or '',
+            'created_at': r.created_at.isoformat() if r.created_at else '',
+            'expires_at': r.expires_at.isoformat(),
+        }
+        for r in rows
+    ]
+
+
+def init_app(app):
+    revoked.refresh_interval = app.config.get('TOKEN_REVOCATION_REFRESH', revoked.refresh_interval)
+    revoked.poll_interval = app.config.get('TOKEN_REVOCATION_POLL', revoked.poll_interval)
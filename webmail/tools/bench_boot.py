@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Measure application boot time and per-worker memory under gunicorn.
+
+Boot time is the wall time of ``import app`` in a fresh interpreter (median
+of --runs). For memory, gunicorn is started with and without --preload; once
+every worker answers, a few requests are sent and Rss/Pss/private memory is
+read from /proc/<pid>/smaps_rollup for the master and each worker.
+
+    DATABASE_URL=sqlite:////tmp/promail-bench.db python tools/bench_boot.py --workers 4
+
+Use --app-dir to point at another checkout for a before/after comparison.
+"""
+
+import argparse, os, socket, statistics, subprocess, sys, time, urllib.request, urllib.error
+
+WEBMAIL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+IMPORT_SNIPPET = 'import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)'
+
+
+def boot_time(app_dir, runs):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=app_dir,
+                             capture_output=True, text=True, check=True).stdout
+        samples.append(float(out.strip().splitlines()[-1]))
+    return statistics.median(samples), min(samples), max(samples)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as fh:
+            return [int(p) for p in fh.read().split()]
+    except OSError:
+        return []
+
+
+def smaps(pid):
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as fh:
+        for line in fh:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss': fields.get('Rss', 0),
+        'pss': fields.get('Pss', 0),
+        'uss': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0),
+    }
+
+
+def get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as resp:
+            return resp.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def gunicorn_memory(app_dir, workers, preload, requests):
+    port = free_port()
+    cmd = [sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+           '--bind', f'127.0.0.1:{port}', '--log-level', 'warning']
+    if preload:
+        cmd.append('--preload')
+    started = time.perf_counter()
+    proc = subprocess.Popen(cmd + ['app:app'], cwd=app_dir,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.time() + 60
+        while True:
+            if time.time() > deadline or proc.poll() is not None:
+                raise RuntimeError('gunicorn did not come up')
+            try:
+                if len(children(proc.pid)) == workers and get(f'http://127.0.0.1:{port}/api/auth/me'):
+                    break
+            except OSError:
+                pass
+            time.sleep(0.05)
+        ready = time.perf_counter() - started
+        for i in range(requests):
+            get(f'http://127.0.0.1:{port}/api/auth/me')
+            get(f'http://127.0.0.1:{port}/auth/login')
+        time.sleep(0.5)
+        master = smaps(proc.pid)
+        per_worker = [smaps(pid) for pid in children(proc.pid)]
+    finally:
+        proc.terminate()
+        proc.wait(10)
+    return ready, master, per_worker
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--app-dir', default=WEBMAIL_DIR)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+    app_dir = os.path.abspath(args.app_dir)
+
+    median, low, high = boot_time(app_dir, args.runs)
+    print(f'import app: median {median * 1000:.0f} ms (min {low * 1000:.0f}, max {high * 1000:.0f})')
+
+    print(f"{'mode':<10} {'ready':>8} {'worker rss':>11} {'worker pss':>11} "
+          f"{'worker uss':>11} {'total pss':>10}")
+    for preload in (False, True):
+        ready, master, per_worker = gunicorn_memory(app_dir, args.workers, preload, args.requests)
+        avg = {k: statistics.mean(w[k] for w in per_worker) / 1024 for k in ('rss', 'pss', 'uss')}
+        total = (master['pss'] + sum(w['pss'] for w in per_worker)) / 1024
+        print(f"{'preload' if preload else 'fork':<10} {ready * 1000:>6.0f}ms {avg['rss']:>9.1f}MB "
+              f"{avg['pss']:>9.1f}MB {avg['uss']:>9.1f}MB {total:>8.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
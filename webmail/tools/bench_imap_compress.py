@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Benchmark IMAP COMPRESS=DEFLATE against a local dovecot stand-in.
+
+Starts a minimal IMAP server on localhost that answers LIST/SELECT/SEARCH/FETCH
+with realistic payloads over a throttled link, then runs the same mailbox
+workload through the pool's connection class with and without compression.
+
+    python tools/bench_imap_compress.py --messages 2000 --pages 4 --kbps 8000
+"""
+
+import argparse, os, socket, sys, threading, time, zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from mailpool import CountingIMAP4, refresh_capabilities  # noqa: E402
+
+CAPS = b'IMAP4rev1 LITERAL+ UNSELECT COMPRESS=DEFLATE'
+
+HEADER = (
+    'Return-Path: <sender{i}@example.org>\r\n'
+    'Delivered-To: bench@example.com\r\n'
+    'Received: from mx.example.org (mx.example.org [203.0.113.{o}])\r\n'
+    '\tby mail.example.com (Postfix) with ESMTPS id 4T{i:06d}X\r\n'
+    '\tfor <bench@example.com>; Mon, 14 Oct 2024 09:{m:02d}:11 +0000 (UTC)\r\n'
+    'DKIM-Signature: v=1; a=rsa-sha256; c=relaxed/relaxed; d=example.org; s=mail;\r\n'
+    '\th=from:to:subject:date:message-id; bh=47DEQpj8HBSa+/TImW+5JCeuQeRkm5NMpJWZG3hSuFU=;\r\n'
+    '\tb=Zm9vYmFyYmF6cXV4{i:08d}cXV1eGZvb2Jhcg==\r\n'
+    'From: "Sender {i}" <sender{i}@example.org>\r\n'
+    'To: bench@example.com\r\n'
+    'Subject: Quarterly report follow-up #{i}\r\n'
+    'Date: Mon, 14 Oct 2024 09:{m:02d}:11 +0000\r\n'
+    'Message-ID: <{i}.bench@example.org>\r\n'
+    'MIME-Version: 1.0\r\n'
+    'Content-Type: multipart/alternative; boundary="b{i}"\r\n'
+    '\r\n'
+)
+
+
+class StandInServer(threading.Thread):
+    """Just enough IMAP4rev1 (+COMPRESS) to drive imaplib through a mailbox workload."""
+
+    def __init__(self, messages, kbps):
+        super().__init__(daemon=True)
+        self.messages = messages
+        self.kbps = kbps
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(8)
+        self.port = self.sock.getsockname()[1]
+
+    def run(self):
+        while True:
+            client, _ = self.sock.accept()
+            threading.Thread(target=self.serve, args=(client,), daemon=True).start()
+
+    def serve(self, client):
+        state = {'comp': None, 'decomp': None, 'buf': b''}
+
+        def send(data):
+            if state['comp']:
+                data = state['comp'].compress(data) + state['comp'].flush(zlib.Z_SYNC_FLUSH)
+            if self.kbps:
+                time.sleep(len(data) * 8 / (self.kbps * 1000))
+            client.sendall(data)
+
+        def readline():
+            while b'\n' not in state['buf']:
+                chunk = client.recv(65536)
+                if not chunk:
+                    return None
+                state['buf'] += state['decomp'].decompress(chunk) if state['decomp'] else chunk
+            line, _, state['buf'] = state['buf'].partition(b'\n')
+            return line.rstrip(b'\r')
+
+        send(b'* OK [CAPABILITY ' + CAPS + b'] stand-in ready\r\n')
+        while True:
+            line = readline()
+            if line is None:
+                break
+            tag, cmd, *rest = line.split(b' ', 2) + [b'']
+            cmd = cmd.upper()
+            args = rest[0]
+            if cmd == b'LOGIN':
+                send(tag + b' OK [CAPABILITY ' + CAPS + b'] Logged in\r\n')
+            elif cmd == b'CAPABILITY':
+                send(b'* CAPABILITY ' + CAPS + b'\r\n' + tag + b' OK done\r\n')
+            elif cmd == b'COMPRESS':
+                send(tag + b' OK DEFLATE active\r\n')
+                state['comp'] = zlib.compressobj(6, zlib.DEFLATED, -15)
+                state['decomp'] = zlib.decompressobj(-15)
+            elif cmd == b'LIST':
+                out = b''.join(
+                    b'* LIST (\\HasNoChildren) "." "Projects.Client%03d"\r\n' % n for n in range(200))
+                send(out + tag + b' OK List completed\r\n')
+            elif cmd in (b'SELECT', b'EXAMINE'):
+                send(b'* %d EXISTS\r\n* OK [UIDVALIDITY 1]\r\n%s OK [READ-WRITE] done\r\n'
+                     % (self.messages, tag))
+            elif cmd == b'SEARCH':
+                ids = b' '.join(str(n).encode() for n in range(1, self.messages + 1))
+                send(b'* SEARCH ' + ids + b'\r\n' + tag + b' OK Search completed\r\n')
+            elif cmd == b'FETCH':
+                lo, _, hi = args.split(b' ', 1)[0].partition(b':')
+                out = []
+                for n in range(int(lo), min(int(hi or lo), self.messages) + 1):
+                    hdr = HEADER.format(i=n, o=n % 250, m=n % 60).encode()
+                    out.append(b'* %d FETCH (FLAGS (\\Seen) BODY[HEADER] {%d}\r\n%s)\r\n'
+                               % (n, len(hdr), hdr))
+                send(b''.join(out) + tag + b' OK Fetch completed\r\n')
+            elif cmd in (b'NOOP', b'UNSELECT'):
+                send(tag + b' OK done\r\n')
+            elif cmd == b'LOGOUT':
+                send(b'* BYE Logging out\r\n' + tag + b' OK Logout completed\r\n')
+                break
+            else:
+                send(tag + b' BAD unknown command\r\n')
+        client.close()
+
+
+def run_workload(port, compress, pages, per_page):
+    started = time.perf_counter()
+    conn = CountingIMAP4('127.0.0.1', port)
+    conn.login('bench@example.com', 'secret')
+    refresh_capabilities(conn)
+    if compress:
+        conn.enable_compression()
+    conn.list()
+    conn.select('INBOX')
+    conn.search(None, 'ALL')
+    for p in range(pages):
+        conn.fetch(f'{p * per_page + 1}:{(p + 1) * per_page}', '(FLAGS BODY.PEEK[HEADER])')
+    counters = conn.byte_counters()
+    conn.logout()
+    counters['elapsed_ms'] = (time.perf_counter() - started) * 1000
+    return counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--pages', type=int, default=4)
+    parser.add_argument('--per-page', type=int, default=50)
+    parser.add_argument('--kbps', type=int, default=8000,
+                        help='simulated link bandwidth between web and storage node (0 = unthrottled)')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    server = StandInServer(args.messages, args.kbps)
+    server.start()
+
+    print(f"{'mode':<10} {'in raw':>10} {'in wire':>10} {'ratio':>7} {'out wire':>9} {'ms':>9}")
+    for compress in (False, True):
+        runs = [run_workload(server.port, compress, args.pages, args.per_page)
+                for _ in range(args.rounds)]
+        best = min(runs, key=lambda r: r['elapsed_ms'])
+        ratio = best['in_raw'] / best['in_wire'] if best['in_wire'] else 0
+        print(f"{'deflate' if compress else 'plain':<10} {best['in_raw']:>10} {best['in_wire']:>10} "
+              f"{ratio:>6.1f}x {best['out_wire']:>9} {best['elapsed_ms']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
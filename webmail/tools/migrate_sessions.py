@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Copy Flask-Session filesystem sessions into the configured session store.
+
+Flask-Session names each file md5(SESSION_KEY_PREFIX + sid), so entries are
+stored under that hash and re-keyed the first time their cookie comes back.
+Expired files are skipped; with --delete every processed file is removed.
+
+    SESSION_TYPE=redis python tools/migrate_sessions.py --source sessions --delete
+"""
+
+import argparse, os, pickle, struct, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app import app  # noqa: E402
+import sessions  # noqa: E402
+
+HEADER = struct.Struct('I')  # cachelib FileSystemCache: absolute expiry, 0 = never
+
+
+def read_entry(path):
+    with open(path, 'rb') as fh:
+        expires = HEADER.unpack(fh.read(HEADER.size))[0]
+        # Files written by our own Flask-Session instance; not untrusted input
+        return expires, pickle.load(fh)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--source', default=app.config['SESSION_FILE_DIR'])
+    parser.add_argument('--to', choices=('redis', 'sqlalchemy'), default=None,
+                        help='target store (default: SESSION_TYPE)')
+    parser.add_argument('--delete', action='store_true', help='remove files after copying')
+    args = parser.parse_args()
+
+    copied = expired = failed = 0
+    now = int(time.time())
+    max_ttl = int(app.permanent_session_lifetime.total_seconds())
+    serializer = sessions.ServerSessionInterface.serializer
+
+    with app.app_context():
+        store = sessions.build_store(app, args.to or app.config.get('SESSION_TYPE'))
+        print(f'target: {type(store).__name__}')
+        for entry in os.scandir(args.source):
+            if not entry.is_file() or entry.name.startswith('__wz_cache') or len(entry.name) != 32:
+                continue
+            try:
+                expires, data = read_entry(entry.path)
+                ttl = min(max_ttl, expires - now) if expires else max_ttl
+                if ttl <= 0 or not data:
+                    expired += 1
+                else:
+                    store.save(sessions.LEGACY_PREFIX + entry.name, serializer.dumps(dict(data)), ttl)
+                    copied += 1
+            except Exception as e:
+                failed += 1
+                print(f'skip {entry.name}: {e}', file=sys.stderr)
+                continue
+            if args.delete:
+                os.remove(entry.path)
+
+    print(f'copied={copied} expired={expired} failed={failed}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,267 @@
+"""
+ProMail — mailbox storage usage
+``flask usage-scan`` (run from cron by a user that can read the mail store)
+measures every mailbox and stores the result in mailbox_usage. Dovecot's own
+numbers are preferred: the maildir quota backend's ``maildirsize`` file, or
+GETQUOTAROOT over a pooled IMAP connection when the store isn't readable.
+Otherwise the Maildir is walked with os.scandir, re-listing only directories
+whose mtime changed since the previous scan. Request paths only read the
+stored rows.
+"""
+
+import os, re, json, logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+from sqlalchemy import bindparam, func, select
+
+import maildirs, mailpool
+from cache import cache
+from models import db, Account, Domain, MailboxUsage, _cipher
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+MESSAGE_DIRS = ('cur', 'new')
+
+_SIZE_RE = re.compile(r',S=(\d+)')
+_STORAGE_RE = re.compile(r'STORAGE (\d+) (\d+)')
+_MESSAGE_RE = re.compile(r'MESSAGE (\d+) (\d+)')
+
+_settings = {'source': 'auto', 'workers': 4, 'cache_ttl': 60,
+             'imap_host': '127.0.0.1', 'imap_port': 993}
+
+
+# ── measuring ──
+
+def read_maildirsize(maildir):
+    """(bytes, messages) from dovecot's maildirsize, or None if there isn't a usable one."""
+    try:
+        with open(os.path.join(maildir, 'maildirsize')) as fh:
+            lines = fh.read().splitlines()
+    except OSError:
+        return None
+    size = count = 0
+    for line in lines[1:]:  # the first line is the quota definition
+        parts = line.split()
+        if len(parts) < 2:
+            continue
+        try:
+            size += int(parts[0])
+            count += int(parts[1])
+        except ValueError:
+            return None
+    return max(size, 0), max(count, 0)
+
+
+def walk(maildir, state=None):
+    """(bytes, messages, state) for a Maildir tree.
+
+    ``state`` maps each directory to [mtime_ns, bytes, messages, subdirs] from
+    the previous walk; a directory whose mtime hasn't moved is reused without
+    listing it. Sizes come from the ``,S=`` part of the file name when present.
+    """
+    state = state or {}
+    new_state, total_size, total_count = {}, 0, 0
+    pending = ['']
+    while pending:
+        rel = pending.pop()
+        path = os.path.join(maildir, rel)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        known = state.get(rel)
+        if known and known[0] == mtime:
+            _, size, count, children = known
+        else:
+            size = count = 0
+            children = []
+            counted = os.path.basename(rel) in MESSAGE_DIRS
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            children.append(os.path.join(rel, entry.name))
+                        elif counted:
+                            match = _SIZE_RE.search(entry.name)
+                            try:
+                                size += int(match.group(1)) if match else entry.stat(follow_symlinks=False).st_size
+                            except FileNotFoundError:
+                                continue  # expunged while we looked
+                            count += 1
+            except FileNotFoundError:
+                continue
+        new_state[rel] = [mtime, size, count, children]
+        total_size += size
+        total_count += count
+        pending.extend(children)
+    return total_size, total_count, new_state
+
+
+def imap_quota(email, password):
+    """(bytes, messages) from GETQUOTAROOT INBOX, or None if the server reports no quota."""
+    with mailpool.pool.connection(_settings['imap_host'], _settings['imap_port'], email, password) as conn:
+        typ, data = conn.getquotaroot('INBOX')
+    if typ != 'OK':
+        return None
+    text = ' '.join(str(part) for chunk in data for part in (chunk if isinstance(chunk, list) else [chunk]))
+    storage, messages = _STORAGE_RE.search(text), _MESSAGE_RE.search(text)
+    if not storage:
+        return None
+    return int(storage.group(1)) * 1024, int(messages.group(1)) if messages else 0
+
+
+def measure(email, state=None, password=None):
+    """(bytes, messages, state, source) for one mailbox, or None if it can't be measured."""
+    source = _settings['source']
+    if source in ('auto', 'disk'):
+        maildir = os.path.join(maildirs.mailbox_path(email), 'Maildir')
+        found = read_maildirsize(maildir)
+        if found:
+            return found + (None, 'maildirsize')
+        if os.path.isdir(maildir):
+            return walk(maildir, state) + ('walk',)
+        if source == 'disk':
+            return None
+    if password is None:
+        return None
+    found = imap_quota(email, password() if callable(password) else password)
+    return found + (None, 'imap') if found else None
+
+
+# ── scanning ──
+
+def _measure_row(account, raw_state):
+    def password():
+        return _cipher().decrypt(account.encrypted_password.encode()).decode() if account.encrypted_password else ''
+
+    try:
+        result = measure(account.email, json.loads(raw_state) if raw_state else None, password)
+    except Exception as e:
+        logger.warning(f"USAGE_SCAN_FAILED email={account.email} error={e}")
+        return None
+    if result is None:
+        return None
+    size, count, state, source = result
+    return {'b_id': account.id, 'b_domain': account.domain_id, 'b_bytes': size, 'b_messages': count,
+            'b_source': source, 'b_state': json.dumps(state, separators=(',', ':')) if state else None,
+            'b_at': datetime.utcnow()}
+
+
+def scan(account_ids=None, batch_size=500):
+    """Measure mailboxes (all active ones when ``account_ids`` is None) and store the results; returns how many were stored."""
+    table = MailboxUsage.__table__
+    query = select(Account.id, Account.email, Account.domain_id, Account.encrypted_password).order_by(Account.id)
+    if account_ids is not None:
+        query = query.where(Account.id.in_(account_ids))
+    else:
+        query = query.where(Account.active.is_(True))
+    with db.engine.connect() as conn:
+        accounts = conn.execute(query).all()
+
+    columns = dict(domain_id=bindparam('b_domain'), bytes=bindparam('b_bytes'), messages=bindparam('b_messages'),
+                   source=bindparam('b_source'), scan_state=bindparam('b_state'), scanned_at=bindparam('b_at'))
+    stored = 0
+    with ThreadPoolExecutor(max_workers=_settings['workers'], thread_name_prefix='promail-usage') as executor:
+        # Batches keep only a slice of the walker state in memory at a time
+        for start in range(0, len(accounts), batch_size):
+            batch = accounts[start:start + batch_size]
+            with db.engine.connect() as conn:
+                states = dict(conn.execute(select(table.c.account_id, table.c.scan_state)
+                                           .where(table.c.account_id.in_([a.id for a in batch]))).all())
+            rows = [r for r in executor.map(lambda a: _measure_row(a, states.get(a.id)), batch) if r]
+            updates = [r for r in rows if r['b_id'] in states]
+            inserts = [r for r in rows if r['b_id'] not in states]
+            with db.engine.begin() as conn:
+                if updates:
+                    conn.execute(table.update().where(table.c.account_id == bindparam('b_id')).values(**columns),
+                                 updates)
+                if inserts:
+                    conn.execute(table.insert().values(account_id=bindparam('b_id'), **columns), inserts)
+            for row in rows:
+                cache.delete(f"usage:{row['b_id']}")
+            stored += len(rows)
+    cache.delete('usage:domains')
+    logger.info(f"USAGE_SCANNED accounts={len(accounts)} stored={stored}")
+    return stored
+
+
+# ── reading ──
+
+def _with_quota(size, messages, quota_mb):
+    quota = (quota_mb or 0) * MB
+    return {'bytes': size, 'messages': messages, 'quota_bytes': quota or None,
+            'percent': round(size * 100 / quota, 1) if quota else None}
+
+
+def for_account(account_id, quota_mb):
+    """Stored usage for one account (cached), or None if it hasn't been scanned yet."""
+    key = f'usage:{account_id}'
+    hit = cache.get(key)
+    if hit is None:
+        row = db.session.get(MailboxUsage, account_id)
+        hit = {'bytes': row.bytes, 'messages': row.messages, 'source': row.source,
+               'scanned_at': row.scanned_at.isoformat() if row.scanned_at else None} if row else {}
+        cache.set(key, hit, ttl=_settings['cache_ttl'])
+    if not hit:
+        return None
+    return dict(_with_quota(hit['bytes'], hit['messages'], quota_mb),
+                source=hit['source'], scanned_at=hit['scanned_at'])
+
+
+def accounts_usage(domain=None, min_percent=None, limit=100):
+    """Accounts with stored usage, fullest (relative to quota) first."""
+    percent = (MailboxUsage.bytes * 100.0 / func.nullif(Account.quota * MB, 0)).label('percent')
+    query = (db.session.query(Account.id, Account.email, Account.quota, Domain.name, MailboxUsage.bytes,
+                              MailboxUsage.messages, MailboxUsage.scanned_at, percent)
+             .join(MailboxUsage, MailboxUsage.account_id == Account.id)
+             .join(Domain, Domain.id == Account.domain_id))
+    if domain:
+        query = query.filter(Domain.name == domain)
+    if min_percent is not None:
+        query = query.filter(percent >= min_percent)
+    rows = query.order_by(percent.desc(), MailboxUsage.bytes.desc()).limit(limit).all()
+    return [dict(_with_quota(r.bytes, r.messages, r.quota), account_id=r.id, email=r.email, domain=r.name,
+                 scanned_at=r.scanned_at.isoformat() if r.scanned_at else None) for r in rows]
+
+
+def domain_totals():
+    """Per-domain stored usage against the quota allocated to its accounts (cached)."""
+    hit = cache.get('usage:domains')
+    if hit is not None:
+        return hit
+    rows = (db.session.query(Domain.id, Domain.name, func.count(Account.id), func.sum(Account.quota),
+                             func.sum(MailboxUsage.bytes), func.sum(MailboxUsage.messages),
+                             func.count(MailboxUsage.account_id))
+            .outerjoin(Account, Account.domain_id == Domain.id)
+            .outerjoin(MailboxUsage, MailboxUsage.account_id == Account.id)
+            .group_by(Domain.id, Domain.name).order_by(Domain.name).all())
+    totals = [dict(_with_quota(int(size or 0), int(messages or 0), int(quota or 0)),
+                   domain_id=domain_id, domain=name, accounts=accounts, scanned_accounts=scanned)
+              for domain_id, name, accounts, quota, size, messages, scanned in rows]
+    cache.set('usage:domains', totals, ttl=_settings['cache_ttl'])
+    return totals
+
+
+def init_app(app):
+    for key, name in (('source', 'USAGE_SOURCE'), ('workers', 'USAGE_SCAN_WORKERS'),
+                      ('cache_ttl', 'USAGE_CACHE_TTL'), ('imap_host', 'MAIL_SERVER'), ('imap_port', 'IMAP_PORT')):
+        _settings[key] = app.config.get(name, _settings[key])
+
+    @app.cli.command('usage-scan')
+    @click.option('--account', 'emails', multiple=True, help='Only scan these addresses.')
+    def scan_command(emails):
+        """Measure mailbox sizes and store them for the admin API and /api/auth/me."""
+        ids = None
+        if emails:
+            found = dict(db.session.execute(select(Account.email, Account.id)
+                                            .where(Account.email.in_(emails))).all())
+            for email in emails:
+                if email not in found:
+                    click.echo(f'{email}: no such account', err=True)
+            if not found:
+                raise click.ClickException('none of the given accounts exist')
+            ids = list(found.values())
+        click.echo(f'stored usage for {scan(ids)} mailboxes')
@@ -0,0 +1,64 @@
+"""
+ProMail — background mailbox warm-up
+Login enqueues a job per account that primes the IMAP pool and mail caches.
+Jobs run on a small bounded executor, are de-duplicated per account and can be
+cancelled (e.g. on logout) so a login storm never turns into an IMAP storm.
+"""
+
+import threading, logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupQueue:
+    def __init__(self, workers=2, max_pending=32):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def enqueue(self, key, fn, *args):
+        """Schedule ``fn(cancel_event, *args)``; returns False if skipped."""
+        with self._lock:
+            job = self._jobs.get(key)
+            if job and not job[0].done():
+                return False
+            if len(self._jobs) >= self.max_pending:
+                logger.info(f"WARMUP_SKIPPED key={key} pending={len(self._jobs)}")
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='promail-warmup')
+            cancel = threading.Event()
+            future = self._executor.submit(self._run, key, cancel, fn, *args)
+            self._jobs[key] = (future, cancel)
+            return True
+
+    def cancel(self, key):
+        with self._lock:
+            job = self._jobs.pop(key, None)
+        if job:
+            job[1].set()
+            job[0].cancel()
+
+    def _run(self, key, cancel, fn, *args):
+        try:
+            if not cancel.is_set():
+                fn(cancel, *args)
+        except Exception as e:
+            logger.warning(f"WARMUP_FAILED key={key} error={e}")
+        finally:
+            with self._lock:
+                job = self._jobs.get(key)
+                if job and job[1] is cancel:
+                    del self._jobs[key]
+
+
+queue = WarmupQueue()
+
+
+def init_app(app):
+    queue.workers = app.config.get('WARMUP_WORKERS', queue.workers)
+    queue.max_pending = app.config.get('WARMUP_MAX_PENDING', queue.max_pending)